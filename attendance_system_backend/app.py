@@ -7,21 +7,28 @@ import numpy as np
 import os
 import pickle
 from datetime import datetime
+from encoding_store import EncodingStore
 
 app = FastAPI()
 
 DB_PATH = "face_database"
-ENCODING_FILE = "encodings/encodings.pkl"
+ENCODING_DIR = "encodings"
+LEGACY_ENCODING_FILE = "encodings/encodings.pkl"
+
+# Template pruning (same limits as backend/utils.py)
+MAX_TEMPLATES_PER_USER = 5
+DUPLICATE_TEMPLATE_DISTANCE = 0.15
 
 os.makedirs(DB_PATH, exist_ok=True)
-os.makedirs("encodings", exist_ok=True)
 
-# Load encodings
-if os.path.exists(ENCODING_FILE):
-    with open(ENCODING_FILE, "rb") as f:
-        known_encodings, known_names = pickle.load(f)
-else:
-    known_encodings, known_names = [], []
+# Load encodings (append-only log, see encoding_store.py)
+store = EncodingStore(ENCODING_DIR)
+if not store.names and os.path.exists(LEGACY_ENCODING_FILE):
+    # First start after the switch: carry over the old pickle once
+    with open(LEGACY_ENCODING_FILE, "rb") as f:
+        store.import_legacy(*pickle.load(f))
+    print(f"[INFO] Imported {len(store.names)} encodings from {LEGACY_ENCODING_FILE}")
+known_encodings, known_names = store.encodings, store.names
 
 
 # ------------------------
@@ -79,6 +86,16 @@ async def enroll_face(
 
     face_encoding = encodings[0]
 
+    # Skip near-duplicate templates and cap templates per person
+    own = [i for i, n in enumerate(known_names) if n == name]
+    if own:
+        distances = face_recognition.face_distance([known_encodings[i] for i in own], face_encoding)
+        if distances.min() < DUPLICATE_TEMPLATE_DISTANCE:
+            return {"success": True, "message": f"{name} is already enrolled with this face"}
+        if len(own) >= MAX_TEMPLATES_PER_USER:
+            # Replace the template closest to the new one
+            store.remove(own[int(distances.argmin())])
+
     # Save image
     person_dir = os.path.join(DB_PATH, name)
     os.makedirs(person_dir, exist_ok=True)
@@ -86,12 +103,8 @@ async def enroll_face(
     img_path = os.path.join(person_dir, f"{datetime.now().timestamp()}.jpg")
     cv2.imwrite(img_path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
 
-    # Save encoding
-    known_encodings.append(face_encoding)
-    known_names.append(name)
-
-    with open(ENCODING_FILE, "wb") as f:
-        pickle.dump((known_encodings, known_names), f)
+    # Save encoding: one fixed-size record appended to the log
+    store.add(name, face_encoding)
 
     return {"success": True, "message": f"{name} enrolled successfully"}
 
@@ -0,0 +1,264 @@
+import os
+import mmap
+import zlib
+import struct
+import threading
+
+import numpy as np
+
+# Append-only face encoding store.
+#
+#   encodings/encodings.log  fixed-size records (see RECORD below)
+#   encodings/names.log      one "name_id<TAB>name" line per distinct name
+#
+# Enrolling appends one record and fsyncs it, so the cost does not grow with
+# the gallery. Removing a template appends a delete record pointing at the
+# template's seq. Both files only ever grow at the end; a crash can at worst
+# leave a torn last record/line, which is detected (length, CRC) and cut off
+# on the next open. Dead records are dropped by a background compaction that
+# rewrites the log to a temp file and swaps it in with os.replace.
+#
+# Readers that must not touch the files (the camera daemon may run while
+# app.py is enrolling) open with read_only=True: a torn tail is then only
+# skipped, and nothing is created or truncated.
+
+ENCODING_DIM = 128
+MAGIC = b"ENCLOG01"
+FILE_HEADER = struct.Struct("<8sII")  # magic, dim, reserved
+RECORD_HEADER = struct.Struct("<BxxxIII")  # op, seq, name_id, crc
+RECORD_SIZE = RECORD_HEADER.size + ENCODING_DIM * 8
+RECORD = np.dtype([
+    ("op", "u1"), ("pad", "V3"), ("seq", "<u4"), ("name_id", "<u4"), ("crc", "<u4"),
+    ("vec", "<f8", (ENCODING_DIM,)),
+])
+
+OP_ADD = 1
+OP_DELETE = 2
+
+# Compact once dead records outnumber live ones (and there are enough to matter)
+COMPACT_MIN_DEAD = 64
+
+
+def _crc(op, seq, name_id, vector_bytes):
+    return zlib.crc32(vector_bytes, zlib.crc32(struct.pack("<BII", op, seq, name_id)))
+
+
+def _fsync_dir(path):
+    if os.name == "nt":
+        return # Directories cannot be opened for fsync on Windows
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class EncodingStore:
+    """
+    Gallery of (name, encoding) templates backed by an append-only log.
+    encodings / names are parallel lists, ready for face_recognition.compare_faces.
+    read_only=True loads a snapshot and refuses writes.
+    """
+
+    def __init__(self, directory, read_only=False):
+        self.directory = directory
+        self.log_path = os.path.join(directory, "encodings.log")
+        self.names_path = os.path.join(directory, "names.log")
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+
+        self.encodings = []
+        self.names = []
+        self._seqs = []
+        self._name_ids = {}
+        self._next_seq = 1
+        self._dead = 0
+        self._lock = threading.Lock()
+        self._compacting = None
+
+        self._log = self._names_file = None
+        self._load_names()
+        self._load_log()
+        if not read_only:
+            self._log = open(self.log_path, "ab")
+            self._names_file = open(self.names_path, "ab")
+
+    # ------------------------
+    # LOADING
+    # ------------------------
+    def _load_names(self):
+        if not os.path.exists(self.names_path):
+            return
+        with open(self.names_path, "rb") as f:
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.decode("utf-8").splitlines():
+            name_id, name = line.split("\t", 1)
+            self._name_ids[name] = int(name_id)
+        if len(complete) != len(data) and not self.read_only:
+            # Torn last line from a crash mid-enrollment; its record was never written
+            with open(self.names_path, "r+b") as f:
+                f.truncate(len(complete))
+
+    def _load_log(self):
+        if not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == 0:
+            if self.read_only:
+                return
+            with open(self.log_path, "wb") as f:
+                f.write(FILE_HEADER.pack(MAGIC, ENCODING_DIM, 0))
+                f.flush()
+                os.fsync(f.fileno())
+            _fsync_dir(self.directory)
+            return
+
+        size = os.path.getsize(self.log_path)
+        with open(self.log_path, "rb") as f:
+            magic, dim, _ = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if magic != MAGIC or dim != ENCODING_DIM:
+                raise ValueError(f"{self.log_path} is not an encoding log")
+            count = (size - FILE_HEADER.size) // RECORD_SIZE
+            if count == 0:
+                records = np.empty(0, dtype=RECORD)
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    records = np.frombuffer(mm, dtype=RECORD, count=count, offset=FILE_HEADER.size).copy()
+
+        # Only the last record can be torn: earlier ones were fsynced before it was written
+        valid_size = FILE_HEADER.size + count * RECORD_SIZE
+        if count:
+            last = records[-1]
+            if last["crc"] != _crc(int(last["op"]), int(last["seq"]), int(last["name_id"]), last["vec"].tobytes()):
+                records = records[:-1]
+                valid_size -= RECORD_SIZE
+        if valid_size != size and not self.read_only:
+            print(f"[WARN] Dropping {size - valid_size} bytes of torn data at the end of {self.log_path}")
+            with open(self.log_path, "r+b") as f:
+                f.truncate(valid_size)
+
+        id_to_name = {name_id: name for name, name_id in self._name_ids.items()}
+        deleted = set(records["seq"][records["op"] == OP_DELETE].tolist())
+        adds = records[records["op"] == OP_ADD]
+        live = adds[~np.isin(adds["seq"], list(deleted))]
+
+        self.encodings = list(live["vec"])
+        self.names = [id_to_name[int(i)] for i in live["name_id"]]
+        self._seqs = live["seq"].tolist()
+        self._dead = len(records) - len(live)
+        if len(records):
+            self._next_seq = int(records["seq"].max()) + 1
+
+    # ------------------------
+    # WRITES
+    # ------------------------
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError(f"{self.directory} was opened read-only")
+
+    def _name_id(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = len(self._name_ids) + 1
+            self._names_file.write(f"{name_id}\t{name}\n".encode("utf-8"))
+            self._names_file.flush()
+            os.fsync(self._names_file.fileno())
+            self._name_ids[name] = name_id
+        return name_id
+
+    def _append(self, op, seq, name_id, vector):
+        vector_bytes = vector.tobytes()
+        record = RECORD_HEADER.pack(op, seq, name_id, _crc(op, seq, name_id, vector_bytes)) + vector_bytes
+        self._log.write(record)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def add(self, name, encoding):
+        """
+        Appends one template. Durable when this returns.
+        """
+        self._check_writable()
+        vector = np.ascontiguousarray(encoding, dtype="<f8").reshape(ENCODING_DIM)
+        with self._lock:
+            seq = self._next_seq
+            self._append(OP_ADD, seq, self._name_id(name), vector)
+            self._next_seq += 1
+            self.encodings.append(vector)
+            self.names.append(name)
+            self._seqs.append(seq)
+
+    def remove(self, index):
+        """
+        Removes the template at position index of encodings / names.
+        """
+        self._check_writable()
+        with self._lock:
+            seq = self._seqs[index]
+            self._append(OP_DELETE, seq, 0, np.zeros(ENCODING_DIM, dtype="<f8"))
+            del self.encodings[index]
+            del self.names[index]
+            del self._seqs[index]
+            self._dead += 2 # the add record and the delete record
+            should_compact = self._dead >= COMPACT_MIN_DEAD and self._dead > len(self._seqs)
+        if should_compact:
+            self.compact_in_background()
+
+    # ------------------------
+    # COMPACTION
+    # ------------------------
+    def compact_in_background(self):
+        if self._compacting is not None and self._compacting.is_alive():
+            return
+        self._compacting = threading.Thread(target=self.compact, name="encoding-compaction", daemon=True)
+        self._compacting.start()
+
+    def compact(self):
+        """
+        Rewrites the log with live templates only. Enrollments can continue
+        while the snapshot is written; anything appended meanwhile is copied
+        over before the swap.
+        """
+        self._check_writable()
+        with self._lock:
+            snapshot = list(zip(self._seqs, self.names, self.encodings))
+            snapshot_size = os.path.getsize(self.log_path)
+            dead_before = self._dead
+
+        tmp_path = self.log_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(FILE_HEADER.pack(MAGIC, ENCODING_DIM, 0))
+            for seq, name, vector in snapshot:
+                name_id = self._name_ids[name]
+                vector_bytes = vector.tobytes()
+                f.write(RECORD_HEADER.pack(OP_ADD, seq, name_id, _crc(OP_ADD, seq, name_id, vector_bytes)) + vector_bytes)
+
+            with self._lock:
+                # Records appended since the snapshot keep their seq, so they copy over as-is
+                with open(self.log_path, "rb") as old:
+                    old.seek(snapshot_size)
+                    tail = old.read()
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+
+                self._log.close()
+                os.replace(tmp_path, self.log_path)
+                _fsync_dir(self.directory)
+                self._log = open(self.log_path, "ab")
+                self._dead -= dead_before
+        print(f"[INFO] Compacted {self.log_path}: {len(snapshot)} live templates")
+
+    def import_legacy(self, encodings, names):
+        """
+        One-off import of the old (known_encodings, known_names) pickle.
+        """
+        for encoding, name in zip(encodings, names):
+            self.add(name, encoding)
+
+    def close(self):
+        if self._compacting is not None:
+            self._compacting.join()
+        with self._lock:
+            for f in (self._log, self._names_file):
+                if f is not None:
+                    f.close()
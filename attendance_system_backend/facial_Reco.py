@@ -1,79 +1,275 @@
 import os
+import time
+import queue
+import argparse
+import threading
 import cv2
 import face_recognition
-import pickle
+import numpy as np
+from encoding_store import EncodingStore
+
+# Pipelined camera daemon:
+#   capture thread  -> keeps only the latest frame (the camera buffer never backs up)
+#   inference threads -> detect + encode + match every Nth frame
+#   event thread    -> posts recognized faces to the backend as attendance events
+#   main thread     -> draws the latest result on the latest frame (cv2.imshow)
+#
+# Usage (from attendance_system_backend/):
+#   python facial_Reco.py                                  # webcam 0, window only
+#   python facial_Reco.py --source lecture.mp4 --no-display
+#   python facial_Reco.py --backend http://127.0.0.1:8000 --room "Lab 1"
+
+FACE_DB_PATH = "face_database"
+ENCODING_DIR = "encodings"
+
+# Detection downscale: shrink frames so the smallest face we care about
+# (MIN_FACE_FRACTION of the frame height) is about TARGET_FACE_PX tall
+MIN_FACE_FRACTION = 0.1
+TARGET_FACE_PX = 80
+MATCH_TOLERANCE = 0.5
+
 
 # -----------------------------
-# STEP 1: Load & encode faces
+# STEP 1: Load known faces
 # -----------------------------
+def load_known_faces():
+    """
+    Uses the enrolled gallery (encodings/, written by app.py) when there is
+    one, otherwise encodes face_database/ like before.
+    """
+    # Read-only: app.py may be enrolling right now, and a torn tail is not ours to cut
+    store = EncodingStore(ENCODING_DIR, read_only=True)
+    known_encodings, known_names = list(store.encodings), list(store.names)
+    store.close()
+    if known_names:
+        print(f"[INFO] Loaded {len(known_names)} encodings from {ENCODING_DIR}/")
+        return known_encodings, known_names
 
-KNOWN_ENCODINGS = []
-KNOWN_NAMES = []
+    print("[INFO] Loading face database...")
+    for person_name in os.listdir(FACE_DB_PATH):
+        person_folder = os.path.join(FACE_DB_PATH, person_name)
+        if not os.path.isdir(person_folder):
+            continue
+
+        for img_name in os.listdir(person_folder):
+            img_path = os.path.join(person_folder, img_name)
+            try:
+                image = face_recognition.load_image_file(img_path)
+                encodings = face_recognition.face_encodings(image)
+                if len(encodings) > 0:
+                    known_encodings.append(encodings[0])
+                    known_names.append(person_name)
+                    print(f"[OK] Encoded {person_name} - {img_name}")
+                else:
+                    print(f"[WARN] No face found in {img_path}")
+            except Exception as e:
+                print(f"[ERROR] {img_path}: {e}")
+
+    print("[INFO] Face encoding completed.")
+    return known_encodings, known_names
 
-FACE_DB_PATH = "face_database"
 
-print("[INFO] Loading face database...")
+# -----------------------------
+# STEP 2: Pipeline stages
+# -----------------------------
+class LatestFrame:
+    """
+    Single-slot buffer: the capture thread overwrites it, readers always get
+    the newest frame. Older frames are dropped, never queued.
+    """
 
-for person_name in os.listdir(FACE_DB_PATH):
-    person_folder = os.path.join(FACE_DB_PATH, person_name)
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.frame = None
+        self.index = -1
+        self.finished = False
 
-    if not os.path.isdir(person_folder):
-        continue
+    def put(self, frame):
+        with self.cond:
+            self.frame = frame
+            self.index += 1
+            self.cond.notify_all()
 
-    for img_name in os.listdir(person_folder):
-        img_path = os.path.join(person_folder, img_name)
+    def finish(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
 
-        try:
-            image = face_recognition.load_image_file(img_path)
-            encodings = face_recognition.face_encodings(image)
+    def wait_newer(self, index, timeout=0.5):
+        """
+        Returns (frame, index) once a frame newer than index exists,
+        or (None, index) if the source has ended.
+        """
+        with self.cond:
+            while self.index <= index and not self.finished:
+                self.cond.wait(timeout)
+            if self.index <= index:
+                return None, index
+            return self.frame, self.index
 
-            if len(encodings) > 0:
-                KNOWN_ENCODINGS.append(encodings[0])
-                KNOWN_NAMES.append(person_name)
-                print(f"[OK] Encoded {person_name} - {img_name}")
-            else:
-                print(f"[WARN] No face found in {img_path}")
 
-        except Exception as e:
-            print(f"[ERROR] {img_path}: {e}")
+def capture_loop(source, latest, stop):
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        print(f"[ERROR] Cannot open video source {source!r}")
+        latest.finish()
+        return
 
-print("[INFO] Face encoding completed.")
+    # Video files are paced at their own frame rate, so they behave like a live camera
+    is_file = isinstance(source, str)
+    interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 25) if is_file else 0
+    next_at = time.perf_counter()
+    try:
+        while not stop.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                if not is_file:
+                    print("[ERROR] Camera not accessible")
+                break
+            latest.put(frame)
+            if interval:
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    finally:
+        cap.release()
+        latest.finish()
 
-# -----------------------------
-# STEP 2: Start webcam
-# -----------------------------
 
-cap = cv2.VideoCapture(0)
+class Recognizer:
+    def __init__(self, known_encodings, known_names, every_n):
+        self.known_encodings = np.asarray(known_encodings, dtype=np.float64).reshape(-1, 128)
+        self.known_names = known_names
+        self.every_n = every_n
+        self.claim_lock = threading.Lock()
+        self.last_claimed = -every_n
+        self.result_lock = threading.Lock()
+        self.result = (-1, [])  # (frame index, [(box, name)])
+        self.processed = 0
+
+    def claim(self, index):
+        # Workers share the stream: each Nth frame is processed by exactly one of them
+        with self.claim_lock:
+            if index - self.last_claimed < self.every_n:
+                return False
+            self.last_claimed = index
+            return True
+
+    def process(self, frame):
+        scale = min(1.0, TARGET_FACE_PX / (MIN_FACE_FRACTION * min(frame.shape[:2])))
+        small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+
+        face_locations = face_recognition.face_locations(rgb_frame)
+        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
 
-print("[INFO] Starting camera. Press 'q' to quit.")
+        faces = []
+        for face_encoding, face_location in zip(face_encodings, face_locations):
+            name = "Unknown"
+            if len(self.known_encodings):
+                distances = face_recognition.face_distance(self.known_encodings, face_encoding)
+                best = int(distances.argmin())
+                if distances[best] <= MATCH_TOLERANCE:
+                    name = self.known_names[best]
+            box = tuple(int(v / scale) for v in face_location)
+            faces.append((box, name))
+        return faces
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("[ERROR] Camera not accessible")
-        break
+    def publish(self, index, faces):
+        with self.result_lock:
+            if index > self.result[0]:
+                self.result = (index, faces)
+            self.processed += 1
 
-    # Resize for speed
-    small_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-    rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+    def latest_result(self):
+        with self.result_lock:
+            return self.result
 
-    face_locations = face_recognition.face_locations(rgb_frame)
-    face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
 
-    for face_encoding, face_location in zip(face_encodings, face_locations):
-        matches = face_recognition.compare_faces(KNOWN_ENCODINGS, face_encoding, tolerance=0.5)
-        name = "Unknown"
+def inference_loop(latest, recognizer, events, stop):
+    index = -1
+    while not stop.is_set():
+        frame, index = latest.wait_newer(index)
+        if frame is None:
+            return
+        if not recognizer.claim(index):
+            continue
+        faces = recognizer.process(frame)
+        recognizer.publish(index, faces)
+        for box, name in faces:
+            if name != "Unknown":
+                events.offer(name, frame, box)
 
-        if True in matches:
-            matched_index = matches.index(True)
-            name = KNOWN_NAMES[matched_index]
 
-        top, right, bottom, left = face_location
-        top *= 2
-        right *= 2
-        bottom *= 2
-        left *= 2
+class EventSender(threading.Thread):
+    """
+    Turns sightings into attendance events. Each person is reported at most
+    once per cooldown; the face crop goes to the backend's kiosk endpoint,
+    which re-checks identity and marks the active class.
+    """
 
+    def __init__(self, backend_url, room, cooldown):
+        super().__init__(name="attendance-events", daemon=True)
+        self.backend_url = backend_url.rstrip("/") if backend_url else None
+        self.room = room
+        self.cooldown = cooldown
+        self.last_sent = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=64)
+        self.session = None
+
+    def offer(self, name, frame, box):
+        now = time.monotonic()
+        with self.lock:  # several inference threads report sightings
+            if now - self.last_sent.get(name, -self.cooldown) < self.cooldown:
+                return
+            self.last_sent[name] = now
+        top, right, bottom, left = box
+        pad = (bottom - top) // 2
+        crop = frame[max(0, top - pad):bottom + pad, max(0, left - pad):right + pad]
+        try:
+            self.queue.put_nowait((name, time.time(), crop.copy()))
+        except queue.Full:
+            print(f"[WARN] Event queue full, dropped sighting of {name}")
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            name, seen_at, crop = item
+            print(f"[EVENT] {time.strftime('%H:%M:%S', time.localtime(seen_at))} {name}")
+            if self.backend_url:
+                self.send(name, crop)
+
+    def send(self, name, crop):
+        import requests
+        if self.session is None:
+            self.session = requests.Session()  # keep-alive across events
+        ok, jpeg = cv2.imencode(".jpg", crop)
+        if not ok:
+            return
+        try:
+            resp = self.session.post(
+                f"{self.backend_url}/attendance/auto-mark",
+                files={"file": (f"{name}.jpg", jpeg.tobytes(), "image/jpeg")},
+                data={"room": self.room} if self.room else None,
+                timeout=10,
+            )
+            body = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {}
+            message = body.get("message") or body.get("detail") or resp.text
+            print(f"[BACKEND] {name}: {resp.status_code} {message}")
+        except requests.RequestException as e:
+            print(f"[ERROR] Could not reach backend: {e}")
+
+    def close(self):
+        self.queue.put(None)
+        self.join(timeout=15)
+
+
+def draw(frame, faces):
+    for (top, right, bottom, left), name in faces:
         cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
         cv2.putText(
             frame,
@@ -84,11 +280,67 @@ while True:
             (0, 255, 0),
             2
         )
+    return frame
+
+
+# -----------------------------
+# STEP 3: Run
+# -----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Facial attendance camera daemon")
+    parser.add_argument("--source", default="0", help="Camera index or video file path")
+    parser.add_argument("--every", type=int, default=3, help="Run recognition on every Nth frame")
+    parser.add_argument("--workers", type=int, default=1, help="Inference threads")
+    parser.add_argument("--backend", default=None, help="Backend URL, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--room", default=None, help="Kiosk room sent with each event")
+    parser.add_argument("--cooldown", type=float, default=60.0, help="Seconds between events for the same person")
+    parser.add_argument("--no-display", action="store_true", help="Do not open a window")
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    known_encodings, known_names = load_known_faces()
+
+    latest = LatestFrame()
+    stop = threading.Event()
+    recognizer = Recognizer(known_encodings, known_names, max(1, args.every))
+    events = EventSender(args.backend, args.room, args.cooldown)
+    events.start()
+
+    threads = [threading.Thread(target=capture_loop, args=(source, latest, stop), name="capture", daemon=True)]
+    threads += [
+        threading.Thread(target=inference_loop, args=(latest, recognizer, events, stop), name=f"inference-{i}", daemon=True)
+        for i in range(max(1, args.workers))
+    ]
+    for t in threads:
+        t.start()
+
+    print("[INFO] Starting camera. Press 'q' to quit." if not args.no_display else "[INFO] Running headless.")
+    started = time.perf_counter()
+    index = -1
+    try:
+        while True:
+            frame, index = latest.wait_newer(index)
+            if frame is None:
+                break
+            if args.no_display:
+                continue
+            _, faces = recognizer.latest_result()
+            cv2.imshow("Facial Attendance System", draw(frame.copy(), faces))
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=5)
+        events.close()
+        if not args.no_display:
+            cv2.destroyAllWindows()
 
-    cv2.imshow("Facial Attendance System", frame)
+    elapsed = time.perf_counter() - started
+    print(f"[INFO] {latest.index + 1} frames captured, {recognizer.processed} recognized in {elapsed:.1f}s")
 
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
 
-cap.release()
-cv2.destroyAllWindows()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import os
+import re
+import argparse
+import threading
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import create_engine, select, func, MetaData, Table, Column, Integer, String, DateTime, UniqueConstraint
+
+import utils
+
+# Cold storage for attendance of terms that are over.
+#
+# Archiving a term moves its rows out of the live attendance table into one
+# SQLite file per term (ARCHIVE_DIR/attendance_<term>.db, same columns and
+# ids), so the table every dashboard and kiosk query hits only grows with the
+# current term. Reads that may reach back into closed terms go through
+# query(), which asks the live table and each archived term overlapping the
+# requested date range and merges the results.
+#
+# Rows are copied in chunks and each chunk is deleted from the live table only
+# after the archive has committed it. A row can therefore briefly exist in
+# both places; query() prefers the live copy and re-running archive_term()
+# finishes the move. Rows recorded for an archived term later (edge kiosk
+# syncs, recordings) land in the live table, are still found by query(), and
+# are moved by archiving the term again.
+ARCHIVE_DIR = os.getenv("ATTENDANCE_ARCHIVE_DIR", os.path.join(utils.APP_DIR, "attendance_archive"))
+ARCHIVE_CHUNK = 5000
+
+_archive_meta = MetaData()
+archive_table = Table(
+    "attendance", _archive_meta,
+    Column("archive_id", Integer, primary_key=True),
+    # id in the live table. SQLite hands out a deleted max id again, so a
+    # row recorded after an archive can reuse an archived id; ids are only
+    # unique together with the timestamp.
+    Column("id", Integer, nullable=False),
+    Column("user_id", Integer, index=True),
+    Column("subject_id", Integer, index=True),
+    Column("date", DateTime, index=True),
+    Column("status", String(10)),
+    UniqueConstraint("id", "date"),
+)
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class ArchivedAttendance:
+    """
+    Read-only row from an archive file, with the attributes of models.Attendance.
+    """
+    __slots__ = ("id", "user_id", "subject_id", "date", "status")
+
+    def __init__(self, id, user_id, subject_id, date, status):
+        self.id = id
+        self.user_id = user_id
+        self.subject_id = subject_id
+        self.date = date
+        self.status = status
+
+
+def archive_engine(path):
+    with _engines_lock:
+        if path not in _engines:
+            _engines[path] = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        return _engines[path]
+
+
+def term_bounds(term):
+    """
+    Returns the term as a [start, end) datetime range.
+    """
+    return (datetime.combine(term.start_date, datetime.min.time()),
+            datetime.combine(term.end_date + timedelta(days=1), datetime.min.time()))
+
+
+def archived_terms(db_session, start=None, end=None):
+    from models import Term
+    query = db_session.query(Term).filter(Term.status == "archived")
+    if start:
+        query = query.filter(Term.end_date >= start.date())
+    if end:
+        query = query.filter(Term.start_date <= end.date())
+    return query.order_by(Term.start_date).all()
+
+
+def _filtered(table, start, end, user_id, subject_id):
+    conditions = []
+    if start:
+        conditions.append(table.c.date >= start)
+    if end:
+        conditions.append(table.c.date < end)
+    if user_id is not None:
+        conditions.append(table.c.user_id == user_id)
+    if subject_id is not None:
+        conditions.append(table.c.subject_id == subject_id)
+    return conditions
+
+
+def query(db_session, start=None, end=None, user_id=None, subject_id=None, newest_first=False):
+    """
+    Attendance in [start, end) (either end open) from the live table and the
+    archives it overlaps, sorted by date. Live rows are models.Attendance,
+    archived ones ArchivedAttendance.
+    """
+    from models import Attendance
+    rows = db_session.query(Attendance).filter(*_filtered(Attendance.__table__, start, end, user_id, subject_id)).all()
+
+    live_keys = {(r.id, r.date) for r in rows}
+    for term in archived_terms(db_session, start, end):
+        path = os.path.join(ARCHIVE_DIR, term.archive_path)
+        if not os.path.exists(path):
+            print(f"[WARN] Archive for term {term.name} is missing: {path}")
+            continue
+        with archive_engine(path).connect() as conn:
+            archived = conn.execute(
+                select(archive_table.c.id, archive_table.c.user_id, archive_table.c.subject_id,
+                       archive_table.c.date, archive_table.c.status)
+                .where(*_filtered(archive_table, start, end, user_id, subject_id))
+            ).all()
+        rows.extend(ArchivedAttendance(*r) for r in archived if (r.id, r.date) not in live_keys)
+
+    rows.sort(key=lambda r: (r.date or datetime.min, r.id), reverse=newest_first)
+    return rows
+
+
+def archived_count(db_session):
+    from models import Term
+    return db_session.query(func.coalesce(func.sum(Term.archived_rows), 0)).filter(Term.status == "archived").scalar()
+
+
+def archive_term(db_session, term, today=None):
+    """
+    Moves the term's rows from the live table into its archive file.
+    Safe to re-run. Returns the number of rows moved.
+    """
+    from models import Attendance, EdgeMark
+
+    if term.end_date >= (today or date.today()):
+        raise ValueError(f"Term {term.name} has not ended yet")
+    start, end = term_bounds(term)
+    term.archive_path = term.archive_path or "attendance_{}.db".format(re.sub(r"[^A-Za-z0-9_-]+", "_", term.name))
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    engine = archive_engine(os.path.join(ARCHIVE_DIR, term.archive_path))
+    _archive_meta.create_all(engine)
+
+    live = Attendance.__table__
+    in_term = [live.c.date >= start, live.c.date < end]
+    moved, last_id = 0, 0
+    while True:
+        rows = db_session.execute(
+            select(live.c.id, live.c.user_id, live.c.subject_id, live.c.date, live.c.status)
+            .where(*in_term, live.c.id > last_id).order_by(live.c.id).limit(ARCHIVE_CHUNK)
+        ).all()
+        if not rows:
+            break
+        # Copy first; a row that is already there came from an interrupted run
+        with engine.begin() as conn:
+            conn.execute(archive_table.insert().prefix_with("OR IGNORE"), [dict(r._mapping) for r in rows])
+
+        # Ids only grow, so this id window holds exactly the rows just copied
+        window = [*in_term, live.c.id > last_id, live.c.id <= rows[-1].id]
+        edge_marks = EdgeMark.__table__
+        db_session.execute(edge_marks.update().where(
+            edge_marks.c.attendance_id.in_(select(live.c.id).where(*window))
+        ).values(attendance_id=None))
+        db_session.execute(live.delete().where(*window))
+        db_session.commit()
+        moved += len(rows)
+        last_id = rows[-1].id
+
+    with engine.connect() as conn:
+        term.archived_rows = conn.execute(select(func.count()).select_from(archive_table)).scalar()
+    term.status = "archived"
+    term.archived_at = datetime.utcnow()
+    if moved:
+        # Core deletes fire no ORM hooks; tell other workers' attendance caches
+        import cache_bus
+        cache_bus.publish(db_session.connection(), "presence")
+    db_session.commit()
+    print(f"[INFO] Archived term {term.name}: moved {moved} rows, {term.archived_rows} in {term.archive_path}")
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move attendance of finished terms into archive files")
+    parser.add_argument("term", nargs="?", help="Term name to archive (omit to list terms)")
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine, add_missing_columns
+    from models import Base, Term
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(Base)
+
+    db = SessionLocal()
+    try:
+        if not args.term:
+            for t in db.query(Term).order_by(Term.start_date).all():
+                print(f"{t.name:<16} {t.start_date} .. {t.end_date}  {t.status:<8} {t.archived_rows or 0} archived rows")
+        else:
+            t = db.query(Term).filter(Term.name == args.term).first()
+            if not t:
+                print(f"[ERROR] Term {args.term} not found")
+            else:
+                archive_term(db, t)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"[FATAL ERROR] {e}")
+    finally:
+        db.close()
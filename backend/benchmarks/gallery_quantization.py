@@ -0,0 +1,189 @@
+"""
+Accuracy / memory trade-off of the compact gallery (GALLERY_MODE, see
+compact_gallery.py) against the default float32 gallery.
+
+Builds a throw-away SQLite database of synthetic identities (a random
+centre per person, TEMPLATES noisy enrolled captures around it), then for
+each mode loads the gallery and reports:
+
+    MB / B per face : memory retained by the loaded gallery (tracemalloc)
+    warm / cold ms  : one probe through match_encoding, re-rank templates
+                      cached / read from the database (compact modes)
+    rank-1          : genuine probes matched to the right person
+    agree           : same answer as float32, probe by probe
+    false accepts   : impostor (not enrolled) probes matched to someone
+    max err         : largest |quantized - exact| centroid distance seen
+
+Usage (from backend/):
+    python benchmarks/gallery_quantization.py --sizes 10000,50000
+"""
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import statistics
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+ENCODING_DIM = 128
+MODES = ("float32", "float16", "int8")
+
+
+def log(msg):
+    print(f"[BENCH] {msg}", flush=True)
+
+
+def make_people(rng, n, spread):
+    return rng.normal(0, spread, size=(n, ENCODING_DIM)).astype(np.float32)
+
+
+def captures(rng, centres, noise):
+    return (centres + rng.normal(0, noise, size=centres.shape)).astype(np.float32)
+
+
+def insert_gallery(engine, rng, centres, templates_per_user, noise):
+    """
+    Returns (user ids, float32 centroids) in insertion order.
+    """
+    import utils
+    templates = np.stack([captures(rng, centres, noise) for _ in range(templates_per_user)], axis=1)
+    centroids = templates.mean(axis=1)
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.executemany(
+            "INSERT INTO users (name, email, password_hash, role, account_status, face_encoding, face_templates) "
+            "VALUES (?, ?, ?, 'student', 'active', ?, ?)",
+            [(f"Gallery {i}", f"gallery{i}@vbis.com", "x", json.dumps(centroids[i].tolist()),
+              utils.templates_to_bytes(templates[i])) for i in range(len(centres))]
+        )
+        raw.commit()
+        cur.execute("SELECT id FROM users WHERE email LIKE 'gallery%@vbis.com' ORDER BY id")
+        ids = [row[0] for row in cur.fetchall()]
+    finally:
+        raw.close()
+    return np.asarray(ids, dtype=np.int64), centroids
+
+
+def load_measured(utils, db):
+    utils.KNOWN_FACES_CACHE, utils.KNOWN_TEMPLATES_CACHE, utils._GALLERY_IDS, utils._GALLERY_CENTROIDS = {}, {}, None, None
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    utils.load_known_faces(db)
+    if utils.GALLERY_MODE == "float32":
+        utils._gallery_matrix() # The shortlist matrix is part of the resident gallery
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return retained
+
+
+def match_all(utils, probes, batch):
+    ids = []
+    for start in range(0, len(probes), batch):
+        ids.extend(user_id for user_id, _ in utils.match_encodings(probes[start:start + batch]))
+    return ids
+
+
+def latency_ms(utils, probes, cold):
+    gallery = utils.KNOWN_FACES_CACHE
+    samples = []
+    for probe in probes:
+        if cold and hasattr(gallery, "rerank_cache"):
+            gallery.rerank_cache.clear()
+        start = time.perf_counter()
+        utils.match_encoding(probe)
+        samples.append(time.perf_counter() - start)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def run_size(args, size, rng):
+    import database, utils
+    from models import User
+
+    with database.engine.begin() as conn:
+        conn.execute(User.__table__.delete())
+    centres = make_people(rng, size, args.spread)
+    user_ids, centroids = insert_gallery(database.engine, rng, centres, args.templates, args.noise)
+    who = rng.integers(0, size, args.probes)
+    genuine = captures(rng, centres[who], args.noise)
+    impostors = captures(rng, make_people(rng, args.probes, args.spread), args.noise)
+
+    db = database.SessionLocal()
+    rows, baseline = [], None
+    try:
+        for mode in MODES:
+            utils.GALLERY_MODE = mode
+            retained = load_measured(utils, db)
+            matched = match_all(utils, genuine, args.batch)
+            false_accepts = sum(user_id is not None for user_id in match_all(utils, impostors, args.batch))
+            if baseline is None:
+                baseline = matched
+            row = {
+                "mode": mode,
+                "mb": retained / 2**20,
+                "bytes_per_face": retained / size,
+                "warm_ms": latency_ms(utils, genuine[:args.latency_probes], cold=False),
+                "cold_ms": latency_ms(utils, genuine[:args.latency_probes], cold=True),
+                "rank1": float(np.mean(np.asarray(matched, dtype=object) == user_ids[who])),
+                "agree": float(np.mean([a == b for a, b in zip(matched, baseline)])),
+                "false_accepts": false_accepts,
+                "max_err": 0.0,
+            }
+            gallery = utils.KNOWN_FACES_CACHE
+            if mode != "float32":
+                nearest, approx = gallery.scan(genuine, 1)
+                exact = np.linalg.norm(centroids[np.searchsorted(user_ids, nearest[:, 0])] - genuine, axis=1)
+                row["max_err"] = float(np.abs(approx[:, 0] - exact).max())
+            rows.append(row)
+    finally:
+        db.close()
+
+    log(f"{size} faces, {args.templates} templates each, {args.probes} genuine + {args.probes} impostor probes")
+    print(f"{'mode':<8} {'MB':>8} {'B/face':>8} {'warm ms':>8} {'cold ms':>8} {'rank-1':>8} {'agree':>8} {'FA':>5} {'max err':>8}")
+    for r in rows:
+        print(f"{r['mode']:<8} {r['mb']:>8.1f} {r['bytes_per_face']:>8.0f} {r['warm_ms']:>8.3f} {r['cold_ms']:>8.3f} "
+              f"{r['rank1']:>8.4f} {r['agree']:>8.4f} {r['false_accepts']:>5} {r['max_err']:>8.4f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and accuracy of the quantized gallery modes")
+    parser.add_argument("--sizes", default="10000,50000", help="Comma-separated gallery sizes")
+    parser.add_argument("--templates", type=int, default=3, help="Enrolled templates per person")
+    parser.add_argument("--probes", type=int, default=2000, help="Genuine (and impostor) probes per size")
+    parser.add_argument("--latency-probes", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=64, help="Probes per match_encodings call")
+    # Spread 0.05 puts different people ~0.8 apart and captures of one person ~0.3, as with dlib
+    parser.add_argument("--spread", type=float, default=0.05, help="Per-dimension std of identity centres")
+    parser.add_argument("--noise", type=float, default=0.02, help="Per-dimension std of a capture")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gallery_bench_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'gallery.db')}"
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+
+    try:
+        import database
+        from models import Base
+        Base.metadata.create_all(bind=database.engine)
+        rng = np.random.default_rng(args.seed)
+        for size in (int(s) for s in args.sizes.split(",")):
+            run_size(args, size, rng)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"[FATAL ERROR] {e}")
+    finally:
+        import shutil
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,64 @@
+"""
+Measures what a worker pays to start: wall time and peak RSS of importing
+the API (main.py), in a fresh interpreter per mode.
+
+    local   : API import only (vision stack is now imported lazily)
+    remote  : VISION_MODE=remote, the API-only deployment
+    vision  : local, then force the vision stack in (numpy, cv2,
+              face_recognition) -- what every worker used to pay at import
+
+Usage (from backend/):
+    python benchmarks/import_cost.py --runs 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+PROBE = r"""
+import sys, time, json, resource
+start = time.perf_counter()
+import main
+if sys.argv[1] == "vision":
+    import utils, frame_cache
+    utils.load_vision()
+    utils.np.zeros(1), utils.cv2.resize
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("numpy", "cv2", "face_recognition", "dlib") if m in sys.modules]
+print(json.dumps({"seconds": elapsed, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "loaded": heavy}))
+"""
+
+MODES = {
+    "local": {"VISION_MODE": "local"},
+    "remote": {"VISION_MODE": "remote"},
+    "vision": {"VISION_MODE": "local"},
+}
+
+
+def measure(mode, runs):
+    env = dict(os.environ, WARMUP_ON_START="0", METRICS_ENABLED="0", **MODES[mode])
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE, mode], cwd=BACKEND_DIR, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        "import_ms": round(statistics.median(s["seconds"] for s in samples) * 1000, 1),
+        "max_rss_mb": round(statistics.median(s["max_rss_mb"] for s in samples), 1),
+        "heavy_modules": samples[-1]["loaded"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time / RSS per deployment mode")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for mode in MODES:
+        r = measure(mode, args.runs)
+        print(f"{mode:<8} {r['import_ms']:>8} ms  {r['max_rss_mb']:>7} MB  loaded: {', '.join(r['heavy_modules']) or '-'}")
@@ -0,0 +1,424 @@
+"""
+Reproducible, offline benchmark suite for the attendance backend.
+
+Builds a throw-away SQLite database with a synthetic gallery of random
+128-d encodings and a synthetic attendance history, stubs the face model
+(so it runs on any CPU-only box without dlib), then times gallery load,
+matching, recognition service bursts, /attendance/auto-mark end to end,
+bulk marking, exports and dashboards. Results are written as JSON so runs can be compared.
+
+Usage (from backend/):
+    python benchmarks/run_benchmarks.py --sizes 1000,10000,50000 --attendance-rows 1000000
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+ENCODING_DIM = 128
+PROBE_NOISE = 0.01
+STUB_FRAME_WIDTH, STUB_FRAME_HEIGHT = 640, 480
+
+
+# ------------------------
+# FACE MODEL STUB
+# ------------------------
+def make_face_recognition_stub():
+    """
+    Stand-in for the face_recognition module. A "photo" is simply the raw
+    float64 bytes of the encoding it should produce. Loading it returns a
+    textured VGA frame (so resize/crop/quality code runs on realistic
+    shapes) with a tag pixel stamped at the centre of the face box; the
+    tag maps back to the encoding, so frames can be encoded in any order
+    (the recognition service batches them). Frames without a face get a
+    dark corner patch instead.
+    """
+    stub = types.ModuleType("face_recognition")
+    tags = {}
+    frame = np.random.default_rng(0).integers(60, 200, size=(STUB_FRAME_HEIGHT, STUB_FRAME_WIDTH, 3), dtype=np.uint8)
+    h, w = frame.shape[:2]
+    face_box = (h // 4, 3 * w // 4, 3 * h // 4, w // 4)
+
+    def load_image_file(path, mode="RGB"):
+        if hasattr(path, "read"):
+            data = path.read()
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+        image = frame.copy()
+        if len(data) != ENCODING_DIM * 8:
+            image[:40, :40] = 0
+            return image
+        tag = len(tags) + 1 # Red channel stays below the background's 60..200 range
+        tags[tag] = np.frombuffer(data, dtype=np.float64)
+        top, right, bottom, left = face_box
+        image[(top + bottom) // 2, (left + right) // 2] = [(tag >> 16) & 255, (tag >> 8) & 255, tag & 255]
+        return image
+
+    def face_locations(image, number_of_times_to_upsample=1, model="hog"):
+        if image[:4, :4].max() < 10:
+            return []
+        ih, iw = image.shape[:2]
+        return [(ih // 4, 3 * iw // 4, 3 * ih // 4, iw // 4)]
+
+    def face_encodings(image, known_face_locations=None, num_jitters=1, model="small"):
+        found = []
+        for top, right, bottom, left in known_face_locations or []:
+            # Boxes scaled back from the downsampled detector can be off by a pixel or two
+            cy, cx = (top + bottom) // 2, (left + right) // 2
+            patch = image[max(0, cy - 3):cy + 4, max(0, cx - 3):cx + 4].reshape(-1, 3).astype(np.int64)
+            for r, g, b in patch[patch[:, 0] < 60]:
+                encoding = tags.get((int(r) << 16) | (int(g) << 8) | int(b))
+                if encoding is not None:
+                    found.append(np.array(encoding))
+                    break
+        return found
+
+    def face_landmarks(face_image, face_locations=None, model="large"):
+        # Frontal 5-point layout for every box
+        marks = []
+        for top, right, bottom, left in face_locations or []:
+            w, h = right - left, bottom - top
+            marks.append({
+                "left_eye": [(left + w * 0.25, top + h * 0.4), (left + w * 0.35, top + h * 0.4)],
+                "right_eye": [(left + w * 0.65, top + h * 0.4), (left + w * 0.75, top + h * 0.4)],
+                "nose_tip": [(left + w * 0.5, top + h * 0.6)],
+            })
+        return marks
+
+    def face_distance(face_encodings, face_to_compare):
+        if len(face_encodings) == 0:
+            return np.empty(0)
+        return np.linalg.norm(np.asarray(face_encodings) - face_to_compare, axis=1)
+
+    def compare_faces(known_face_encodings, face_encoding_to_check, tolerance=0.6):
+        return list(face_distance(known_face_encodings, face_encoding_to_check) <= tolerance)
+
+    stub.load_image_file = load_image_file
+    stub.face_locations = face_locations
+    stub.face_encodings = face_encodings
+    stub.face_landmarks = face_landmarks
+    stub.face_distance = face_distance
+    stub.compare_faces = compare_faces
+    return stub
+
+
+def random_encodings(rng, n):
+    # Real dlib encodings have norm ~1; N(0, 0.09) per dim gives the same scale
+    return rng.normal(0, 0.09, size=(n, ENCODING_DIM))
+
+
+def probe_bytes(rng, encoding):
+    return (encoding + rng.normal(0, PROBE_NOISE, size=ENCODING_DIM)).astype(np.float64).tobytes()
+
+
+# ------------------------
+# TIMING
+# ------------------------
+def summarize(samples):
+    arr = np.asarray(samples) * 1000.0
+    return {
+        "n": len(samples),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "max_ms": round(float(arr.max()), 3),
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def log(msg):
+    print(f"[BENCH] {msg}", flush=True)
+
+
+# ------------------------
+# DATA GENERATION
+# ------------------------
+def insert_students(engine, rng, start_index, count, department="BENCH"):
+    """
+    Bulk-inserts synthetic students with encodings. Returns {user_id: encoding}.
+    """
+    encodings = random_encodings(rng, count)
+    now = datetime.utcnow()
+    rows = []
+    for i in range(count):
+        n = start_index + i
+        rows.append((
+            f"Bench Student {n}", f"bench{n}@vbis.com", "x", "student",
+            department, f"B{n:07d}", "active",
+            json.dumps(encodings[i].tolist()), now
+        ))
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.executemany(
+            "INSERT INTO users (name, email, password_hash, role, department, roll_number, "
+            "account_status, face_encoding, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        raw.commit()
+        cur.execute("SELECT id, email FROM users WHERE email LIKE 'bench%@vbis.com'")
+        by_email = dict((email, uid) for uid, email in cur.fetchall())
+    finally:
+        raw.close()
+    return {by_email[f"bench{start_index + i}@vbis.com"]: encodings[i] for i in range(count)}
+
+
+def insert_attendance(engine, rng, user_ids, subject_ids, total_rows, days=180, chunk=200000):
+    statuses = np.array(["present", "absent", "late"])
+    user_ids = np.asarray(user_ids)
+    subject_ids = np.asarray(subject_ids)
+    start = datetime.now() - timedelta(days=days)
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        written = 0
+        while written < total_rows:
+            n = min(chunk, total_rows - written)
+            users = rng.choice(user_ids, n)
+            subjects = rng.choice(subject_ids, n)
+            status = statuses[rng.choice(3, n, p=[0.8, 0.15, 0.05])]
+            offsets = rng.integers(0, days * 86400, n)
+            rows = [
+                (int(u), int(s), (start + timedelta(seconds=int(o))).strftime("%Y-%m-%d %H:%M:%S.000000"), str(st))
+                for u, s, o, st in zip(users, subjects, offsets, status)
+            ]
+            cur.executemany(
+                "INSERT INTO attendance (user_id, subject_id, date, status) VALUES (?, ?, ?, ?)", rows
+            )
+            raw.commit()
+            written += n
+    finally:
+        raw.close()
+
+
+def enroll(engine, student_ids, subject_id):
+    raw = engine.raw_connection()
+    try:
+        raw.cursor().executemany(
+            "INSERT INTO student_courses (student_id, subject_id) VALUES (?, ?)",
+            [(int(s), subject_id) for s in student_ids]
+        )
+        raw.commit()
+    finally:
+        raw.close()
+
+
+# ------------------------
+# BENCHMARK RUN
+# ------------------------
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="attendance_bench_")
+    db_path = os.path.join(workdir, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    # The suite loads the gallery itself at each size; a background warm-up would race it
+    os.environ.setdefault("WARMUP_ON_START", "0")
+
+    # Install the stub before the backend imports face_recognition
+    sys.modules["face_recognition"] = make_face_recognition_stub()
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+
+    from fastapi.testclient import TestClient
+    import main, database, models, utils
+
+    # Imports the stub in place of the real library
+    assert utils.load_vision()
+
+    results = {}
+    meta = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "args": vars(args),
+    }
+
+    try:
+        with TestClient(main.app) as client:
+            def token(email):
+                resp = client.post("/auth/login", data={"username": email, "password": "test"})
+                return {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+            admin, teacher, student = token("admin@vbis.com"), token("teacher@vbis.com"), token("student@vbis.com")
+            db = database.SessionLocal()
+            subject_ids = [s.id for s in db.query(models.Subject).all()]
+            teacher_subject = db.query(models.Subject).filter(models.Subject.code == "CS101").first().id
+            student_id = db.query(models.User).filter(models.User.email == "student@vbis.com").first().id
+            db.close()
+
+            # ---- Gallery load + match latency per gallery size ----
+            gallery = {}
+            for size in sorted(args.sizes):
+                log(f"Growing gallery to {size} encodings...")
+                gallery.update(insert_students(database.engine, rng, len(gallery), size - len(gallery)))
+                ids = list(gallery)
+
+                db = database.SessionLocal()
+                results[f"gallery_load[{size}]"] = measure(lambda: utils.load_known_faces(db), args.repeat_slow)
+                db.close()
+
+                probe_path = os.path.join(workdir, "probe.bin")
+
+                def match_once():
+                    with open(probe_path, "wb") as f:
+                        f.write(probe_bytes(rng, gallery[random.choice(ids)]))
+                    assert utils.recognize_face(probe_path) is not None
+                results[f"match[{size}]"] = measure(match_once, args.repeat)
+
+            ids = list(gallery)
+            db = database.SessionLocal()
+            utils.load_known_faces(db)
+            db.close()
+
+            # ---- Recognition service: a burst of kiosk frames, batched vs one at a time ----
+            import recognition_service
+            recognition_service.batcher.start()
+            burst_frames = [probe_bytes(rng, gallery[random.choice(ids)]) for _ in range(args.burst)]
+            for batch_size in (1, recognition_service.RECOGNITION_BATCH_SIZE):
+                recognition_service.RECOGNITION_BATCH_SIZE = batch_size
+
+                def burst():
+                    futures = [recognition_service.batcher.submit("recognize", f, profile="kiosk") for f in burst_frames]
+                    for future in futures:
+                        assert future.result()["user_id"] is not None
+                results[f"service_burst{args.burst}[batch={batch_size}]"] = measure(burst, args.repeat_slow)
+
+            # ---- Synthetic attendance history ----
+            log(f"Inserting {args.attendance_rows} attendance rows...")
+            started = time.perf_counter()
+            history_users = ids[:args.history_students] + [student_id]
+            insert_attendance(database.engine, rng, history_users, subject_ids, args.attendance_rows)
+            enroll(database.engine, ids[:args.class_size], teacher_subject)
+            meta["attendance_insert_seconds"] = round(time.perf_counter() - started, 2)
+
+            # ---- /attendance/auto-mark end to end ----
+            def auto_mark():
+                payload = probe_bytes(rng, gallery[random.choice(ids)])
+                resp = client.post("/attendance/auto-mark", files={"file": ("probe.jpg", payload, "image/jpeg")})
+                assert resp.status_code == 200, resp.text
+            results["auto_mark"] = measure(auto_mark, args.repeat)
+
+            # ---- Bulk marking ----
+            def bulk_mark():
+                body = {"subject_id": teacher_subject, "student_ids": random.sample(ids, min(args.class_size, len(ids))), "status": "present"}
+                resp = client.post("/teacher/attendance/bulk", json=body, headers=teacher)
+                assert resp.status_code == 200, resp.text
+            results["bulk_mark"] = measure(bulk_mark, args.repeat_slow)
+
+            # ---- Dashboards ----
+            def get(path, headers):
+                def call():
+                    resp = client.get(path, headers=headers)
+                    assert resp.status_code == 200, resp.text
+                return call
+            results["student_dashboard"] = measure(get("/student/dashboard", student), args.repeat)
+            results["teacher_dashboard"] = measure(get("/teacher/dashboard", teacher), args.repeat)
+            results["subject_students"] = measure(get(f"/teacher/subject/{teacher_subject}/students", teacher), args.repeat_slow)
+            results["admin_stats"] = measure(get("/admin/stats", admin), args.repeat)
+
+            # ---- Exports ----
+            if "export" not in args.skip:
+                results["teacher_export"] = measure(get(f"/teacher/attendance/export?subject_id={teacher_subject}", teacher), 1, warmup=0)
+                results["admin_export"] = measure(get("/admin/attendance/export", admin), 1, warmup=0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {"meta": meta, "results": results}
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'benchmark':32} {'old p50':>10} {'new p50':>10} {'ratio':>8}")
+    for name in sorted(set(old) | set(new)):
+        a, b = old.get(name, {}).get("p50_ms"), new.get(name, {}).get("p50_ms")
+        ratio = f"{b / a:.2f}x" if a and b else "-"
+        print(f"{name:32} {a if a is not None else '-':>10} {b if b is not None else '-':>10} {ratio:>8}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Attendance backend benchmarks")
+    parser.add_argument("--sizes", default="1000,10000", help="Comma separated gallery sizes")
+    parser.add_argument("--attendance-rows", type=int, default=1000000)
+    parser.add_argument("--history-students", type=int, default=5000, help="Students that own the synthetic history")
+    parser.add_argument("--class-size", type=int, default=500, help="Students enrolled in the benchmarked subject")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--repeat-slow", type=int, default=5)
+    parser.add_argument("--burst", type=int, default=64, help="Frames per recognition service burst")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--skip", default="", help="Comma separated groups to skip (export)")
+    parser.add_argument("--quick", action="store_true", help="Small sizes for a smoke run")
+    parser.add_argument("--output", default=None, help="Result JSON path")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args(argv)
+
+    args.sizes = [int(s) for s in str(args.sizes).split(",") if s]
+    args.skip = [s for s in args.skip.split(",") if s]
+    if args.quick:
+        args.sizes = [1000]
+        args.attendance_rows = 50000
+        args.repeat, args.repeat_slow = 10, 2
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    report = run(args)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench_{report['meta']['git_revision'] or 'local'}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, stats in report["results"].items():
+        print(f"{name:32} p50={stats['p50_ms']:>10} ms  p95={stats['p95_ms']:>10} ms  n={stats['n']}")
+    print(f"[DONE] Results written to {output}")
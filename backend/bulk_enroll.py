@@ -0,0 +1,286 @@
+"""
+Parallel, resumable bulk enrollment from a face_database/ folder.
+
+    face_database/
+        <person name>/
+            1.jpg
+            2.jpg
+
+Images are hashed and skipped if that content is already enrolled, decoded
+and encoded across a process pool (same detection profile and quality gate
+as the enrollment endpoints), and written to the DB in batches. Without
+face_recognition the run stops before touching anything.
+After every committed batch the processed paths are appended to a
+checkpoint file, so a crashed run picks up where it stopped. Per-image
+failures are collected in a summary file.
+
+Usage (from backend/):
+    python bulk_enroll.py --face-db ../attendance_system_backend/face_database --workers 8
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Ensure we can import from backend
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FACE_DB = os.path.join(os.path.dirname(APP_DIR), "attendance_system_backend", "face_database")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def person_email(person_name: str) -> str:
+    # Same convention as migrate_encodings.py
+    return f"{person_name.lower().replace(' ', '')}@student.com"
+
+
+def _init_worker():
+    import utils
+    utils.load_vision()
+
+
+def encode_image(path: str):
+    """
+    Worker: decodes one image and returns (path, encoding list or None, error or None).
+    """
+    import utils
+    if not utils.load_vision():
+        return path, None, "face_recognition not available"
+    try:
+        image = utils.face_recognition.load_image_file(path)
+        boxes = utils.detect_faces(image, "enrollment")
+        if not boxes:
+            return path, None, "no face found"
+        utils.gate_face(image, boxes[0], "enrollment")
+        encodings = utils.encode_faces(image, boxes[:1])
+        if not encodings:
+            return path, None, "no face found"
+        return path, encodings[0].tolist(), None
+    except utils.FaceQualityError as e:
+        return path, None, f"face rejected: {e}"
+    except Exception as e:
+        return path, None, str(e)
+
+
+def scan_face_db(face_db_path: str):
+    """
+    Yields (person_name, image_path) for every image under face_db_path.
+    """
+    for person_name in sorted(os.listdir(face_db_path)):
+        person_folder = os.path.join(face_db_path, person_name)
+        if not os.path.isdir(person_folder):
+            continue
+        for img_name in sorted(os.listdir(person_folder)):
+            if img_name.lower().endswith(IMAGE_EXTENSIONS):
+                yield person_name, os.path.join(person_folder, img_name)
+
+
+def load_checkpoint(path: str):
+    done = set()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    done.add(json.loads(line)["path"])
+    return done
+
+
+class Enroller:
+    def __init__(self, db, checkpoint_path, batch_size):
+        self.db = db
+        self.batch_size = batch_size
+        self.checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+        self.batch = []
+        self.users = {}  # person name -> User
+        self.stats = {"enrolled_images": 0, "users_created": 0, "templates_added": 0,
+                      "duplicates_pruned": 0, "outliers_rejected": 0, "failed": 0}
+        self.failures = []
+
+    def _get_users(self, person_names):
+        from models import User
+        missing = [p for p in person_names if p not in self.users]
+        if not missing:
+            return
+        emails = {person_email(p): p for p in missing}
+        # One query for the whole batch instead of one per person
+        existing = self.db.query(User).filter(
+            User.email.in_(list(emails)) | User.name.in_(missing)
+        ).all()
+        for user in existing:
+            person = emails.get(user.email, user.name)
+            self.users.setdefault(person, user)
+        for person in missing:
+            if person in self.users:
+                continue
+            user = User(
+                name=person,
+                email=person_email(person),
+                password_hash="hashed_default_password",
+                role="student",
+                account_status="active"
+            )
+            self.db.add(user)
+            self.users[person] = user
+            self.stats["users_created"] += 1
+        self.db.flush()
+
+    def add(self, person, path, content_hash, encoding, error):
+        self.batch.append((person, path, content_hash, encoding, error))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        from models import FaceImage
+        import utils
+
+        self._get_users({person for person, _, _, encoding, _ in self.batch if encoding is not None})
+        for person, path, content_hash, encoding, error in self.batch:
+            if encoding is None:
+                self.stats["failed"] += 1
+                self.failures.append({"person": person, "path": path, "error": error})
+                continue
+            user = self.users[person]
+            # Multi-template: near-duplicates and outliers are pruned here
+            status = utils.enroll_template(user, encoding)
+            self.stats[{"added": "templates_added", "duplicate": "duplicates_pruned",
+                        "outlier": "outliers_rejected"}[status]] += 1
+            self.db.add(FaceImage(user=user, content_hash=content_hash, source_path=path))
+            self.stats["enrolled_images"] += 1
+        self.db.commit()
+
+        # Only checkpoint once the batch is durable
+        for person, path, content_hash, encoding, error in self.batch:
+            self.checkpoint.write(json.dumps({"path": path, "hash": content_hash, "ok": encoding is not None}) + "\n")
+        self.checkpoint.flush()
+        os.fsync(self.checkpoint.fileno())
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        self.checkpoint.close()
+
+
+def bulk_enroll(face_db_path, workers=None, batch_size=200, checkpoint_path=None, summary_path=None, restart=False):
+    from database import SessionLocal, engine, add_missing_columns
+    from models import Base, FaceImage
+    import utils
+
+    if not os.path.exists(face_db_path):
+        print(f"[ERROR] Face database path not found: {face_db_path}")
+        return None
+    # A dummy encoding would be recorded as enrolled and its image skipped by every later run
+    if not utils.load_vision():
+        print("[ERROR] face_recognition is not installed; nothing was enrolled.")
+        return None
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(Base)
+    # Running API workers pick up the new faces from the change feed
+    import cache_bus
+    cache_bus.register_listeners()
+
+    checkpoint_path = checkpoint_path or os.path.join(APP_DIR, "enroll_checkpoint.jsonl")
+    summary_path = summary_path or os.path.join(APP_DIR, "enroll_summary.json")
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    print(f"[INFO] Scanning for faces in: {face_db_path}")
+
+    started = time.time()
+    db = SessionLocal()
+    done_paths = load_checkpoint(checkpoint_path)
+    enrolled_hashes = {h for (h,) in db.query(FaceImage.content_hash).all()}
+
+    pending = []
+    skipped = {"checkpoint": 0, "duplicate_hash": 0}
+    for person, path in scan_face_db(face_db_path):
+        if path in done_paths:
+            skipped["checkpoint"] += 1
+            continue
+        content_hash = file_hash(path)
+        if content_hash in enrolled_hashes:
+            skipped["duplicate_hash"] += 1
+            continue
+        enrolled_hashes.add(content_hash)  # also dedupes copies within this run
+        pending.append((person, path, content_hash))
+
+    print(f"[INFO] {len(pending)} images to encode ({skipped['checkpoint']} resumed, {skipped['duplicate_hash']} duplicates skipped)")
+
+    enroller = Enroller(db, checkpoint_path, batch_size)
+    workers = workers or os.cpu_count() or 1
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            # Keep a bounded number of images in flight so memory stays flat
+            tasks = iter(pending)
+            in_flight = {}
+            max_in_flight = workers * 4
+
+            def submit_more():
+                for person, path, content_hash in tasks:
+                    in_flight[pool.submit(encode_image, path)] = (person, content_hash)
+                    if len(in_flight) >= max_in_flight:
+                        break
+
+            submit_more()
+            processed = 0
+            while in_flight:
+                finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    person, content_hash = in_flight.pop(future)
+                    path, encoding, error = future.result()
+                    enroller.add(person, path, content_hash, encoding, error)
+                    processed += 1
+                    if processed % 100 == 0:
+                        print(f"[PROGRESS] {processed}/{len(pending)} images")
+                submit_more()
+    finally:
+        enroller.close()
+        db.close()
+
+    summary = {
+        "face_db": face_db_path,
+        "elapsed_seconds": round(time.time() - started, 2),
+        "workers": workers,
+        "skipped": skipped,
+        **enroller.stats,
+        "failures": enroller.failures,
+    }
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"\n[DONE] Enrolled {enroller.stats['enrolled_images']} images "
+          f"({enroller.stats['failed']} failed) in {summary['elapsed_seconds']}s. Summary: {summary_path}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk face enrollment")
+    parser.add_argument("--face-db", default=DEFAULT_FACE_DB)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--summary", default=None)
+    parser.add_argument("--restart", action="store_true", help="Ignore the existing checkpoint")
+    args = parser.parse_args()
+
+    try:
+        bulk_enroll(args.face_db, args.workers, args.batch_size, args.checkpoint, args.summary, args.restart)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"[FATAL ERROR] {e}")
@@ -0,0 +1,265 @@
+import os
+import time
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect
+
+import metrics
+
+# Cross-worker invalidation for the per-process caches (gallery, timetable
+# index, presence bitmaps, frame cache).
+#
+# Writes that change a cached view append a row to a change feed inside the
+# same transaction (ORM listeners, see register_listeners), so the event is
+# visible exactly when the data is. Every worker polls the feed for ids past
+# the last one it applied and hands each topic's keys to its subscribers in
+# one call per poll, e.g. one IN query for all users enrolled meanwhile.
+# A worker skips its own events; it already updated its caches in-line.
+#
+# CACHE_BUS=db      feed is the cache_events table of the shared database (default)
+# CACHE_BUS=memory  in-process feed: single worker, tests, benchmarks
+# CACHE_BUS=off     no feed at all
+CACHE_BUS = os.getenv("CACHE_BUS", "db")
+CACHE_BUS_POLL_SECONDS = float(os.getenv("CACHE_BUS_POLL_SECONDS", "1.0"))
+CACHE_BUS_RETENTION_SECONDS = float(os.getenv("CACHE_BUS_RETENTION_SECONDS", "3600"))
+CACHE_BUS_BATCH = 1000
+# An id missing from the middle of the feed is usually a transaction that has
+# not committed yet; wait this long for it before treating it as rolled back
+GAP_WAIT_SECONDS = 5.0
+PRUNE_EVERY_SECONDS = 300
+
+ORIGIN = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Structure: { topic: [handler(keys)] } where keys is a set of strings, or
+# None when the whole cache must be rebuilt
+_handlers = {}
+
+
+class DatabaseFeed:
+    def append(self, connection, rows):
+        from models import CacheEvent
+        # Runs on the flushing connection: committed or rolled back with the write
+        connection.execute(CacheEvent.__table__.insert(), rows)
+
+    def read(self, after_id, limit):
+        from models import CacheEvent
+        from database import engine
+        table = CacheEvent.__table__
+        with engine.connect() as conn:
+            return conn.execute(
+                table.select().with_only_columns(table.c.id, table.c.topic, table.c.key, table.c.origin)
+                .where(table.c.id > after_id).order_by(table.c.id).limit(limit)
+            ).all()
+
+    def head(self):
+        from models import CacheEvent
+        from database import engine
+        from sqlalchemy import func, select
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(CacheEvent.__table__.c.id))).scalar() or 0
+
+    def prune(self, older_than):
+        from models import CacheEvent
+        from database import engine
+        table = CacheEvent.__table__
+        with engine.begin() as conn:
+            return conn.execute(table.delete().where(table.c.created_at < older_than)).rowcount
+
+
+class MemoryFeed:
+    """
+    Local stand-in with the same interface; events are visible immediately.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = [] # (id, topic, key, origin, created_at)
+
+    def append(self, connection, rows):
+        with self.lock:
+            for row in rows:
+                next_id = self.events[-1][0] + 1 if self.events else 1
+                self.events.append((next_id, row["topic"], row["key"], row["origin"], row["created_at"]))
+
+    def read(self, after_id, limit):
+        with self.lock:
+            return [e[:4] for e in self.events if e[0] > after_id][:limit]
+
+    def head(self):
+        with self.lock:
+            return self.events[-1][0] if self.events else 0
+
+    def prune(self, older_than):
+        with self.lock:
+            before = len(self.events)
+            self.events = [e for e in self.events if e[4] >= older_than]
+            return before - len(self.events)
+
+
+FEED = {"db": DatabaseFeed, "memory": MemoryFeed}.get(CACHE_BUS, lambda: None)()
+
+
+def subscribe(topic, handler):
+    _handlers.setdefault(topic, []).append(handler)
+
+
+def publish(connection, topic, key=None):
+    """
+    Appends one event. Pass the connection of the transaction making the
+    change (SQLAlchemy event hooks get it as an argument).
+    """
+    if FEED is None:
+        return
+    FEED.append(connection, [{"topic": topic, "key": None if key is None else str(key),
+                              "origin": ORIGIN, "created_at": datetime.utcnow()}])
+    metrics.inc("cache_bus_published_total", {"topic": topic}, help_text="Invalidation events published")
+
+
+def _dispatch(changes):
+    for topic, keys in changes.items():
+        for handler in _handlers.get(topic, []):
+            try:
+                handler(keys)
+            except Exception as e:
+                print(f"[ERROR] Cache bus handler for {topic} failed: {e}")
+        metrics.inc("cache_bus_applied_total", {"topic": topic}, help_text="Invalidation batches applied")
+
+
+def _merge(changes, topic, key):
+    if key is None or changes.get(topic, ()) is None:
+        changes[topic] = None
+    else:
+        changes.setdefault(topic, set()).add(key)
+
+
+class Poller(threading.Thread):
+    """
+    Applies feed events from other workers, in id order, one batch per poll.
+    """
+
+    def __init__(self, feed, interval=CACHE_BUS_POLL_SECONDS):
+        super().__init__(name="cache-bus", daemon=True)
+        self.feed = feed
+        self.interval = interval
+        self.stop_event = threading.Event()
+        # Events from before this worker started are already in its fresh caches
+        self.last_id = feed.head()
+        self.ahead = set() # applied ids past a gap
+        self.gap_since = None
+        self.last_poll = time.monotonic()
+        self.last_prune = time.monotonic()
+
+    def poll(self):
+        now = time.monotonic()
+        if now - self.last_poll > CACHE_BUS_RETENTION_SECONDS / 2:
+            # Stalled long enough that pruned events may have been missed
+            print("[WARN] Cache bus fell behind; invalidating all caches")
+            _dispatch({topic: None for topic in _handlers})
+            self.last_id, self.ahead, self.gap_since = self.feed.head(), set(), None
+        self.last_poll = now
+
+        changes = {}
+        for event_id, topic, key, origin in self.feed.read(self.last_id, CACHE_BUS_BATCH):
+            if event_id in self.ahead:
+                continue
+            self.ahead.add(event_id)
+            if origin != ORIGIN:
+                _merge(changes, topic, key)
+        if changes:
+            _dispatch(changes)
+
+        # Advance through contiguous ids; hold at a gap until it fills or times out
+        while self.last_id + 1 in self.ahead:
+            self.last_id += 1
+            self.ahead.discard(self.last_id)
+        if self.ahead:
+            self.gap_since = self.gap_since or now
+            if now - self.gap_since > GAP_WAIT_SECONDS:
+                self.last_id = min(self.ahead)
+                self.ahead.discard(self.last_id)
+                while self.last_id + 1 in self.ahead:
+                    self.last_id += 1
+                    self.ahead.discard(self.last_id)
+                self.gap_since = None
+        else:
+            self.gap_since = None
+
+        if now - self.last_prune > PRUNE_EVERY_SECONDS:
+            self.last_prune = now
+            self.feed.prune(datetime.utcnow() - timedelta(seconds=CACHE_BUS_RETENTION_SECONDS))
+        return changes
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"[ERROR] Cache bus poll failed: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+_poller = None
+
+
+def start():
+    """
+    Starts this process's poller (once). Subscribe handlers first.
+    """
+    global _poller
+    if FEED is None or _poller is not None:
+        return
+    _poller = Poller(FEED)
+    _poller.start()
+    print(f"[INFO] Cache bus ({CACHE_BUS}) polling every {CACHE_BUS_POLL_SECONDS}s as {ORIGIN}")
+
+
+# ------------------------
+# WRITE-SIDE HOOKS
+# ------------------------
+FACE_COLUMNS = ("face_encoding", "face_templates")
+
+
+def _user_changed(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[c].history.has_changes() for c in FACE_COLUMNS):
+        publish(connection, "gallery", target.id)
+
+
+def _user_deleted(mapper, connection, target):
+    publish(connection, "gallery", target.id)
+
+
+def _subject_changed(mapper, connection, target):
+    publish(connection, "timetable")
+
+
+def _attendance_changed(mapper, connection, target):
+    # Inserts need no event: a presence miss already falls back to the DB
+    publish(connection, "presence", target.subject_id)
+
+
+def register_listeners():
+    """
+    Publishes events for every ORM write that changes a cached view.
+    Call once per process that writes (API, CLIs). Core bulk statements do
+    not fire these; publish() by hand after them.
+    """
+    from models import User, Subject, Attendance
+    hooks = [
+        (User, "after_insert", _user_changed),
+        (User, "after_update", _user_changed),
+        (User, "after_delete", _user_deleted),
+        (Subject, "after_insert", _subject_changed),
+        (Subject, "after_update", _subject_changed),
+        (Subject, "after_delete", _subject_changed),
+        (Attendance, "after_update", _attendance_changed),
+        (Attendance, "after_delete", _attendance_changed),
+    ]
+    for model, event_name, hook in hooks:
+        if not event.contains(model, event_name, hook):
+            event.listen(model, event_name, hook)
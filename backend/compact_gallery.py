@@ -0,0 +1,194 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Compact in-memory gallery (GALLERY_MODE=int8 | float16, see utils).
+#
+# The default gallery keeps a float32 centroid and a float32 template block
+# per user as separate arrays in two dicts, plus a float32 copy of every
+# centroid for the shortlist matrix. Here each user costs one row of a
+# single quantized centroid block (128 bytes as int8 with one float32 scale
+# per row, 256 as float16) and nothing else:
+#
+#   1. the shortlist is scanned on the quantized rows, a chunk at a time
+#   2. the shortlisted users are re-ranked exactly against their float32
+#      templates, which are read from the database on demand and kept in a
+#      small LRU (a kiosk sees the same students over and over)
+#
+# The templates stay in the database, so a worker's resident gallery no
+# longer grows with templates per user.
+ENCODING_DIM = 128
+SCAN_CHUNK = 16384 # Rows dequantized at a time during a scan
+MODES = {"int8": np.int8, "float16": np.float16}
+
+
+def quantize(vectors, mode):
+    """
+    Returns (codes, scales) for float vectors (n x 128). int8 uses a
+    symmetric per-vector scale; float16 needs none (scales are 1).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    if mode == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize(codes, scales):
+    return codes.astype(np.float32) * scales[:, None]
+
+
+class CompactGallery:
+    """
+    Quantized centroid rows keyed by user id. Quacks like the dict it
+    replaces as far as the rest of the app is concerned (len, keys, in).
+    fetch_templates(user_ids) -> {user_id: float32 templates} is the source
+    of the exact re-rank.
+    """
+
+    def __init__(self, mode, fetch_templates, rerank_cache_size=1024):
+        if mode not in MODES:
+            raise ValueError(f"Unknown compact gallery mode {mode}")
+        self.mode = mode
+        self.fetch_templates = fetch_templates
+        self.rerank_cache_size = rerank_cache_size
+        self.rerank_cache = OrderedDict()
+        self.lock = threading.Lock()
+        self._set_rows(np.empty(0, dtype=np.int64), np.empty((0, ENCODING_DIM), dtype=MODES[mode]),
+                       np.empty(0, dtype=np.float32))
+
+    def _set_rows(self, ids, codes, scales):
+        self.ids = ids # -1 marks a freed row
+        self.codes = codes
+        self.scales = scales
+        # |c|^2 of the dequantized rows, so scan distances are self-consistent
+        self.sq_norms = (dequantize(codes, scales) ** 2).sum(axis=1) if len(ids) else np.empty(0, dtype=np.float32)
+        self.sq_norms[ids < 0] = np.inf
+        self.size = len(ids)
+        self.free = [int(i) for i in np.flatnonzero(ids < 0)]
+
+    def load(self, user_ids, centroids):
+        codes, scales = quantize(centroids, self.mode)
+        with self.lock:
+            self._set_rows(np.asarray(user_ids, dtype=np.int64), codes, scales)
+            self.rerank_cache.clear()
+
+    # --- dict-like view ---
+    def __len__(self):
+        return self.size - len(self.free)
+
+    def __contains__(self, user_id):
+        return bool((self.ids[:self.size] == user_id).any())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        ids = self.ids[:self.size]
+        return [int(i) for i in ids[ids >= 0]]
+
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.ids, self.codes, self.scales, self.sq_norms))
+
+    # --- updates ---
+    def _row_of(self, user_id):
+        rows = np.flatnonzero(self.ids[:self.size] == user_id)
+        return int(rows[0]) if len(rows) else None
+
+    def set(self, user_id, templates):
+        templates = np.asarray(templates, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        codes, scales = quantize(templates.mean(axis=0), self.mode)
+        with self.lock:
+            row = self._row_of(user_id)
+            if row is None and self.free:
+                row = self.free.pop()
+            if row is None:
+                if self.size == len(self.ids):
+                    # Grow by doubling into new arrays; running scans keep the old ones
+                    capacity = max(16, 2 * len(self.ids))
+                    grow = capacity - len(self.ids)
+                    self.ids = np.concatenate([self.ids, np.full(grow, -1, dtype=np.int64)])
+                    self.codes = np.concatenate([self.codes, np.zeros((grow, ENCODING_DIM), dtype=self.codes.dtype)])
+                    self.scales = np.concatenate([self.scales, np.ones(grow, dtype=np.float32)])
+                    self.sq_norms = np.concatenate([self.sq_norms, np.full(grow, np.inf, dtype=np.float32)])
+                row = self.size
+                self.size += 1
+            self.codes[row] = codes[0]
+            self.scales[row] = scales[0]
+            self.sq_norms[row] = (dequantize(codes, scales) ** 2).sum()
+            self.ids[row] = user_id
+            self._cache_templates(user_id, templates)
+
+    def drop(self, user_id):
+        with self.lock:
+            row = self._row_of(user_id)
+            if row is None:
+                return False
+            self.ids[row] = -1
+            self.sq_norms[row] = np.inf
+            self.free.append(row)
+            self.rerank_cache.pop(user_id, None)
+            return True
+
+    # --- exact templates ---
+    def _cache_templates(self, user_id, templates):
+        self.rerank_cache[user_id] = templates
+        self.rerank_cache.move_to_end(user_id)
+        while len(self.rerank_cache) > self.rerank_cache_size:
+            self.rerank_cache.popitem(last=False)
+
+    def templates(self, user_ids):
+        """
+        {user_id: float32 templates} for the given users, from the LRU or,
+        in one call, from fetch_templates.
+        """
+        found, missing = {}, []
+        with self.lock:
+            for user_id in user_ids:
+                templates = self.rerank_cache.get(user_id)
+                if templates is None:
+                    missing.append(user_id)
+                else:
+                    self.rerank_cache.move_to_end(user_id)
+                    found[user_id] = templates
+        if missing:
+            fetched = self.fetch_templates(missing)
+            with self.lock:
+                for user_id, templates in fetched.items():
+                    self._cache_templates(user_id, templates)
+            found.update(fetched)
+        return found
+
+    # --- matching ---
+    def scan(self, probes, k):
+        """
+        Approximate nearest rows on the quantized data.
+        Returns (user ids, distances), both (probes x k), sorted by distance;
+        id -1 pads galleries smaller than k.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        with self.lock:
+            ids, codes, scales, sq_norms, size = self.ids, self.codes, self.scales, self.sq_norms, self.size
+        best_d = np.full((len(probes), k), np.inf, dtype=np.float32)
+        best_i = np.full((len(probes), k), -1, dtype=np.int64)
+        probe_norms = (probes ** 2).sum(axis=1)[:, None]
+        for start in range(0, size, SCAN_CHUNK):
+            end = min(start + SCAN_CHUNK, size)
+            dots = probes @ codes[start:end].astype(np.float32).T
+            if self.mode == "int8":
+                dots *= scales[start:end]
+            squared = probe_norms + sq_norms[start:end] - 2.0 * dots
+            merged_d = np.concatenate([best_d, squared], axis=1)
+            merged_i = np.concatenate([best_i, np.broadcast_to(np.arange(start, end), squared.shape)], axis=1)
+            keep = np.argpartition(merged_d, k - 1, axis=1)[:, :k] if merged_d.shape[1] > k else \
+                np.broadcast_to(np.arange(merged_d.shape[1]), (len(probes), merged_d.shape[1]))
+            best_d = np.take_along_axis(merged_d, keep, axis=1)
+            best_i = np.take_along_axis(merged_i, keep, axis=1)
+        order = np.argsort(best_d, axis=1)
+        best_d = np.sqrt(np.maximum(np.take_along_axis(best_d, order, axis=1), 0.0))
+        best_i = np.take_along_axis(best_i, order, axis=1)
+        user_ids = np.where(np.isfinite(best_d) & (best_i >= 0), ids[np.maximum(best_i, 0)], -1) if size else best_i
+        return user_ids, best_d
@@ -24,3 +24,30 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def add_missing_columns(base=None):
+    """
+    create_all() never alters existing tables, so nullable columns added to
+    the models later are backfilled here with ALTER TABLE ADD COLUMN, and
+    indexes added later are created.
+    """
+    from sqlalchemy import inspect, text
+    base = base or Base
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    with engine.begin() as conn:
+        for table in base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present or not column.nullable:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+                print(f"[INFO] Added column {table.name}.{column.name}")
+            indexed = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexed:
+                    index.create(conn)
+                    print(f"[INFO] Added index {index.name}")
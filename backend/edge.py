@@ -0,0 +1,191 @@
+import os
+import json
+import struct
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+import utils
+import presence
+import timetable
+
+# Server side of edge kiosk mode (see edge_kiosk.py for the agent).
+#
+# Gallery slice, application/octet-stream:
+#   header    "<4sHHqII": magic, format, flags (1 = delta), version, meta length, template count
+#   meta      UTF-8 JSON: {"members": [user ids in the slice],
+#                          "users": [[user_id, name, template count], ...]  (changed users only),
+#                          "subjects": [...]}                               (for kiosk display)
+#   templates float16 (template count x 128), in "users" order
+#
+# version is the newest face_updated_at in the slice (ms since epoch); a
+# kiosk sends it back as ?since= and only gets users changed after it.
+# "members" is always complete, so users who left the slice are dropped, and
+# a kiosk re-pulls with since=0 when it lists users it has no templates for
+# (joined the slice after the kiosk's version, enrolled before it).
+EDGE_SYNC_TOKEN = os.getenv("EDGE_SYNC_TOKEN", "")
+EDGE_MAX_SYNC_BATCH = 1000
+
+SLICE_MAGIC = b"GSL1"
+SLICE_FORMAT = 1
+SLICE_HEADER = struct.Struct("<4sHHqII")
+FLAG_DELTA = 1
+
+
+def _version(ts):
+    # Faces enrolled before face_updated_at existed count as version 1,
+    # so they are sent once and not again on every delta
+    return int(ts.timestamp() * 1000) if ts else 1
+
+
+def build_slice(db_session, room=None, department=None, since=0):
+    """
+    Returns (payload bytes, version) for the students a kiosk in room /
+    department may see: the room's enrolled students plus the department.
+    """
+    from models import User, Subject, StudentCourse
+    np = utils.np
+
+    subjects = db_session.query(Subject).filter(
+        or_(Subject.room == room, Subject.department == department) if room and department
+        else (Subject.room == room if room else Subject.department == department)
+    ).all()
+    room_subject_ids = [s.id for s in subjects if room and s.room == room]
+
+    membership = []
+    if department:
+        membership.append(User.department == department)
+    if room_subject_ids:
+        membership.append(User.id.in_(
+            db_session.query(StudentCourse.student_id).filter(StudentCourse.subject_id.in_(room_subject_ids))
+        ))
+    if not membership:
+        members = []
+    else:
+        members = db_session.query(User.id, User.face_updated_at).filter(
+            User.role == "student", User.face_encoding.isnot(None), or_(*membership)
+        ).all()
+
+    version = max([_version(ts) for _, ts in members] or [0])
+    changed_ids = [uid for uid, ts in members if since <= 0 or _version(ts) > since]
+
+    users, blocks = [], []
+    if changed_ids:
+        rows = db_session.query(User.id, User.name, User.face_encoding, User.face_templates).filter(
+            User.id.in_(changed_ids)
+        ).all()
+        for uid, name, face_encoding, face_templates in rows:
+            if face_templates:
+                templates = utils.templates_from_bytes(face_templates)
+            else:
+                templates = np.asarray(json.loads(face_encoding), dtype=np.float32).reshape(1, utils.ENCODING_DIM)
+            users.append([uid, name, len(templates)])
+            blocks.append(templates)
+
+    meta = json.dumps({
+        "members": sorted(uid for uid, _ in members),
+        "users": users,
+        "subjects": [
+            {"id": s.id, "name": s.name, "room": s.room, "department": s.department, "weekdays": s.weekdays,
+             "weekday_numbers": sorted(s.weekday_numbers()),
+             "start_time": s.start_time.isoformat() if s.start_time else None,
+             "end_time": s.end_time.isoformat() if s.end_time else None}
+            for s in subjects
+        ],
+    }, separators=(",", ":")).encode("utf-8")
+    templates = np.vstack(blocks).astype("<f2") if blocks else np.empty((0, utils.ENCODING_DIM), dtype="<f2")
+    header = SLICE_HEADER.pack(SLICE_MAGIC, SLICE_FORMAT, FLAG_DELTA if since > 0 else 0, version, len(meta), len(templates))
+    return header + meta + templates.tobytes(), version
+
+
+def apply_sync(db_session, kiosk_id, room, marks):
+    """
+    Records a batch of offline marks. Idempotent per mark_id: marks already
+    synced are reported as duplicates and never inserted again.
+    Returns {"results": [{"mark_id", "result"}], "counts": {...}}.
+    """
+    from models import User, Attendance, EdgeMark
+
+    # A mark_id sent twice in one batch counts once
+    marks = list({m.mark_id: m for m in marks}.values())
+    mark_ids = [m.mark_id for m in marks]
+
+    seen = {mid: result for mid, result in db_session.query(EdgeMark.mark_id, EdgeMark.result).filter(
+        EdgeMark.mark_id.in_(mark_ids)
+    ).all()}
+    fresh = [m for m in marks if m.mark_id not in seen]
+
+    departments = dict(db_session.query(User.id, User.department).filter(
+        User.id.in_({m.user_id for m in fresh}), User.role == "student"
+    ).all()) if fresh else {}
+
+    # Resolve each mark to the class running in that room at that time
+    indexes = {}
+    resolved = []  # (mark, subject_id or None, result)
+    for m in fresh:
+        if m.user_id not in departments:
+            resolved.append((m, None, "unknown_user"))
+            continue
+        seen_at = m.seen_at.replace(tzinfo=None)
+        day = seen_at.date()
+        if day not in indexes:
+            indexes[day] = timetable.index_for(db_session, day)
+        session = timetable.resolve(db_session, now=seen_at, room=room, department=departments[m.user_id], index=indexes[day])
+        resolved.append((m, session.subject_id if session else None, "pending" if session else "no_class"))
+
+    # One query for existing attendance across the whole batch
+    pending = [(m, sid) for m, sid, result in resolved if result == "pending"]
+    existing = set()
+    if pending:
+        days = [m.seen_at.replace(tzinfo=None).date() for m, _ in pending]
+        start = datetime.combine(min(days), datetime.min.time())
+        end = datetime.combine(max(days), datetime.min.time()) + timedelta(days=1)
+        rows = db_session.query(Attendance.user_id, Attendance.subject_id, Attendance.date).filter(
+            Attendance.user_id.in_({m.user_id for m, _ in pending}),
+            Attendance.subject_id.in_({sid for _, sid in pending}),
+            Attendance.date >= start,
+            Attendance.date < end,
+        ).all()
+        existing = {(uid, sid, d.date()) for uid, sid, d in rows}
+
+    new_rows, edge_rows, results = [], [], []
+    for m, sid, result in resolved:
+        seen_at = m.seen_at.replace(tzinfo=None)
+        attendance = None
+        if result == "pending":
+            key = (m.user_id, sid, seen_at.date())
+            if key in existing:
+                result = "already_marked"
+            else:
+                existing.add(key)
+                attendance = Attendance(user_id=m.user_id, subject_id=sid, date=seen_at, status="present")
+                new_rows.append(attendance)
+                result = "marked"
+        edge_rows.append((EdgeMark(mark_id=m.mark_id, kiosk_id=kiosk_id, user_id=m.user_id,
+                                   seen_at=seen_at, result=result), attendance))
+        results.append({"mark_id": m.mark_id, "result": result})
+
+    try:
+        db_session.add_all(new_rows)
+        db_session.flush()
+        for edge_row, attendance in edge_rows:
+            if attendance is not None:
+                edge_row.attendance_id = attendance.id
+        db_session.add_all([edge_row for edge_row, _ in edge_rows])
+        db_session.commit()
+    except IntegrityError:
+        # A concurrent sync of the same batch won the race; what it stored is the answer
+        db_session.rollback()
+        return apply_sync(db_session, kiosk_id, room, marks)
+
+    today = datetime.now().date()
+    for attendance in new_rows:
+        if attendance.date.date() == today:
+            presence.mark(attendance.user_id, attendance.subject_id)
+
+    results += [{"mark_id": mid, "result": "duplicate"} for mid in mark_ids if mid in seen]
+    counts = {}
+    for r in results:
+        counts[r["result"]] = counts.get(r["result"], 0) + 1
+    return {"results": results, "counts": counts}
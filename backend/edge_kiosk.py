@@ -0,0 +1,392 @@
+"""
+Edge kiosk agent: runs on (or next to) a classroom kiosk and keeps
+marking attendance while the central server is slow or unreachable.
+
+It serves the same POST /attendance/auto-mark contract as main.py, but
+detects, encodes and matches locally against a slice of the gallery (the
+room's enrolled students and the department, float16). Every recognition
+is written to a local SQLite journal first and answered immediately.
+Two background threads keep it in step with the server:
+
+  pull  GET  /edge/gallery?since=<version>   only users whose face changed
+  push  POST /edge/sync                       unsynced journal rows, in batches
+
+The server decides what each mark means (which class, duplicates) when it
+syncs; mark ids make the push safe to repeat after a timeout.
+
+Run it on the kiosk (from backend/):
+    EDGE_SERVER_URL=https://attendance.example EDGE_SYNC_TOKEN=... EDGE_ROOM="Lab 1" \\
+        uvicorn edge_kiosk:app --port 8100
+and point the kiosk page at it: /kiosk?edge=http://localhost:8100
+"""
+import io
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi.middleware.cors import CORSMiddleware
+
+import utils
+from edge import SLICE_HEADER, SLICE_MAGIC, SLICE_FORMAT, FLAG_DELTA
+
+EDGE_SERVER_URL = os.getenv("EDGE_SERVER_URL", "http://127.0.0.1:8000").rstrip("/")
+EDGE_SYNC_TOKEN = os.getenv("EDGE_SYNC_TOKEN", "")
+EDGE_KIOSK_ID = os.getenv("EDGE_KIOSK_ID", "") or os.uname().nodename
+EDGE_ROOM = os.getenv("EDGE_ROOM") or None
+EDGE_DEPARTMENT = os.getenv("EDGE_DEPARTMENT") or None
+EDGE_DATA_DIR = os.getenv("EDGE_DATA_DIR", os.path.join(utils.APP_DIR, "edge_data"))
+EDGE_PULL_INTERVAL = float(os.getenv("EDGE_PULL_INTERVAL", "60"))
+EDGE_PUSH_INTERVAL = float(os.getenv("EDGE_PUSH_INTERVAL", "5"))
+EDGE_PUSH_BATCH = int(os.getenv("EDGE_PUSH_BATCH", "200"))
+EDGE_COOLDOWN = float(os.getenv("EDGE_COOLDOWN", "300")) # Seconds before the same student is journaled again
+EDGE_TIMEOUT = float(os.getenv("EDGE_TIMEOUT", "10"))
+
+GALLERY_PATH = os.path.join(EDGE_DATA_DIR, "gallery.npz")
+JOURNAL_PATH = os.path.join(EDGE_DATA_DIR, "edge_journal.db")
+
+app = FastAPI(title="Edge Attendance Kiosk")
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+def parse_slice(payload):
+    """
+    Returns (flags, version, meta, templates float32) from a /edge/gallery body.
+    """
+    np = utils.np
+    magic, fmt, flags, version, meta_len, count = SLICE_HEADER.unpack_from(payload)
+    if magic != SLICE_MAGIC or fmt != SLICE_FORMAT:
+        raise ValueError("Not a gallery slice")
+    start = SLICE_HEADER.size
+    meta = json.loads(payload[start:start + meta_len].decode("utf-8"))
+    templates = np.frombuffer(payload, dtype="<f2", count=count * utils.ENCODING_DIM, offset=start + meta_len)
+    return flags, version, meta, templates.astype(np.float32).reshape(count, utils.ENCODING_DIM)
+
+
+class Gallery:
+    """
+    The local slice. Deltas replace changed users in place; the member list
+    in every response drops users who left the room or department.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.names = {}
+        self.templates = {} # user_id -> float32 (n, 128)
+        self.subjects = []
+        self.missing = set() # Members the server listed but sent no templates for
+        self._matrix = None
+        self._owners = None
+
+    def apply(self, payload):
+        flags, version, meta, templates = parse_slice(payload)
+        with self.lock:
+            names = dict(self.names) if flags & FLAG_DELTA else {}
+            per_user = dict(self.templates) if flags & FLAG_DELTA else {}
+            offset = 0
+            for user_id, name, count in meta["users"]:
+                names[user_id] = name
+                per_user[user_id] = templates[offset:offset + count]
+                offset += count
+            members = set(meta["members"])
+            self.missing = members - set(per_user)
+            self.names = {uid: n for uid, n in names.items() if uid in members}
+            self.templates = {uid: t for uid, t in per_user.items() if uid in members}
+            self.subjects = meta["subjects"]
+            self.version = version
+            self._matrix = None
+        return len(meta["users"])
+
+    def match(self, encoding, tolerance=utils.MATCH_TOLERANCE):
+        """
+        Returns (user_id, distance) of the closest template, or (None, distance).
+        """
+        np = utils.np
+        with self.lock:
+            if self._matrix is None and self.templates:
+                self._owners = np.concatenate([np.full(len(t), uid) for uid, t in self.templates.items()])
+                self._matrix = np.vstack(list(self.templates.values()))
+            matrix, owners = self._matrix, self._owners
+        if matrix is None:
+            return None, None
+        distances = np.linalg.norm(matrix - np.asarray(encoding, dtype=np.float32), axis=1)
+        best = int(distances.argmin())
+        distance = float(distances[best])
+        return (int(owners[best]) if distance <= tolerance else None), distance
+
+    def save(self, path):
+        """
+        Writes the merged slice (float16, like the wire format) so a restart
+        works offline and resumes from the same version.
+        """
+        np = utils.np
+        with self.lock:
+            ids = list(self.templates)
+            meta = {"version": self.version, "subjects": self.subjects,
+                    "users": [[uid, self.names[uid], len(self.templates[uid])] for uid in ids]}
+            templates = np.vstack([self.templates[uid] for uid in ids]) if ids else np.empty((0, utils.ENCODING_DIM))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+                     templates=templates.astype("<f2"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        np = utils.np
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            templates = data["templates"].astype(np.float32)
+        with self.lock:
+            offset = 0
+            for user_id, name, count in meta["users"]:
+                self.names[user_id] = name
+                self.templates[user_id] = templates[offset:offset + count]
+                offset += count
+            self.subjects = meta["subjects"]
+            self.version = meta["version"]
+            self._matrix = None
+
+    def current_subject(self, room=None, now=None):
+        """
+        Best-effort display of the running class; the server has the final say.
+        """
+        now = now or datetime.now()
+        for subject in self.subjects:
+            if room and subject["room"] != room:
+                continue
+            # Parsed by the server (Subject.weekday_numbers), so both sides agree on "mon,wed" or "Monday"
+            days = subject.get("weekday_numbers")
+            if days is not None and now.weekday() not in days:
+                continue
+            if not subject["start_time"] or not subject["end_time"]:
+                continue
+            if subject["start_time"] <= now.strftime("%H:%M:%S") <= subject["end_time"]:
+                return subject
+        return None
+
+
+class Journal:
+    """
+    Local write-ahead record of every mark taken on this kiosk.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS marks ("
+            " mark_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, seen_at TEXT NOT NULL,"
+            " distance REAL, result TEXT, synced_at TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_marks_unsynced ON marks (synced_at) WHERE synced_at IS NULL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_marks_user ON marks (user_id, seen_at)")
+
+    def record(self, user_id, distance, now=None):
+        """
+        Journals a sighting unless the student was journaled within EDGE_COOLDOWN.
+        Returns the new mark_id, or None during the cooldown.
+        """
+        now = now or datetime.now()
+        cutoff = datetime.fromtimestamp(now.timestamp() - EDGE_COOLDOWN).isoformat()
+        with self.lock:
+            recent = self.conn.execute(
+                "SELECT 1 FROM marks WHERE user_id = ? AND seen_at >= ? LIMIT 1", (user_id, cutoff)
+            ).fetchone()
+            if recent:
+                return None
+            mark_id = f"{EDGE_KIOSK_ID}:{uuid.uuid4().hex}"
+            self.conn.execute(
+                "INSERT INTO marks (mark_id, user_id, seen_at, distance) VALUES (?, ?, ?, ?)",
+                (mark_id, user_id, now.isoformat(), distance),
+            )
+            return mark_id
+
+    def unsynced(self, limit):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT mark_id, user_id, seen_at, distance FROM marks WHERE synced_at IS NULL ORDER BY seen_at LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def mark_synced(self, results):
+        synced_at = datetime.now().isoformat()
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "UPDATE marks SET result = ?, synced_at = ? WHERE mark_id = ?",
+                [(r["result"], synced_at, r["mark_id"]) for r in results],
+            )
+            self.conn.execute("COMMIT")
+
+    def pending_count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM marks WHERE synced_at IS NULL").fetchone()[0]
+
+
+os.makedirs(EDGE_DATA_DIR, exist_ok=True)
+gallery = Gallery()
+journal = Journal(JOURNAL_PATH)
+SYNC_STATE = {"last_pull": None, "last_push": None, "last_error": None}
+
+
+# ------------------------
+# SERVER SYNC
+# ------------------------
+def _server(method, path, params=None, body=None):
+    url = f"{EDGE_SERVER_URL}{path}"
+    if params:
+        url += "?" + urllib.parse.urlencode({k: v for k, v in params.items() if v is not None})
+    headers = {"X-Edge-Token": EDGE_SYNC_TOKEN}
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(url, data=data, headers=headers, method=method)
+    with urllib.request.urlopen(req, timeout=EDGE_TIMEOUT) as resp:
+        return resp.read()
+
+
+def pull_gallery():
+    """
+    Fetches the gallery delta since the local version and saves the merged
+    slice when anything changed.
+    """
+    version = gallery.version
+    payload = _server("GET", "/edge/gallery",
+                      {"room": EDGE_ROOM, "department": EDGE_DEPARTMENT, "since": version})
+    changed = gallery.apply(payload)
+    if gallery.missing and version:
+        # Students who joined the slice (department change, new course) after
+        # our version but enrolled before it are not in the delta
+        print(f"[INFO] {len(gallery.missing)} slice members without templates, pulling the full slice")
+        changed = gallery.apply(_server("GET", "/edge/gallery",
+                                        {"room": EDGE_ROOM, "department": EDGE_DEPARTMENT, "since": 0}))
+    if changed or gallery.version != version or not os.path.exists(GALLERY_PATH):
+        gallery.save(GALLERY_PATH)
+    SYNC_STATE["last_pull"] = datetime.now().isoformat()
+    if changed:
+        print(f"[INFO] Gallery slice v{gallery.version}: {changed} users updated, {len(gallery.names)} in slice")
+
+
+def push_marks():
+    """
+    Sends unsynced journal rows until the backlog is empty.
+    """
+    while True:
+        rows = journal.unsynced(EDGE_PUSH_BATCH)
+        if not rows:
+            return
+        body = {
+            "kiosk_id": EDGE_KIOSK_ID,
+            "room": EDGE_ROOM,
+            "marks": [{"mark_id": m, "user_id": u, "seen_at": s, "distance": d} for m, u, s, d in rows],
+        }
+        response = json.loads(_server("POST", "/edge/sync", body=body))
+        journal.mark_synced(response["results"])
+        SYNC_STATE["last_push"] = datetime.now().isoformat()
+        print(f"[INFO] Synced {len(rows)} marks: {response['counts']}")
+        if len(rows) < EDGE_PUSH_BATCH:
+            return
+
+
+def _sync_loop(action, interval):
+    while True:
+        try:
+            action()
+            SYNC_STATE["last_error"] = None
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            # Offline is the normal case this agent exists for; keep journaling and retry
+            SYNC_STATE["last_error"] = f"{action.__name__}: {e}"
+        time.sleep(interval)
+
+
+@app.on_event("startup")
+def startup_event():
+    if os.path.exists(GALLERY_PATH):
+        gallery.load(GALLERY_PATH)
+        print(f"[INFO] Loaded gallery slice: {len(gallery.names)} students")
+    threading.Thread(target=_sync_loop, args=(pull_gallery, EDGE_PULL_INTERVAL), name="edge-pull", daemon=True).start()
+    threading.Thread(target=_sync_loop, args=(push_marks, EDGE_PUSH_INTERVAL), name="edge-push", daemon=True).start()
+    threading.Thread(target=utils.load_vision, name="vision-import", daemon=True).start()
+
+
+# ------------------------
+# KIOSK API
+# ------------------------
+def _encode_probe(content):
+    if not utils.load_vision():
+        raise HTTPException(status_code=503, detail="Face recognition is not available on this kiosk")
+    image = utils.face_recognition.load_image_file(io.BytesIO(content))
+    locations = utils.detect_faces(image, "kiosk")
+    if not locations:
+        return None
+    utils.gate_face(image, locations[0], "kiosk")
+    return utils.encode_crops([utils.face_crop(image, locations[0])])[0]
+
+
+@app.post("/attendance/auto-mark")
+async def auto_mark_attendance(file: UploadFile = File(...), room: str = Form(None)):
+    content = await file.read()
+    try:
+        encoding = _encode_probe(content)
+    except utils.FaceQualityError as e:
+        raise HTTPException(status_code=422, detail={"reason": e.reason, "message": str(e)})
+
+    user_id, distance = gallery.match(encoding) if encoding is not None else (None, None)
+    if not user_id:
+        raise HTTPException(status_code=404, detail="Face not recognized.")
+
+    name = gallery.names.get(user_id, "student")
+    subject = gallery.current_subject(room or EDGE_ROOM)
+    if not subject:
+        return {
+            "status": "partial",
+            "student_name": name,
+            "message": f"Welcome, {name}. No class is currently scheduled.",
+            "subject": None
+        }
+
+    # The server re-resolves the class from seen_at when the mark is synced
+    if journal.record(user_id, distance) is None:
+        return {
+            "status": "success",
+            "student_name": name,
+            "subject": subject["name"],
+            "message": f"Already marked for {subject['name']}."
+        }
+    return {
+        "status": "success",
+        "student_name": name,
+        "subject": subject["name"],
+        "message": f"Attendance marked for {subject['name']}"
+    }
+
+
+@app.get("/health/ready")
+def readiness_check():
+    return {
+        "ready": bool(gallery.names),
+        "kiosk_id": EDGE_KIOSK_ID,
+        "gallery_version": gallery.version,
+        "gallery_students": len(gallery.names),
+        "pending_marks": journal.pending_count(),
+        **SYNC_STATE,
+    }
@@ -0,0 +1,252 @@
+import os
+import io
+import csv
+import json
+import argparse
+import itertools
+import threading
+
+from sqlalchemy import event, select, func, case
+
+import utils
+import metrics
+
+# Institution-wide eligibility report: the Eligible / Warning / Shortage
+# breakdown of the student dashboard, for every student at once.
+#
+# One grouped query returns (student, subject, classes, present) counts for
+# the live attendance table (the current term, see attendance_archive.py).
+# Overall and per-subject percentages and bands are then computed on whole
+# arrays, so the cost is one scan of the table plus O(rows) NumPy work.
+# NumPy is only imported once a report is built, so API-only workers
+# (VISION_MODE=remote) still start without it.
+#
+# A built report is cached until the next attendance write: locally through
+# ORM listeners (register_listeners), from other workers through their
+# presence events on the cache bus (updates, deletes, term archival), and for
+# inserts made elsewhere through the table's max id, checked per request.
+SHORTAGE_PCT = float(os.getenv("ELIGIBILITY_SHORTAGE_PCT", "65"))
+WARNING_PCT = float(os.getenv("ELIGIBILITY_WARNING_PCT", "75"))
+BANDS = ("Shortage", "Warning", "Eligible")
+STREAM_CHUNK = 1000 # Students per yielded chunk
+NO_SUBJECT = 0 # subject_id of records without a subject in the grouped counts
+
+_cache = {}
+_version = 0
+_lock = threading.Lock()
+
+
+def bands(percentages, shortage=SHORTAGE_PCT, warning=WARNING_PCT):
+    """
+    Band index per percentage: 0 Shortage, 1 Warning, 2 Eligible.
+    """
+    np = utils.np
+    return np.where(percentages < shortage, 0, np.where(percentages < warning, 1, 2))
+
+
+def status_for(percentage, shortage=SHORTAGE_PCT, warning=WARNING_PCT):
+    if percentage < shortage:
+        return BANDS[0]
+    return BANDS[1] if percentage < warning else BANDS[2]
+
+
+def _percent(attended, total):
+    np = utils.np
+    return np.divide(attended * 100.0, total, out=np.zeros(len(total)), where=total > 0)
+
+
+class EligibilityReport:
+    def __init__(self, students, subjects, counts, shortage, warning):
+        """
+        students: (ids, names, roll numbers, departments), ids sorted
+        subjects: {id: (code, name)}
+        counts:   int64 array of (user_id, subject_id, total, attended) rows,
+                  subject_id NO_SUBJECT for records without a subject
+        """
+        np = utils.np
+        self.student_ids, self.names, self.rolls, self.departments = students
+        self.subjects = subjects
+        self.shortage, self.warning = shortage, warning
+        n = len(self.student_ids)
+
+        # Keep counts of listed students only, grouped by student
+        pos = np.searchsorted(self.student_ids, counts[:, 0])
+        keep = pos < n
+        keep[keep] = self.student_ids[pos[keep]] == counts[keep, 0]
+        counts, pos = counts[keep], pos[keep]
+
+        # Overall figures count every record, like the student dashboard
+        self.total = np.bincount(pos, weights=counts[:, 2], minlength=n).astype(np.int64)
+        self.attended = np.bincount(pos, weights=counts[:, 3], minlength=n).astype(np.int64)
+        self.pct = _percent(self.attended, self.total)
+        self.band = bands(self.pct, shortage, warning)
+
+        # Records without a subject have no row in the per-subject breakdown
+        has_subject = counts[:, 1] != NO_SUBJECT
+        counts, pos = counts[has_subject], pos[has_subject]
+        order = np.lexsort((counts[:, 1], pos))
+        self.pos = pos[order]
+        self.subject_ids = counts[order, 1]
+        self.sub_total = counts[order, 2]
+        self.sub_attended = counts[order, 3]
+        self.sub_pct = _percent(self.sub_attended, self.sub_total)
+        self.sub_band = bands(self.sub_pct, shortage, warning)
+        # Row range of each student's subjects
+        self.bounds = np.searchsorted(self.pos, np.arange(n + 1))
+
+    def summary(self):
+        counts = utils.np.bincount(self.band, minlength=len(BANDS))
+        return {
+            "students": int(len(self.student_ids)),
+            "thresholds": {"shortage": self.shortage, "warning": self.warning},
+            **{str(name): int(count) for name, count in zip(BANDS, counts)},
+        }
+
+    def _subject_code(self, subject_id):
+        return self.subjects.get(int(subject_id), (str(subject_id), ""))[0]
+
+    def iter_csv(self):
+        np = utils.np
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["student_id", "name", "roll_number", "department", "subject",
+                         "total", "attended", "percentage", "status"])
+        pct, sub_pct = np.round(self.pct, 1), np.round(self.sub_pct, 1)
+        for start in range(0, len(self.student_ids), STREAM_CHUNK):
+            for i in range(start, min(start + STREAM_CHUNK, len(self.student_ids))):
+                who = [int(self.student_ids[i]), self.names[i], self.rolls[i], self.departments[i]]
+                writer.writerow(who + ["OVERALL", int(self.total[i]), int(self.attended[i]), pct[i], BANDS[self.band[i]]])
+                for j in range(self.bounds[i], self.bounds[i + 1]):
+                    writer.writerow(who + [self._subject_code(self.subject_ids[j]), int(self.sub_total[j]),
+                                           int(self.sub_attended[j]), sub_pct[j], BANDS[self.sub_band[j]]])
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+
+    def iter_json(self):
+        np = utils.np
+        yield '{"summary": ' + json.dumps(self.summary()) + ', "students": ['
+        pct, sub_pct = np.round(self.pct, 1).tolist(), np.round(self.sub_pct, 1).tolist()
+        for start in range(0, len(self.student_ids), STREAM_CHUNK):
+            chunk = []
+            for i in range(start, min(start + STREAM_CHUNK, len(self.student_ids))):
+                chunk.append(json.dumps({
+                    "student_id": int(self.student_ids[i]),
+                    "name": self.names[i],
+                    "roll_number": self.rolls[i],
+                    "department": self.departments[i],
+                    "total": int(self.total[i]),
+                    "attended": int(self.attended[i]),
+                    "percentage": pct[i],
+                    "status": str(BANDS[self.band[i]]),
+                    "subjects": [
+                        {"code": self._subject_code(self.subject_ids[j]), "total": int(self.sub_total[j]),
+                         "attended": int(self.sub_attended[j]), "percentage": sub_pct[j],
+                         "status": str(BANDS[self.sub_band[j]])}
+                        for j in range(self.bounds[i], self.bounds[i + 1])
+                    ],
+                }))
+            yield ("," if start else "") + ",".join(chunk)
+        yield "]}"
+
+
+def build(db_session, department=None, shortage=SHORTAGE_PCT, warning=WARNING_PCT):
+    from models import User, Subject, Attendance
+    np = utils.np
+
+    student_query = db_session.query(User.id, User.name, User.roll_number, User.department).filter(User.role == "student")
+    if department:
+        student_query = student_query.filter(User.department == department)
+    rows = student_query.order_by(User.id).all()
+    students = (np.array([r.id for r in rows], dtype=np.int64),
+                [r.name for r in rows], [r.roll_number for r in rows], [r.department for r in rows])
+
+    subjects = {sid: (code, name) for sid, code, name in db_session.query(Subject.id, Subject.code, Subject.name).all()}
+
+    # Same counting as the student dashboard: every record is a class, "present" is attended
+    grouped = db_session.execute(
+        select(Attendance.user_id, func.coalesce(Attendance.subject_id, NO_SUBJECT), func.count(),
+               func.sum(case((Attendance.status == "present", 1), else_=0)))
+        .where(Attendance.user_id.isnot(None))
+        .group_by(Attendance.user_id, Attendance.subject_id)
+    )
+    # Streamed straight into one array; np.array() over Row objects is several times slower
+    counts = np.fromiter(itertools.chain.from_iterable(grouped), dtype=np.int64).reshape(-1, 4)
+    return EligibilityReport(students, subjects, counts, shortage, warning)
+
+
+def _fingerprint(db_session):
+    # Index lookup; count(*) would scan the table on every request
+    from models import Attendance
+    return db_session.execute(select(func.max(Attendance.id))).scalar()
+
+
+def get_report(db_session, department=None, shortage=SHORTAGE_PCT, warning=WARNING_PCT):
+    """
+    Cached build(); rebuilt after any attendance write.
+    """
+    key = (department, shortage, warning)
+    fingerprint = _fingerprint(db_session)
+    with _lock:
+        version = _version
+        cached = _cache.get(key)
+        if cached and cached[0] == (version, fingerprint):
+            metrics.cache_lookup("eligibility", True)
+            return cached[1]
+    metrics.cache_lookup("eligibility", False)
+    report = build(db_session, department, shortage, warning)
+    with _lock:
+        # Left uncached if a write happened while building
+        if _version == version:
+            _cache[key] = ((version, fingerprint), report)
+    return report
+
+
+def invalidate(*args):
+    global _version
+    with _lock:
+        _version += 1
+        _cache.clear()
+
+
+def register_listeners():
+    """
+    Drops cached reports whenever an Attendance row is written in this process.
+    """
+    from models import Attendance
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        if not event.contains(Attendance, event_name, invalidate):
+            event.listen(Attendance, event_name, invalidate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Attendance eligibility report for all students")
+    parser.add_argument("--format", choices=("csv", "json"), default="csv")
+    parser.add_argument("--out", default=None, help="Output file (default: stdout)")
+    parser.add_argument("--department", default=None)
+    parser.add_argument("--shortage", type=float, default=SHORTAGE_PCT, help="Below this percentage: Shortage")
+    parser.add_argument("--warning", type=float, default=WARNING_PCT, help="Below this percentage: Warning")
+    args = parser.parse_args()
+
+    import sys
+    import time
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        started = time.time()
+        report = build(db, args.department, args.shortage, args.warning)
+        out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+        try:
+            for chunk in (report.iter_csv() if args.format == "csv" else report.iter_json()):
+                out.write(chunk)
+        finally:
+            if args.out:
+                out.close()
+        print(f"[INFO] {report.summary()} in {time.time() - started:.2f}s", file=sys.stderr)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"[FATAL ERROR] {e}", file=sys.stderr)
+    finally:
+        db.close()
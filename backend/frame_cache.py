@@ -0,0 +1,79 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import metrics
+import utils
+
+# Short-lived "same frame as last time" cache for kiosks and live classrooms.
+# Each source (kiosk / teacher session) remembers the signature of the last
+# frame it had recognized and the result. A new frame whose signature barely
+# differs is answered from the cache without decode/detect/encode/match.
+FRAME_CACHE_TTL = float(os.getenv("FRAME_CACHE_TTL", "10")) # seconds
+FRAME_DIFF_THRESHOLD = float(os.getenv("FRAME_DIFF_THRESHOLD", "4.0")) # mean abs gray-level diff
+FRAME_CACHE_MAX_SOURCES = 1024
+SIGNATURE_SIZE = 16
+
+# Structure: { source_key: (signature, result, stored_at) }
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+MISS = object()
+
+
+def signature(content: bytes):
+    """
+    Returns a 16x16 grayscale thumbnail of an encoded image, or None if it
+    cannot be decoded. JPEGs are decoded at 1/8 scale, which is very cheap.
+    Without OpenCV, and in VISION_MODE=remote (the API worker must not load
+    the vision stack), every frame is a cache miss.
+    """
+    if utils.VISION_MODE == "remote":
+        return None
+    try:
+        import numpy as np
+        import cv2
+    except ImportError:
+        return None
+    buf = np.frombuffer(content, dtype=np.uint8)
+    image = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    thumb = cv2.resize(image, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA)
+    return thumb.astype(np.int16)
+
+
+def lookup(source_key: str, sig):
+    """
+    Returns the cached result for source_key if the frame is effectively
+    unchanged and the entry is still fresh, otherwise MISS.
+    """
+    if sig is None:
+        return MISS
+    import numpy as np
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(source_key)
+        if entry is not None:
+            last_sig, result, stored_at = entry
+            if now - stored_at <= FRAME_CACHE_TTL and np.abs(sig - last_sig).mean() < FRAME_DIFF_THRESHOLD:
+                metrics.cache_lookup("frame", True)
+                return result
+    metrics.cache_lookup("frame", False)
+    return MISS
+
+
+def store(source_key: str, sig, result):
+    if sig is None:
+        return
+    with _lock:
+        _entries[source_key] = (sig, result, time.monotonic())
+        _entries.move_to_end(source_key)
+        while len(_entries) > FRAME_CACHE_MAX_SOURCES:
+            _entries.popitem(last=False)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,193 @@
+import io
+import os
+import uuid
+import hashlib
+
+import utils
+import metrics
+
+# Content-addressed storage for uploaded photos.
+#
+# A file is stored once under the SHA-256 of its bytes, in two levels of
+# 256-way shard directories (ab/cd/abcd...), so re-uploads cost nothing and
+# no folder grows to millions of entries. Originals are kept byte for byte;
+# a small thumbnail is derived once per image for the UI. The face encoding
+# computed for an image is memoized per (hash, profile) in image_encodings.
+#
+# IMAGE_STORE_BACKEND selects the backend class from BACKENDS; anything
+# with put / get / exists / delete / thumbnail can be registered there.
+IMAGE_STORE_BACKEND = os.getenv("IMAGE_STORE_BACKEND", "local")
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(utils.APP_DIR, "image_store"))
+THUMBNAIL_PX = int(os.getenv("THUMBNAIL_PX", "160")) # Longest side
+THUMBNAIL_QUALITY = 80
+
+MEDIA_TYPES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def media_type(content: bytes) -> str:
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, kind in MEDIA_TYPES:
+        if content.startswith(magic):
+            return kind
+    return "application/octet-stream"
+
+
+def make_thumbnail(content: bytes, size=THUMBNAIL_PX):
+    """
+    Returns (bytes, media type) of a copy whose longest side is at most
+    size, as WebP (JPEG if this OpenCV build has no WebP encoder).
+    """
+    cv2, np = utils.cv2, utils.np
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Not a decodable image")
+    scale = size / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, THUMBNAIL_QUALITY])
+    if ok:
+        return encoded.tobytes(), "image/webp"
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    return encoded.tobytes(), "image/jpeg"
+
+
+class LocalImageStore:
+    """
+    Filesystem backend: root/originals/ab/cd/<hash>, root/thumbs/ab/cd/<hash>_<px>.
+    """
+
+    def __init__(self, root=IMAGE_STORE_DIR):
+        self.root = root
+
+    def _path(self, kind, digest, suffix=""):
+        return os.path.join(self.root, kind, digest[:2], digest[2:4], digest + suffix)
+
+    def _write(self, path, content):
+        # Readers only ever see complete files
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def put(self, content: bytes):
+        """
+        Stores content unless it is already there. Returns (hash, created).
+        """
+        digest = content_hash(content)
+        path = self._path("originals", digest)
+        if os.path.exists(path):
+            return digest, False
+        self._write(path, content)
+        return digest, True
+
+    def exists(self, digest):
+        return os.path.exists(self._path("originals", digest))
+
+    def get(self, digest):
+        """
+        Returns the original bytes, or None.
+        """
+        try:
+            with open(self._path("originals", digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def thumbnail(self, digest, size=THUMBNAIL_PX):
+        """
+        Returns (bytes, media type) of the thumbnail, deriving it on first
+        use. None if the original does not exist.
+        """
+        for suffix, kind in ((".webp", "image/webp"), (".jpg", "image/jpeg")):
+            path = self._path("thumbs", digest, f"_{size}{suffix}")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return f.read(), kind
+        content = self.get(digest)
+        if content is None:
+            return None
+        thumb, kind = make_thumbnail(content, size)
+        self._write(self._path("thumbs", digest, f"_{size}" + (".webp" if kind == "image/webp" else ".jpg")), thumb)
+        return thumb, kind
+
+    def delete(self, digest):
+        path = self._path("originals", digest)
+        if os.path.exists(path):
+            os.remove(path)
+        thumbs_dir = os.path.dirname(self._path("thumbs", digest))
+        if os.path.isdir(thumbs_dir):
+            for name in os.listdir(thumbs_dir):
+                if name.startswith(digest):
+                    os.remove(os.path.join(thumbs_dir, name))
+
+
+BACKENDS = {"local": LocalImageStore}
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = BACKENDS[IMAGE_STORE_BACKEND]()
+    return _store
+
+
+def url_for(digest: str) -> str:
+    return f"/images/{digest}"
+
+
+def save_upload(content: bytes):
+    """
+    Stores an uploaded photo and pre-builds its thumbnail.
+    Returns (hash, created).
+    """
+    store = get_store()
+    digest, created = store.put(content)
+    if created:
+        try:
+            store.thumbnail(digest)
+        except Exception as e:
+            # Still served at full size; the thumbnail is retried on first request
+            print(f"[WARN] Thumbnail for {digest[:12]} failed: {e}")
+    return digest, created
+
+
+def encoding_for(db_session, digest, content, profile="enrollment"):
+    """
+    get_face_encoding() memoized by content hash: an image that was already
+    encoded with this profile is answered from image_encodings. Only found
+    faces are remembered: None can also mean the encoder failed, and
+    quality rejections raise.
+    """
+    from models import ImageEncoding
+    from sqlalchemy.exc import IntegrityError
+
+    row = db_session.query(ImageEncoding.encoding).filter(
+        ImageEncoding.content_hash == digest, ImageEncoding.profile == profile
+    ).first()
+    if row is not None:
+        metrics.cache_lookup("image_encoding", True)
+        return utils.templates_from_bytes(row.encoding)[0].tolist()
+    metrics.cache_lookup("image_encoding", False)
+
+    encoding = utils.get_face_encoding(io.BytesIO(content), profile=profile)
+    if encoding is None or (utils.VISION_MODE != "remote" and not utils.REAL_RECOGNITION_AVAILABLE):
+        return encoding # Mock encodings are not worth remembering
+    db_session.add(ImageEncoding(content_hash=digest, profile=profile, encoding=utils.templates_to_bytes(encoding)))
+    try:
+        db_session.commit()
+    except IntegrityError:
+        # Same image encoded concurrently by another request; either result is fine
+        db_session.rollback()
+    return encoding
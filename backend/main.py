@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
@@ -6,14 +6,21 @@ from datetime import timedelta, datetime
 from typing import List
 import csv
 import io
-import uuid
 import os
-from fastapi.responses import StreamingResponse
-import models, database, schemas, auth, utils
+import hmac
+import threading
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, Response
+import models, database, schemas, auth, utils, presence, timetable, metrics, profiler, frame_cache, edge, cache_bus, image_store, user_import, attendance_archive, eligibility, rollups
 
 app = FastAPI(title="Face Recognition Attendance System")
 
 models.Base.metadata.create_all(bind=database.engine)
+database.add_missing_columns(models.Base)
+timetable.register_listeners()
+cache_bus.register_listeners()
+eligibility.register_listeners()
+rollups.register_listeners()
+metrics.install_db_hooks(database.engine)
 
 # CORS configuration
 app.add_middleware(
@@ -24,6 +31,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency / DB query metrics (METRICS_ENABLED=0 to disable)
+if metrics.METRICS_ENABLED:
+    app.middleware("http")(metrics.http_middleware)
+
 @app.on_event("startup")
 def startup_event():
     db = database.SessionLocal()
@@ -103,14 +114,55 @@ def startup_event():
                  existing.teacher_id = teacher_id
              db.add(existing)
     db.commit()
+
+    # Warm today's "already marked" bitmaps in one query
+    presence.warm(db)
+    timetable.build(db)
     
     db.close()
 
+    # Other workers' writes arrive through the change feed
+    cache_bus.subscribe("gallery", _apply_gallery_changes)
+    cache_bus.subscribe("timetable", lambda keys: timetable.invalidate())
+    cache_bus.subscribe("presence", lambda keys: presence.invalidate(None if keys is None else {int(k) for k in keys}))
+    cache_bus.subscribe("presence", eligibility.invalidate)
+    cache_bus.start()
+    threading.Thread(target=rollups.backfill, name="rollup-backfill", daemon=True).start()
+
+    # Preload face models + gallery off the startup path so /health/live answers
+    # immediately while /health/ready stays 503 until the worker is warm
+    if os.getenv("WARMUP_ON_START", "1") == "1":
+        threading.Thread(target=_warm_up_worker, name="warmup", daemon=True).start()
+    else:
+        utils.WARMUP_STATE["ready"] = True
+
+def _apply_gallery_changes(user_ids):
+    # Cached frame results may name a user whose face just changed
+    frame_cache.clear()
+    if utils.VISION_MODE == "remote" or not utils.KNOWN_FACES_LOADED:
+        return # No local gallery, or the first load will read the new rows
+    db = database.SessionLocal()
+    try:
+        if user_ids is None:
+            utils.load_known_faces(db)
+        else:
+            utils.reload_known_faces(db, {int(uid) for uid in user_ids})
+    finally:
+        db.close()
+
+def _warm_up_worker():
+    db = database.SessionLocal()
+    try:
+        utils.warm_up(db)
+    finally:
+        db.close()
+
 # ... (Previous API endpoints) ...
 
 # Teacher Dashboard APIs
 
 @app.get("/teacher/dashboard")
+@profiler.profiled("get_teacher_dashboard")
 def get_teacher_dashboard(current_user: models.User = Depends(auth.get_current_active_user), db: Session = Depends(database.get_db)):
     if current_user.role != "teacher" and current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
@@ -128,7 +180,8 @@ def get_teacher_dashboard(current_user: models.User = Depends(auth.get_current_a
     todays_classes = []
     current_time = datetime.now().time()
     for sub in my_subjects:
-        is_today = True # simplified assumption
+        if not sub.runs_on(today):
+            continue
         status = "Upcoming"
         if sub.start_time and sub.end_time:
             if sub.end_time < current_time: status = "Completed"
@@ -173,20 +226,18 @@ def get_subject_attendance(
     if current_user.role == "teacher" and sub.teacher_id != current_user.id:
           raise HTTPException(status_code=403, detail="You do not teach this subject")
           
-    query = db.query(models.Attendance).filter(models.Attendance.subject_id == subject_id)
-    
     if date:
+        # A past day may belong to an archived term
         query_date = datetime.strptime(date, "%Y-%m-%d").date()
         start = datetime.combine(query_date, datetime.min.time())
-        end = datetime.combine(query_date, datetime.max.time())
-        query = query.filter(models.Attendance.date >= start, models.Attendance.date <= end)
+        records = attendance_archive.query(db, start=start, end=start + timedelta(days=1), subject_id=subject_id)
     else:
         # Default to today
         today = datetime.now().date()
         start = datetime.combine(today, datetime.min.time())
-        query = query.filter(models.Attendance.date >= start)
-        
-    records = query.all()
+        records = db.query(models.Attendance).filter(
+            models.Attendance.subject_id == subject_id, models.Attendance.date >= start
+        ).all()
     
     # Enrich with student details
     result = []
@@ -315,14 +366,18 @@ def bulk_mark_attendance(
     
     start_of_day = datetime.combine(today.date(), datetime.min.time())
 
-    for student_id in req.student_ids:
-        # Check existing
-        existing = db.query(models.Attendance).filter(
-            models.Attendance.user_id == student_id,
+    # Today's rows for the whole batch in one query
+    existing_rows = {}
+    if req.student_ids:
+        for record in db.query(models.Attendance).filter(
+            models.Attendance.user_id.in_(set(req.student_ids)),
             models.Attendance.subject_id == sub.id,
             models.Attendance.date >= start_of_day
-        ).first()
-        
+        ):
+            existing_rows.setdefault(record.user_id, record)
+
+    for student_id in req.student_ids:
+        existing = existing_rows.get(student_id)
         if existing:
             existing.status = req.status
             already_marked_count += 1
@@ -334,13 +389,16 @@ def bulk_mark_attendance(
                 date=today
             )
             db.add(new_record)
+            existing_rows[student_id] = new_record
             new_marked_count += 1
             
     db.commit()
+    for student_id in req.student_ids:
+        presence.mark(student_id, sub.id)
     return {"message": f"Updated {already_marked_count + new_marked_count} students ({new_marked_count} new)."}
 
 @app.post("/teacher/attendance/live")
-async def live_classroom_attendance(
+def live_classroom_attendance(
     subject_id: int = Form(...),
     file: UploadFile = File(...),
     current_user: models.User = Depends(auth.get_current_active_user),
@@ -349,14 +407,25 @@ async def live_classroom_attendance(
     if current_user.role != "teacher" and current_user.role != "admin":
          raise HTTPException(status_code=403, detail="Not authorized")
          
-    # 1. Recognize
-    content = await file.read()
-    users = db.query(models.User).filter(models.User.face_encoding.isnot(None)).all()
-    known_encodings = [(u.id, u.face_encoding) for u in users]
-    
-    if not known_encodings: return {"status": "error", "message": "No users registered"}
-    
-    user_id = utils.recognize_face(content, known_encodings)
+    # 1. Recognize (gallery comes from the in-memory cache)
+    content = file.file.read()
+    if utils.VISION_MODE == "local":
+        if not utils.KNOWN_FACES_LOADED:
+            utils.load_known_faces(db)
+        if not utils.KNOWN_FACES_CACHE: return {"status": "error", "message": "No users registered"}
+    
+    # Unchanged frames (nobody moved) reuse the previous result
+    cache_key = f"live:{current_user.id}:{subject_id}"
+    frame_sig = frame_cache.signature(content)
+    user_id = frame_cache.lookup(cache_key, frame_sig)
+    if user_id is frame_cache.MISS:
+        try:
+            # Decoded straight from memory (or forwarded as-is in VISION_MODE=remote)
+            user_id = utils.recognize_face(io.BytesIO(content), db_session=db, profile="live")
+        except utils.FaceQualityError as e:
+            # Defer: the next frame will likely be better
+            return {"status": "idle", "message": str(e), "reason": e.reason}
+        frame_cache.store(cache_key, frame_sig, user_id)
     
     if not user_id: return {"status": "idle", "message": "No face recognized"}
     
@@ -364,15 +433,8 @@ async def live_classroom_attendance(
     
     # 2. Mark Attendance for Subject
     today = datetime.now()
-    start_of_day = datetime.combine(today.date(), datetime.min.time())
     
-    existing = db.query(models.Attendance).filter(
-        models.Attendance.user_id == student.id,
-        models.Attendance.subject_id == subject_id,
-        models.Attendance.date >= start_of_day
-    ).first()
-    
-    if existing:
+    if presence.is_marked(db, student.id, subject_id):
         return {
             "status": "success", 
             "student": {"id": student.id, "name": student.name, "roll_number": student.roll_number},
@@ -387,6 +449,7 @@ async def live_classroom_attendance(
     )
     db.add(new_record)
     db.commit()
+    presence.mark(student.id, subject_id)
     
     return {
         "status": "success", 
@@ -415,40 +478,35 @@ def update_my_profile(
 # ... (Validate email domain) ...
 
 # Automated Attendance Kiosk Endpoint
+# Plain def like the other recognition endpoints: FastAPI runs it in its threadpool,
+# so the face model (or the VISION_MODE=remote round trip) never blocks the event loop
 @app.post("/attendance/auto-mark")
-async def auto_mark_attendance(
+def auto_mark_attendance(
+    request: Request,
     file: UploadFile = File(...),
+    room: str = Form(None), # Kiosk location, used to pick between overlapping classes
     db: Session = Depends(database.get_db)
 ):
     # 1. Read Image
-    content = await file.read()
+    content = file.file.read()
     
-    # Check if we should use DB or if faces are already cached in utils
-    # If using utils.recognize_face with db session, it handles loading.
+    # 2. Recognize. Idle kiosks send near-identical frames; those reuse the
+    # previous result instead of running the face model again.
+    cache_key = f"kiosk:{room or (request.client.host if request.client else 'unknown')}"
+    frame_sig = frame_cache.signature(content)
+    user_id = frame_cache.lookup(cache_key, frame_sig)
     
-    try:
-        user_id = utils.recognize_face(file.filename, db) # Just passing db to trigger load if needed, but wait..
-        # utils.recognize_face expects image CONTENT not filename (Wait, my utils.recognize_face expects PATH).
-        # But here 'content' is bytes.
-        # My updated utils.recognize_face saves Content to temp file if I pass bytes?
-        # Let me re-check utils.py... It expects "unknown_image_path" string.
-        # So I need to save it first here.
-        
-        # ACTUALLY, I should update utils to accept bytes or I do it here.
-        # In this specific file context, let's keep it simple.
-        
-        temp_filename = f"temp_kiosk_{uuid.uuid4()}.jpg"
-        temp_path = utils.upload_to_supabase(content, temp_filename)
-        
-        user_id = utils.recognize_face(temp_path, db_session=db)
-        
-        # Cleanup
-        try: os.remove(temp_path)
-        except: pass
-
-    except Exception as e:
-        print(f"Recognition Error: {e}")
-        user_id = None
+    if user_id is frame_cache.MISS:
+        try:
+            # Decoded straight from memory (or forwarded as-is in VISION_MODE=remote)
+            user_id = utils.recognize_face(io.BytesIO(content), db_session=db, profile="kiosk")
+            frame_cache.store(cache_key, frame_sig, user_id)
+        except utils.FaceQualityError as e:
+            # Tell the kiosk why, so it can prompt the student
+            raise HTTPException(status_code=422, detail={"reason": e.reason, "message": str(e)})
+        except Exception as e:
+            print(f"Recognition Error: {e}")
+            user_id = None
     
     if not user_id:
         raise HTTPException(status_code=404, detail="Face not recognized.")
@@ -458,14 +516,8 @@ async def auto_mark_attendance(
          raise HTTPException(status_code=404, detail="User not found.")
 
     # 3. Find Active Class based on Time
-    current_time = datetime.now().time()
-    
-    # Find subject where start <= now <= end
-    # Note: SQLite Time comparison works with Python time objects
-    active_subject = db.query(models.Subject).filter(
-        models.Subject.start_time <= current_time,
-        models.Subject.end_time >= current_time
-    ).first()
+    # Resolved from the in-memory timetable (room -> student's department -> any)
+    active_subject = timetable.resolve(db, room=room, department=user.department)
     
     if not active_subject:
          # Optional: You could allow general attendance without subject if no class is on
@@ -477,17 +529,8 @@ async def auto_mark_attendance(
          }
          
     # 4. Mark Attendance
-    # Check duplicate for today + subject
-    today = datetime.now().date()
-    start_of_day = datetime.combine(today, datetime.min.time())
-    
-    existing = db.query(models.Attendance).filter(
-        models.Attendance.user_id == user.id,
-        models.Attendance.subject_id == active_subject.id,
-        models.Attendance.date >= start_of_day
-    ).first()
-    
-    if existing:
+    # Check duplicate for today + subject (served from the in-memory bitmap)
+    if presence.is_marked(db, user.id, active_subject.subject_id):
          return {
              "status": "success",
              "student_name": user.name,
@@ -498,11 +541,12 @@ async def auto_mark_attendance(
     new_record = models.Attendance(
         user_id=user.id,
         status="present",
-        subject_id=active_subject.id,
+        subject_id=active_subject.subject_id,
         date=datetime.now()
     )
     db.add(new_record)
     db.commit()
+    presence.mark(user.id, active_subject.subject_id)
     
     return {
         "status": "success",
@@ -511,6 +555,32 @@ async def auto_mark_attendance(
         "message": f"Attendance marked for {active_subject.name}"
     }
 
+# Edge kiosks: pull a gallery slice for their room, push marks taken offline
+def _check_edge_kiosk(request: Request):
+    if not edge.EDGE_SYNC_TOKEN:
+        raise HTTPException(status_code=404, detail="Edge sync is not enabled")
+    if not hmac.compare_digest(request.headers.get("X-Edge-Token", ""), edge.EDGE_SYNC_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid edge token")
+
+@app.get("/edge/gallery")
+def edge_gallery(request: Request, room: str = None, department: str = None, since: int = 0,
+                 db: Session = Depends(database.get_db)):
+    _check_edge_kiosk(request)
+    if not room and not department:
+        raise HTTPException(status_code=400, detail="room or department is required")
+    payload, version = edge.build_slice(db, room=room, department=department, since=since)
+    return Response(content=payload, media_type="application/octet-stream",
+                    headers={"X-Gallery-Version": str(version)})
+
+@app.post("/edge/sync")
+def edge_sync(request: Request, batch: schemas.EdgeSyncRequest, db: Session = Depends(database.get_db)):
+    _check_edge_kiosk(request)
+    if len(batch.marks) > edge.EDGE_MAX_SYNC_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {edge.EDGE_MAX_SYNC_BATCH} marks per sync")
+    if not batch.marks:
+        return {"results": [], "counts": {}}
+    return edge.apply_sync(db, batch.kiosk_id, batch.room, batch.marks)
+
 # Student Dashboard API
 def validate_email_domain(email: str):
     if not email.endswith("@vbis.com"):
@@ -543,22 +613,22 @@ def create_user(
     # Process Image
     content = file.file.read()
     
-    # Save temporarily to process (or permanently if we decide this is the final file)
-    # We use upload_to_supabase which currently saves locally to uploads/
-    # We will rename it later using the user ID if successful, or just use a UUID-based name.
-    # User requested image name based on candidate name.
-    sanitized_name = name.replace(" ", "_").lower()
-    final_filename = f"{sanitized_name}_{uuid.uuid4()}.jpg"
-    image_url = utils.upload_to_supabase(content, final_filename)
+    # Stored by content hash; the same photo uploaded twice is stored and encoded once
+    digest, created = image_store.save_upload(content)
+    image_url = image_store.url_for(digest)
     
     # Verify Face
-    encoding = utils.get_face_encoding(image_url)
+    try:
+        encoding = image_store.encoding_for(db, digest, content, profile="enrollment")
+        quality_error = None
+    except utils.FaceQualityError as e:
+        encoding, quality_error = None, e
     if not encoding:
-        # Delete the file if face not found
-        try:
-             os.remove(image_url)
-        except:
-            pass
+        # Delete the file if face not found (unless it was already stored for someone else)
+        if created:
+            image_store.get_store().delete(digest)
+        if quality_error:
+            raise HTTPException(status_code=400, detail=f"Face photo rejected: {quality_error}")
         raise HTTPException(status_code=400, detail="No face detected in the image. Registration failed.")
 
     hashed_password = auth.get_password_hash(password)
@@ -573,14 +643,47 @@ def create_user(
         course=course,
         year_semester=year_semester,
         account_status="active",
-        image_url=image_url,
-        face_encoding=str(encoding)
+        image_url=image_url
     )
+    utils.enroll_template(new_user, encoding)
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    utils.set_known_face(new_user.id, utils.templates_from_bytes(new_user.face_templates))
+    utils.refresh_remote_face(new_user.id)
+    # A kiosk frame cached as "no match" may show this face
+    frame_cache.clear()
     return new_user
 
+# Bulk import: CSV / NDJSON of users (+ optional zip of face photos), processed
+# in the background; poll the returned job id for progress
+@app.post("/admin/users/import", status_code=202)
+def import_users(
+    file: UploadFile = File(...),
+    photos: UploadFile = File(None),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can import users")
+    fmt = user_import.detect_format(file.filename, file.content_type)
+    if not fmt:
+        raise HTTPException(status_code=400, detail="Upload a .csv or .ndjson file")
+    try:
+        job = user_import.start(db, current_user.id, file.file, fmt, photos.file if photos else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/admin/users/import/{job_id}")
+def get_import_job(job_id: str, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can import users")
+    job = db.query(models.ImportJob).filter(models.ImportJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return user_import.job_status(job)
+
 @app.get("/admin/users", response_model=List[schemas.UserResponse])
 def get_all_users(role: str = None, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
     if current_user.role != "admin":
@@ -634,7 +737,7 @@ def get_admin_stats(current_user: models.User = Depends(auth.get_current_user),
     total_students = db.query(models.User).filter(models.User.role == "student").count()
     total_teachers = db.query(models.User).filter(models.User.role == "teacher").count()
     
-    total_attendance = db.query(models.Attendance).count()
+    total_attendance = db.query(models.Attendance).count() + attendance_archive.archived_count(db)
     
     # Today's attendance
     today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -653,7 +756,7 @@ def export_attendance(current_user: models.User = Depends(auth.get_current_user)
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only admins can export data")
     
-    records = db.query(models.Attendance).all()
+    records = attendance_archive.query(db)
     
     output = io.StringIO()
     writer = csv.writer(output)
@@ -678,16 +781,156 @@ def export_attendance(current_user: models.User = Depends(auth.get_current_user)
         headers={"Content-Disposition": "attachment; filename=attendance_report.csv"}
     )
 
+@app.get("/admin/reports/eligibility")
+def eligibility_report(
+    format: str = "csv",
+    department: str = None,
+    shortage: float = eligibility.SHORTAGE_PCT,
+    warning: float = eligibility.WARNING_PCT,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view reports")
+    if format not in ("csv", "json"):
+        raise HTTPException(status_code=400, detail="format must be csv or json")
+    if not 0 <= shortage <= warning <= 100:
+        raise HTTPException(status_code=400, detail="Thresholds must satisfy 0 <= shortage <= warning <= 100")
+
+    report = eligibility.get_report(db, department, shortage, warning)
+    if format == "json":
+        return StreamingResponse(report.iter_json(), media_type="application/json")
+    return StreamingResponse(
+        report.iter_csv(),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=eligibility_report.csv"}
+    )
+
+@app.get("/admin/analytics/attendance")
+def attendance_analytics(
+    start: str = None, # YYYY-MM-DD, default: 30 days before end
+    end: str = None, # YYYY-MM-DD, default: today
+    granularity: str = "day",
+    group_by: str = "none",
+    department: str = None,
+    subject_id: int = None,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view analytics")
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d").date() if start else None
+        end_date = datetime.strptime(end, "%Y-%m-%d").date() if end else None
+        return rollups.series(db, start_date, end_date, granularity, group_by, department, subject_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/admin/terms")
+def list_terms(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can manage terms")
+    return db.query(models.Term).order_by(models.Term.start_date).all()
+
+@app.post("/admin/terms")
+def create_term(term: schemas.TermCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can manage terms")
+    if term.end_date < term.start_date:
+        raise HTTPException(status_code=400, detail="Term ends before it starts")
+    if db.query(models.Term).filter(models.Term.name == term.name).first():
+        raise HTTPException(status_code=400, detail="Term name already exists")
+    overlapping = db.query(models.Term).filter(
+        models.Term.start_date <= term.end_date, models.Term.end_date >= term.start_date
+    ).first()
+    if overlapping:
+        raise HTTPException(status_code=400, detail=f"Overlaps term {overlapping.name}")
+    new_term = models.Term(name=term.name, start_date=term.start_date, end_date=term.end_date)
+    db.add(new_term)
+    db.commit()
+    db.refresh(new_term)
+    return new_term
+
+@app.post("/admin/terms/{term_id}/archive")
+def archive_term(term_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can manage terms")
+    term = db.query(models.Term).filter(models.Term.id == term_id).first()
+    if not term:
+        raise HTTPException(status_code=404, detail="Term not found")
+    try:
+        moved = attendance_archive.archive_term(db, term)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if moved:
+        eligibility.invalidate()
+    return {"message": f"Archived {term.name}", "moved": moved, "archived_rows": term.archived_rows}
+
 from sqlalchemy import text
 
 @app.get("/health")
 def health_check(db: Session = Depends(database.get_db)):
+    ready = utils.WARMUP_STATE["ready"]
     try:
         # Simple DB check
         db.execute(text("SELECT 1"))
-        return {"status": "ok", "database": "connected", "backend": "running"}
+        return {"status": "ok", "database": "connected", "backend": "running", "ready": ready}
     except Exception as e:
-        return {"status": "error", "database": str(e), "backend": "running"}
+        return {"status": "error", "database": str(e), "backend": "running", "ready": ready}
+
+# Liveness: the process is up and serving (no dependencies checked)
+@app.get("/health/live")
+def liveness_check():
+    return {"status": "alive"}
+
+# Readiness: models loaded, gallery built, warm-up inference done
+@app.get("/health/ready")
+def readiness_check():
+    state = utils.WARMUP_STATE
+    body = {
+        "ready": state["ready"],
+        "stages": state["stages"],
+        "error": state["error"],
+        "gallery_faces": len(utils.KNOWN_FACES_CACHE),
+        "vision_mode": utils.VISION_MODE,
+    }
+    ready = state["ready"]
+    if ready and utils.VISION_MODE == "remote":
+        # An API-only worker is only useful while its recognition worker is up
+        ready = body["recognition_service"] = utils.remote_ready()
+    if not ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profiling")
+def get_profiling_status(current_user: models.User = Depends(auth.get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can manage profiling")
+    return profiler.status()
+
+@app.post("/admin/profiling")
+def configure_profiling(config: schemas.ProfilingConfig, current_user: models.User = Depends(auth.get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can manage profiling")
+    try:
+        profiler.configure(sample_rate=config.sample_rate, mode=config.mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if config.reset_stacks:
+        profiler.reset_stacks()
+    return profiler.status()
+
+@app.get("/admin/profiling/stacks", response_class=PlainTextResponse)
+def get_profiling_stacks(current_user: models.User = Depends(auth.get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can manage profiling")
+    return PlainTextResponse(profiler.collapsed_stacks())
 
 @app.delete("/admin/users/{user_id}")
 def delete_user(user_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
@@ -722,7 +965,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/user/upload-face")
-def upload_face(user_id: int = None, file: UploadFile = File(...), current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+def upload_face(user_id: int = None, replace: bool = False, file: UploadFile = File(...), current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
     # Determine target user
     target_user = current_user
     if user_id:
@@ -733,24 +976,74 @@ def upload_face(user_id: int = None, file: UploadFile = File(...), current_user:
             raise HTTPException(status_code=404, detail="User not found")
 
     content = file.file.read()
-    filename = f"{target_user.id}_{file.filename}"
-    
-    # Upload to storage (Supabase/Local)
-    image_url = utils.upload_to_supabase(content, filename)
     
-    # Get encoding
-    # In real world: save locally first if needed by library
-    encoding = utils.get_face_encoding(image_url) 
+    # Upload to the image store (deduplicated by content hash)
+    digest, created = image_store.save_upload(content)
+    image_url = image_store.url_for(digest)
     
-    # Update user
-    target_user.image_url = image_url
-    target_user.face_encoding = str(encoding)
+    # Get encoding (memoized per image)
+    # Poor photos are rejected here so they never become templates
+    try:
+        encoding = image_store.encoding_for(db, digest, content, profile="enrollment")
+        quality_error = None
+    except utils.FaceQualityError as e:
+        encoding, quality_error = None, e
+    if not encoding:
+        # Same as create_user: drop the photo unless it was already stored for someone else
+        if created:
+            image_store.get_store().delete(digest)
+        if quality_error:
+            raise HTTPException(status_code=400, detail=f"Face photo rejected: {quality_error}")
+        raise HTTPException(status_code=400, detail="No face detected in the image.")
+    
+    # Add as an extra template (near-duplicates and outliers are pruned).
+    # replace=true starts the user's template set over from this photo.
+    enroll_status = utils.enroll_template(target_user, encoding, replace=replace)
+    if enroll_status != "outlier":
+        target_user.image_url = image_url
     db.commit()
-    
-    return {"message": "Face uploaded successfully", "image_url": image_url}
+    utils.set_known_face(target_user.id, utils.templates_from_bytes(target_user.face_templates))
+    utils.refresh_remote_face(target_user.id)
+    frame_cache.clear()
+    
+    messages = {
+        "added": "Face uploaded successfully",
+        "duplicate": "Face uploaded. A near-identical template is already enrolled.",
+        "outlier": "Face uploaded, but it does not match this user's enrolled face and was not added as a template.",
+    }
+    return {"message": messages[enroll_status], "image_url": image_url, "template_status": enroll_status}
+
+# Stored photos. Content never changes for a hash, so the browser may cache forever,
+# but they are faces: private keeps them out of shared caches and proxies.
+# (No bearer auth: the dashboards load them through plain <img> tags.)
+IMAGE_CACHE_HEADERS = {"Cache-Control": "private, max-age=31536000, immutable"}
+
+def _check_digest(digest: str):
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+@app.get("/images/{digest}")
+def get_image(digest: str):
+    _check_digest(digest)
+    content = image_store.get_store().get(digest)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(content=content, media_type=image_store.media_type(content),
+                    headers={**IMAGE_CACHE_HEADERS, "ETag": f'"{digest}"'})
+
+@app.get("/images/{digest}/thumb")
+def get_image_thumbnail(digest: str):
+    _check_digest(digest)
+    thumb = image_store.get_store().thumbnail(digest)
+    if thumb is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    content, media_type = thumb
+    return Response(content=content, media_type=media_type,
+                    headers={**IMAGE_CACHE_HEADERS, "ETag": f'"{digest}-thumb"'})
 
 # Student Dashboard API
 @app.get("/student/dashboard", response_model=schemas.DashboardStats)
+@profiler.profiled("get_student_dashboard")
 def get_student_dashboard(
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
@@ -774,11 +1067,7 @@ def get_student_dashboard(
     
     overall_percentage = (attended_count / total_attendance * 100) if total_attendance > 0 else 0.0
     
-    status_label = "Eligible"
-    if overall_percentage < 65:
-        status_label = "Shortage"
-    elif overall_percentage < 75:
-        status_label = "Warning"
+    status_label = eligibility.status_for(overall_percentage)
         
     # Subject-wise Stats
     # Get all subjects relevant to student (ideally filter by dept, but for now getting all active subjects with records)
@@ -827,47 +1116,37 @@ def get_subjects(db: Session = Depends(database.get_db)):
 
 # Modified Mark Attendance to accept Subject
 @app.post("/attendance/mark")
-async def mark_attendance(
+def mark_attendance(
     file: UploadFile = File(...),
     subject_id: int = Form(None), # Optional for now, but UI should send it
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     # Verify Face matches User
-    content = await file.read()
+    content = file.file.read()
     
     # 1. Get user's enrolled face encoding
     if not current_user.face_encoding:
          raise HTTPException(status_code=400, detail="Face validation failed. No face data found for user.")
          
-    # 2. Verify
-    # Save temp for verification function
-    temp_filename = f"temp_{uuid.uuid4()}.jpg"
-    temp_path = utils.upload_to_supabase(content, temp_filename) 
-    
-    match = utils.verify_face(temp_path, current_user.face_encoding)
-    
-    # Cleanup temp
+    # 2. Verify (1:1 against the user's cached templates, straight from bytes)
     try:
-        os.remove(temp_path)
-    except:
-        pass
+        match, _ = utils.verify_face(content, current_user.id, db_session=db)
+    except utils.FaceQualityError as e:
+        raise HTTPException(status_code=422, detail={"reason": e.reason, "message": str(e)})
         
     if match:
         # Mark Present
         # Check if already marked for today and this subject
-        today = datetime.now().date()
-        start_of_day = datetime.combine(today, datetime.min.time())
-        
-        query = db.query(models.Attendance).filter(
-            models.Attendance.user_id == current_user.id,
-            models.Attendance.date >= start_of_day
-        )
-        
         if subject_id:
-             query = query.filter(models.Attendance.subject_id == subject_id)
-        
-        existing = query.first()
+            existing = presence.is_marked(db, current_user.id, subject_id)
+        else:
+            today = datetime.now().date()
+            start_of_day = datetime.combine(today, datetime.min.time())
+            existing = db.query(models.Attendance).filter(
+                models.Attendance.user_id == current_user.id,
+                models.Attendance.date >= start_of_day
+            ).first()
         
         if existing:
              return {"message": "Attendance already marked for today."}
@@ -880,6 +1159,7 @@ async def mark_attendance(
         )
         db.add(new_record)
         db.commit()
+        presence.mark(current_user.id, subject_id)
         return {"message": f"Attendance Marked Present for {current_user.name}"}
     else:
         raise HTTPException(status_code=401, detail="Face verification failed. Identify verification mismatch.")
@@ -887,9 +1167,9 @@ async def mark_attendance(
 @app.get("/attendance/history", response_model=List[schemas.AttendanceResponse])
 def get_attendance(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
     if current_user.role in ["admin", "teacher"]:
-        return db.query(models.Attendance).all()
+        return attendance_archive.query(db)
     else:
-        return db.query(models.Attendance).filter(models.Attendance.user_id == current_user.id).all()
+        return attendance_archive.query(db, user_id=current_user.id)
 
 @app.get("/users/me", response_model=schemas.UserResponse)
 def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
@@ -907,7 +1187,7 @@ def export_subject_attendance(
     sub = db.query(models.Subject).filter(models.Subject.id == subject_id).first()
     if not sub: raise HTTPException(status_code=404, detail="Subject not found")
     
-    records = db.query(models.Attendance).filter(models.Attendance.subject_id == subject_id).order_by(models.Attendance.date.desc()).all()
+    records = attendance_archive.query(db, subject_id=subject_id, newest_first=True)
     
     output = io.StringIO()
     writer = csv.writer(output)
@@ -939,11 +1219,7 @@ def get_student_history_teacher(
     if current_user.role != "teacher" and current_user.role != "admin":
          raise HTTPException(status_code=403, detail="Not authorized")
          
-    query = db.query(models.Attendance).filter(models.Attendance.user_id == student_id)
-    if subject_id:
-        query = query.filter(models.Attendance.subject_id == subject_id)
-        
-    records = query.order_by(models.Attendance.date.desc()).all()
+    records = attendance_archive.query(db, user_id=student_id, subject_id=subject_id or None, newest_first=True)
     
     result = []
     for r in records:
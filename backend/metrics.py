@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+import contextvars
+from contextlib import contextmanager
+
+# Lightweight in-process metrics, rendered in Prometheus text exposition format.
+# Set METRICS_ENABLED=0 to turn every recording call into a no-op.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+_lock = threading.Lock()
+
+# Structure: { name: {"type": str, "help": str, "buckets": tuple, "series": {labels: value}} }
+# Histogram series values are [bucket_counts..., sum, count]
+_REGISTRY = {}
+
+# Per-request DB query counter, set by the HTTP middleware
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _metric(name, kind, help_text, buckets=None):
+    metric = _REGISTRY.get(name)
+    if metric is None:
+        metric = {"type": kind, "help": help_text, "buckets": buckets, "series": {}}
+        _REGISTRY[name] = metric
+    return metric
+
+
+def inc(name, labels=None, amount=1, help_text=""):
+    if not METRICS_ENABLED:
+        return
+    key = _labels_key(labels)
+    with _lock:
+        series = _metric(name, "counter", help_text)["series"]
+        series[key] = series.get(key, 0) + amount
+
+
+def set_gauge(name, value, labels=None, help_text=""):
+    if not METRICS_ENABLED:
+        return
+    key = _labels_key(labels)
+    with _lock:
+        _metric(name, "gauge", help_text)["series"][key] = value
+
+
+def add_gauge(name, amount, labels=None, help_text=""):
+    if not METRICS_ENABLED:
+        return
+    key = _labels_key(labels)
+    with _lock:
+        series = _metric(name, "gauge", help_text)["series"]
+        series[key] = series.get(key, 0) + amount
+
+
+def observe(name, value, labels=None, buckets=LATENCY_BUCKETS, help_text=""):
+    if not METRICS_ENABLED:
+        return
+    key = _labels_key(labels)
+    with _lock:
+        metric = _metric(name, "histogram", help_text, buckets)
+        values = metric["series"].get(key)
+        if values is None:
+            values = [0] * (len(metric["buckets"]) + 2)
+            metric["series"][key] = values
+        for i, bound in enumerate(metric["buckets"]):
+            if value <= bound:
+                values[i] += 1
+        values[-2] += value
+        values[-1] += 1
+
+
+@contextmanager
+def timed(name, labels=None, help_text=""):
+    """
+    Times the enclosed block into a latency histogram.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, labels, help_text=help_text)
+
+
+def stage(name):
+    """
+    Shortcut for timing one recognition stage (decode, detect, encode, match).
+    """
+    return timed("recognition_stage_seconds", {"stage": name}, "Time spent per recognition stage")
+
+
+def cache_lookup(cache, hit):
+    inc("cache_requests_total", {"cache": cache, "result": "hit" if hit else "miss"},
+        help_text="Cache lookups by result")
+
+
+# ------------------------
+# SQLAlchemy hooks
+# ------------------------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    verb = statement.lstrip().split(" ", 1)[0].upper()
+    observe("db_query_duration_seconds", elapsed, {"statement": verb},
+            help_text="DB query latency by statement type")
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def install_db_hooks(engine):
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ------------------------
+# HTTP middleware
+# ------------------------
+async def http_middleware(request, call_next):
+    if not METRICS_ENABLED:
+        return await call_next(request)
+
+    counter = [0]
+    token = _request_queries.set(counter)
+    add_gauge("http_requests_in_progress", 1, help_text="Requests currently being served")
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        add_gauge("http_requests_in_progress", -1)
+        _request_queries.reset(token)
+
+        # Use the route template so /users/1 and /users/2 share a series
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        labels = {"method": request.method, "route": path}
+        observe("http_request_duration_seconds", elapsed, labels,
+                help_text="Request latency by route")
+        observe("http_request_db_queries", counter[0], labels, buckets=COUNT_BUCKETS,
+                help_text="DB queries issued per request")
+        inc("http_requests_total", dict(labels, status=str(status_code)),
+            help_text="Requests by route and status")
+
+
+# ------------------------
+# Exposition
+# ------------------------
+def _format_labels(key, extra=None):
+    pairs = list(key) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{str(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def render() -> str:
+    lines = []
+    with _lock:
+        for name in sorted(_REGISTRY):
+            metric = _REGISTRY[name]
+            if metric["help"]:
+                lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in metric["series"].items():
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+                    continue
+                for bound, count in zip(metric["buckets"], value):
+                    lines.append(f"{name}_bucket{_format_labels(key, {'le': bound})} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {value[-2]}")
+                lines.append(f"{name}_count{_format_labels(key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
@@ -13,10 +13,16 @@ import numpy as np
 # Ensure we can import from backend
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from database import SessionLocal
-from models import User
+from database import SessionLocal, engine, add_missing_columns
+from models import Base, User
+import utils
 
 def migrate_faces():
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(Base)
+    # Running API workers pick up the new faces from the change feed
+    import cache_bus
+    cache_bus.register_listeners()
     db = SessionLocal()
     
     # Path to the external face database
@@ -83,14 +89,12 @@ def migrate_faces():
             # Skip actual image processing in mock mode
             continue
 
-        # Process Images to get Encoding (only need one good one)
-        # We will pick the first valid face we find
+        # Process Images to get Encodings
+        # Every valid face becomes a template (near-duplicates/outliers are pruned)
         
         encoding_found = False
         
         for img_name in os.listdir(person_folder):
-            if encoding_found: break
-            
             img_path = os.path.join(person_folder, img_name)
             
             try:
@@ -114,15 +118,12 @@ def migrate_faces():
                 
                 if len(encodings) > 0:
                     # Found a face!
-                    # Convert to list for JSON storage
-                    encoding_list = encodings[0].tolist() 
-                    
-                    # Update User Record
-                    user.face_encoding = json.dumps(encoding_list)
+                    status = utils.enroll_template(user, encodings[0])
                     db.commit()
                     
-                    print(f"   [SUCCESS] Encoded face from {img_name}")
-                    enrolled_count += 1
+                    print(f"   [SUCCESS] Encoded face from {img_name} (template {status})")
+                    if not encoding_found:
+                        enrolled_count += 1
                     encoding_found = True
                 else:
                     print(f"   [WARN] No face found in {img_name}")
@@ -1,10 +1,12 @@
-from sqlalchemy import Column, Integer, String, Enum, DateTime, ForeignKey, Text, Time
+from sqlalchemy import Column, Integer, String, Enum, Date, DateTime, ForeignKey, Text, Time, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
 
 # ... (User code remains same)
 
+WEEKDAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
 class Subject(Base):
     __tablename__ = "subjects"
     id = Column(Integer, primary_key=True, index=True)
@@ -14,10 +16,29 @@ class Subject(Base):
     start_time = Column(Time, nullable=True)
     end_time = Column(Time, nullable=True)
     teacher_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    room = Column(String(50), nullable=True)
+    # Recurrence: comma separated weekdays e.g. "Mon,Wed,Fri". Empty = every day
+    weekdays = Column(String(50), nullable=True)
     
     attendance_records = relationship("Attendance", back_populates="subject")
     teacher = relationship("User", back_populates="subjects_taught")
 
+    def weekday_numbers(self):
+        """
+        Returns the set of weekday numbers (Mon=0) this subject meets on.
+        """
+        if not self.weekdays:
+            return set(range(7))
+        days = set()
+        for token in self.weekdays.split(","):
+            token = token.strip()[:3].lower()
+            if token in WEEKDAY_NAMES:
+                days.add(WEEKDAY_NAMES.index(token))
+        return days
+
+    def runs_on(self, day):
+        return day.weekday() in self.weekday_numbers()
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -41,26 +62,35 @@ class User(Base):
     # URL to the image stored in Supabase
     image_url = Column(String(255), nullable=True)
     
-    # Face encoding stored as text (JSON string) for simplicity
+    # Face encoding stored as text (JSON string) for simplicity.
+    # With multiple templates this holds their centroid.
     face_encoding = Column(Text, nullable=True)
+    # All enrolled templates as one contiguous float32 block (k x 128)
+    face_templates = Column(LargeBinary, nullable=True)
+    # Last template change; edge kiosks pull gallery deltas newer than this
+    face_updated_at = Column(DateTime, nullable=True, index=True)
     
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     # Relationship to attendance records
     attendance_records = relationship("Attendance", back_populates="user")
     subjects_taught = relationship("Subject", back_populates="teacher")
+    face_images = relationship("FaceImage", back_populates="user")
 
 class Attendance(Base):
     __tablename__ = "attendance"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     subject_id = Column(Integer, ForeignKey("subjects.id"), nullable=True) # Nullable for now to support old records or general attendance
-    date = Column(DateTime, default=datetime.datetime.utcnow)
+    date = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     status = Column(Enum("present", "absent", "late"), default="present")
     
     user = relationship("User", back_populates="attendance_records")
     subject = relationship("Subject", back_populates="attendance_records")
 
+    # Covers per-student counts and the grouped eligibility report without touching rows
+    __table_args__ = (Index("ix_attendance_user_subject_status", "user_id", "subject_id", "status"),)
+
 
 
 # Association Table for Student Enrollments
@@ -69,3 +99,103 @@ class StudentCourse(Base):
     id = Column(Integer, primary_key=True, index=True)
     student_id = Column(Integer, ForeignKey("users.id"))
     subject_id = Column(Integer, ForeignKey("subjects.id"))
+
+# Source photos that have been enrolled, keyed by content hash so the same
+# image is never encoded twice
+class FaceImage(Base):
+    __tablename__ = "face_images"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    content_hash = Column(String(64), unique=True, index=True, nullable=False)
+    source_path = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    user = relationship("User", back_populates="face_images")
+
+# Marks recorded offline by edge kiosks, keyed by the kiosk-generated
+# mark_id so a re-sent sync batch never inserts twice
+class EdgeMark(Base):
+    __tablename__ = "edge_marks"
+    id = Column(Integer, primary_key=True, index=True)
+    mark_id = Column(String(64), unique=True, index=True, nullable=False)
+    kiosk_id = Column(String(100), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    seen_at = Column(DateTime, nullable=False)
+    result = Column(String(20), nullable=False) # marked | already_marked | no_class | unknown_user
+    attendance_id = Column(Integer, ForeignKey("attendance.id"), nullable=True)
+    received_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# Change feed shared by all workers (see cache_bus.py). ids only ever grow
+# (AUTOINCREMENT), so "everything after the last id I saw" is a range scan.
+class CacheEvent(Base):
+    __tablename__ = "cache_events"
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = Column(Integer, primary_key=True)
+    topic = Column(String(30), nullable=False) # gallery | timetable | presence
+    key = Column(String(64), nullable=True) # user_id / subject_id; NULL = whole cache
+    origin = Column(String(100), nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+# Encodings computed per stored image (see image_store.py), so the same
+# photo uploaded again is never run through the face model twice
+class ImageEncoding(Base):
+    __tablename__ = "image_encodings"
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), nullable=False, index=True)
+    profile = Column(String(20), nullable=False)
+    encoding = Column(LargeBinary, nullable=False) # float32 x 128
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint("content_hash", "profile"),)
+
+# Bulk user imports (see user_import.py). Progress lives in the DB so any
+# worker can answer a poll for a job started on another one.
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+    id = Column(String(32), primary_key=True)
+    created_by = Column(Integer, ForeignKey("users.id"))
+    status = Column(String(20), default="queued") # queued | running | done | failed
+    rows_read = Column(Integer, default=0)
+    created = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    errors = Column(Text, nullable=True) # JSON list of {line, email, error}, capped
+    message = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+# Academic terms. Once a term is over its attendance can be moved out of the
+# attendance table into a per-term archive file (see attendance_archive.py).
+class Term(Base):
+    __tablename__ = "terms"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(50), unique=True, nullable=False) # e.g. "2025-odd"
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False) # Inclusive
+    status = Column(String(20), default="open") # open | archived
+    archive_path = Column(String(255), nullable=True)
+    archived_rows = Column(Integer, default=0)
+    archived_at = Column(DateTime, nullable=True)
+
+# Attendance counts per (day, hour, subject, student department), kept up to
+# date on every attendance write (see rollups.py). subject_id 0 / department
+# "" stand for none, so the unique key also covers those rows.
+class AttendanceRollup(Base):
+    __tablename__ = "attendance_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False, index=True)
+    hour = Column(Integer, nullable=False)
+    subject_id = Column(Integer, nullable=False, default=0)
+    department = Column(String(100), nullable=False, default="")
+    present = Column(Integer, nullable=False, default=0)
+    late = Column(Integer, nullable=False, default=0)
+    absent = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (UniqueConstraint("day", "hour", "subject_id", "department"),)
+
+# Small facts the app records about its own data, e.g. that the attendance
+# rollups have been backfilled (rollups.backfill)
+class AppState(Base):
+    __tablename__ = "app_state"
+    key = Column(String(50), primary_key=True)
+    value = Column(String(255), nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,155 @@
+import threading
+from datetime import date, datetime
+
+import metrics
+
+# In-memory "already marked today" cache.
+# Structure: { subject_id: bytearray }  -- bit N set => user N has a record today
+# Only valid for PRESENCE_DAY; everything is dropped when the date changes.
+PRESENCE_BITMAPS = {}
+PRESENCE_DAY = None
+
+_lock = threading.Lock()
+
+
+def _start_of_day(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time())
+
+
+def _roll_day():
+    """
+    Drops all bitmaps once the calendar day changes (midnight reset).
+    Must be called with _lock held.
+    """
+    global PRESENCE_BITMAPS, PRESENCE_DAY
+    today = date.today()
+    if PRESENCE_DAY != today:
+        PRESENCE_BITMAPS = {}
+        PRESENCE_DAY = today
+
+
+def _set_bit(bits: bytearray, user_id: int):
+    byte_index = user_id >> 3
+    if byte_index >= len(bits):
+        bits.extend(b"\x00" * (byte_index - len(bits) + 1))
+    bits[byte_index] |= 1 << (user_id & 7)
+
+
+def _test_bit(bits: bytearray, user_id: int) -> bool:
+    byte_index = user_id >> 3
+    if byte_index >= len(bits):
+        return False
+    return bool(bits[byte_index] & (1 << (user_id & 7)))
+
+
+def warm(db_session, subject_id=None):
+    """
+    Loads today's attendance into the bitmaps with a single query.
+    Without a subject_id every subject is warmed (used at startup).
+    """
+    from models import Attendance
+
+    with _lock:
+        _roll_day()
+        day = PRESENCE_DAY
+
+    query = db_session.query(Attendance.user_id, Attendance.subject_id).filter(
+        Attendance.date >= _start_of_day(day),
+        Attendance.subject_id.isnot(None)
+    )
+    if subject_id is not None:
+        query = query.filter(Attendance.subject_id == subject_id)
+
+    loaded = {}
+    if subject_id is not None:
+        loaded[subject_id] = bytearray()
+    for user_id, sub_id in query.all():
+        _set_bit(loaded.setdefault(sub_id, bytearray()), user_id)
+
+    with _lock:
+        # Day may have rolled while we were querying; discard stale data
+        if PRESENCE_DAY != day:
+            return
+        for sub_id, bits in loaded.items():
+            existing = PRESENCE_BITMAPS.get(sub_id)
+            if existing is None:
+                PRESENCE_BITMAPS[sub_id] = bits
+            else:
+                # Keep bits set by writes that raced with the warm-up query
+                if len(existing) < len(bits):
+                    existing.extend(b"\x00" * (len(bits) - len(existing)))
+                for i, b in enumerate(bits):
+                    existing[i] |= b
+
+
+def mark(user_id: int, subject_id: int):
+    """
+    Records that user_id now has an attendance row for subject_id today.
+    Call on every attendance write path after the insert is committed.
+    """
+    if subject_id is None or user_id is None:
+        return
+    with _lock:
+        _roll_day()
+        bits = PRESENCE_BITMAPS.get(subject_id)
+        if bits is None:
+            # Not warmed yet; the warm-up query will pick this row up
+            return
+        _set_bit(bits, user_id)
+
+
+def is_marked(db_session, user_id: int, subject_id: int) -> bool:
+    """
+    Returns True if user_id already has an attendance row for subject_id today.
+    Repeat sightings are answered from memory. A miss falls back to the DB so
+    rows written by other workers are never duplicated.
+    """
+    from models import Attendance
+
+    with _lock:
+        _roll_day()
+        day = PRESENCE_DAY
+        bits = PRESENCE_BITMAPS.get(subject_id)
+        if bits is not None and _test_bit(bits, user_id):
+            metrics.cache_lookup("presence", True)
+            return True
+    metrics.cache_lookup("presence", False)
+
+    if bits is None:
+        warm(db_session, subject_id)
+        with _lock:
+            bits = PRESENCE_BITMAPS.get(subject_id)
+            if bits is not None and _test_bit(bits, user_id):
+                return True
+        return False
+
+    existing = db_session.query(Attendance.id).filter(
+        Attendance.user_id == user_id,
+        Attendance.subject_id == subject_id,
+        Attendance.date >= _start_of_day(day)
+    ).first()
+    if existing:
+        mark(user_id, subject_id)
+        return True
+    return False
+
+
+def invalidate(subject_ids=None):
+    """
+    Drops the bitmaps of subject_ids (all when None); they are re-warmed
+    from the DB on the next lookup. Used when another worker updated or
+    deleted attendance rows.
+    """
+    with _lock:
+        if subject_ids is None:
+            PRESENCE_BITMAPS.clear()
+            return
+        for subject_id in subject_ids:
+            PRESENCE_BITMAPS.pop(subject_id, None)
+
+
+def reset():
+    global PRESENCE_BITMAPS, PRESENCE_DAY
+    with _lock:
+        PRESENCE_BITMAPS = {}
+        PRESENCE_DAY = None
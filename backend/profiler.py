@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import uuid
+import random
+import cProfile
+import threading
+import functools
+from collections import Counter
+
+# Opt-in sampling profiler for recognition and dashboard hot paths.
+# PROFILE_SAMPLE_RATE=0 (default) disables it; 0.05 profiles ~5% of calls.
+# PROFILE_MODE: "cprofile" writes rotating .prof files (open with snakeviz/pstats),
+#               "stack" aggregates sampled call stacks in collapsed (flame-graph) format.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_STACK_INTERVAL = float(os.getenv("PROFILE_STACK_INTERVAL", "0.005"))
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(APP_DIR, "profiles"))
+
+MODES = ("cprofile", "stack")
+
+# Structure: { "name;outer_frame;...;inner_frame": sample_count }
+STACK_SAMPLES = Counter()
+
+_stack_lock = threading.Lock()
+_file_lock = threading.Lock()
+_active = threading.local()
+
+
+def configure(sample_rate: float = None, mode: str = None):
+    global PROFILE_SAMPLE_RATE, PROFILE_MODE
+    if sample_rate is not None:
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        PROFILE_SAMPLE_RATE = sample_rate
+    if mode is not None:
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        PROFILE_MODE = mode
+
+
+def status():
+    files = _profile_files()
+    return {
+        "enabled": PROFILE_SAMPLE_RATE > 0,
+        "sample_rate": PROFILE_SAMPLE_RATE,
+        "mode": PROFILE_MODE,
+        "profile_dir": PROFILE_DIR,
+        "profile_files": [os.path.basename(f) for f in files],
+        "stack_samples": sum(STACK_SAMPLES.values()),
+    }
+
+
+def collapsed_stacks() -> str:
+    """
+    Returns aggregated stacks as "frame;frame;frame count" lines,
+    ready for flamegraph.pl or speedscope.
+    """
+    with _stack_lock:
+        return "".join(f"{stack} {count}\n" for stack, count in STACK_SAMPLES.most_common())
+
+
+def reset_stacks():
+    with _stack_lock:
+        STACK_SAMPLES.clear()
+
+
+def _profile_files():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    files = [os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR) if f.endswith(".prof")]
+    return sorted(files, key=os.path.getmtime)
+
+
+def _dump(name, prof):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}.prof")
+    prof.dump_stats(path)
+    # Rotate: keep only the newest PROFILE_MAX_FILES dumps
+    with _file_lock:
+        files = _profile_files()
+        for old in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+            try: os.remove(old)
+            except OSError: pass
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _StackSampler(threading.Thread):
+    """
+    Samples the target thread's Python stack at a fixed interval until stopped.
+    """
+
+    def __init__(self, name, target_thread_id):
+        super().__init__(daemon=True)
+        self.name_prefix = name
+        self.target = target_thread_id
+        self.stop_event = threading.Event()
+        self.samples = Counter()
+
+    def run(self):
+        while not self.stop_event.wait(PROFILE_STACK_INTERVAL):
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(self.name_prefix)
+            self.samples[";".join(reversed(labels))] += 1
+
+    def finish(self):
+        self.stop_event.set()
+        self.join()
+        with _stack_lock:
+            STACK_SAMPLES.update(self.samples)
+
+
+def profiled(name):
+    """
+    Decorator: profiles a sampled fraction of calls to a sync function.
+    When PROFILE_SAMPLE_RATE is 0 the only cost is one float comparison.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if PROFILE_SAMPLE_RATE <= 0 or getattr(_active, "on", False):
+                return func(*args, **kwargs)
+            if random.random() >= PROFILE_SAMPLE_RATE:
+                return func(*args, **kwargs)
+
+            _active.on = True
+            try:
+                if PROFILE_MODE == "stack":
+                    sampler = _StackSampler(name, threading.get_ident())
+                    sampler.start()
+                    try:
+                        return func(*args, **kwargs)
+                    finally:
+                        sampler.finish()
+
+                prof = cProfile.Profile()
+                prof.enable()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    prof.disable()
+                    _dump(name, prof)
+            finally:
+                _active.on = False
+        return wrapper
+    return decorator
@@ -0,0 +1,101 @@
+import os
+import json
+import socket
+import threading
+import http.client
+import urllib.parse
+
+# Thin client for the recognition service (recognition_service.py), used by
+# API workers running with VISION_MODE=remote.
+# RECOGNITION_SERVICE_URL is http://host:port or unix:///path/to/socket.
+# Each thread keeps one keep-alive connection, so a kiosk burst does not pay
+# a TCP handshake per frame.
+RECOGNITION_SERVICE_URL = os.getenv("RECOGNITION_SERVICE_URL", "http://127.0.0.1:8001").rstrip("/")
+RECOGNITION_SERVICE_TOKEN = os.getenv("RECOGNITION_SERVICE_TOKEN", "")
+RECOGNITION_SERVICE_TIMEOUT = float(os.getenv("RECOGNITION_SERVICE_TIMEOUT", "10"))
+
+_local = threading.local()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _new_connection():
+    url = urllib.parse.urlsplit(RECOGNITION_SERVICE_URL)
+    if url.scheme == "unix":
+        return _UnixHTTPConnection(url.path, RECOGNITION_SERVICE_TIMEOUT)
+    if url.scheme == "https":
+        return http.client.HTTPSConnection(url.hostname, url.port or 443, timeout=RECOGNITION_SERVICE_TIMEOUT)
+    return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=RECOGNITION_SERVICE_TIMEOUT)
+
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _new_connection()
+    return conn
+
+
+def _drop_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def request(method, path, body=None, params=None):
+    """
+    Sends one request on this thread's pooled connection.
+    Returns (status, body bytes). Raises OSError if the service is unreachable.
+    """
+    if params:
+        path = f"{path}?{urllib.parse.urlencode({k: v for k, v in params.items() if v is not None})}"
+    headers = {"X-Recognition-Token": RECOGNITION_SERVICE_TOKEN}
+    if body is not None:
+        headers["Content-Type"] = "application/octet-stream"
+
+    for attempt in range(2):
+        conn = _connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            if response.will_close:
+                _drop_connection()
+            return response.status, data
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The service closed an idle keep-alive connection; retry once on a fresh one
+            _drop_connection()
+            if attempt:
+                raise
+        except (OSError, http.client.HTTPException):
+            _drop_connection()
+            raise
+
+
+def post_image(action, image_bytes, **params):
+    """
+    POSTs an image to /recognition/<action>. Returns (status, decoded JSON body).
+    """
+    status, data = request("POST", f"/recognition/{action}", body=image_bytes, params=params)
+    try:
+        return status, json.loads(data) if data else {}
+    except ValueError:
+        return status, {}
+
+
+def ready() -> bool:
+    """True if the service answers its readiness probe."""
+    try:
+        status, _ = request("GET", "/health/ready")
+        return status == 200
+    except (OSError, http.client.HTTPException):
+        return False
@@ -0,0 +1,290 @@
+"""
+Recognition service: the one process that owns the face gallery and runs
+detection, encoding and matching for every kiosk, live classroom and
+selfie verification.
+
+Requests from all callers go into one queue. A batcher thread takes up to
+RECOGNITION_BATCH_SIZE of them (waiting at most RECOGNITION_BATCH_WAIT_MS
+for the batch to fill), decodes and detects each frame, then encodes all
+the face crops in one encoder call and matches all probes against the
+gallery in one matrix product. The gallery is only touched from the
+batcher thread, so enrollment refreshes go through the same queue.
+
+Run it next to the API (from backend/):
+    RECOGNITION_SERVICE_TOKEN=... uvicorn recognition_service:app --port 8001
+    RECOGNITION_SERVICE_TOKEN=... uvicorn recognition_service:app --uds /tmp/recognition.sock
+and start the API with VISION_MODE=remote and a matching
+RECOGNITION_SERVICE_URL (http://127.0.0.1:8001 or unix:///tmp/recognition.sock).
+"""
+import io
+import os
+import hmac
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+import models, database, utils, metrics, cache_bus
+from recognition_client import RECOGNITION_SERVICE_TOKEN
+
+RECOGNITION_BATCH_SIZE = int(os.getenv("RECOGNITION_BATCH_SIZE", "16"))
+RECOGNITION_BATCH_WAIT_MS = float(os.getenv("RECOGNITION_BATCH_WAIT_MS", "5"))
+RECOGNITION_QUEUE_SIZE = int(os.getenv("RECOGNITION_QUEUE_SIZE", "256"))
+
+# This process is the recognition backend; never forward to itself
+utils.VISION_MODE = "local"
+
+# Same schema bootstrap as main.py, in case the service starts first
+models.Base.metadata.create_all(bind=database.engine)
+database.add_missing_columns(models.Base)
+
+app = FastAPI(title="Face Recognition Service")
+if metrics.METRICS_ENABLED:
+    app.middleware("http")(metrics.http_middleware)
+
+
+class Job:
+    __slots__ = ("action", "image_bytes", "params", "future", "queued_at")
+
+    def __init__(self, action, image_bytes, params):
+        self.action = action
+        self.image_bytes = image_bytes
+        self.params = params
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class Batcher(threading.Thread):
+    """
+    Single consumer of the job queue. Every gallery read and write happens here.
+    """
+
+    def __init__(self):
+        super().__init__(name="recognition-batcher", daemon=True)
+        self.jobs = queue.Queue(maxsize=RECOGNITION_QUEUE_SIZE)
+
+    def submit(self, action, image_bytes, **params):
+        job = Job(action, image_bytes, params)
+        self.jobs.put_nowait(job) # queue.Full -> caller answers 503
+        metrics.set_gauge("recognition_queue_depth", self.jobs.qsize(), help_text="Jobs waiting for the batcher")
+        return job.future
+
+    def _next_batch(self):
+        batch = [self.jobs.get()]
+        deadline = time.perf_counter() + RECOGNITION_BATCH_WAIT_MS / 1000
+        while len(batch) < RECOGNITION_BATCH_SIZE:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.jobs.get(timeout=remaining) if remaining > 0 else self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            metrics.set_gauge("recognition_queue_depth", self.jobs.qsize(), help_text="Jobs waiting for the batcher")
+            metrics.observe("recognition_batch_size", len(batch), buckets=metrics.COUNT_BUCKETS,
+                            help_text="Jobs processed per batch")
+            db = database.SessionLocal()
+            try:
+                self._process(batch, db)
+            except Exception as e:
+                print(f"[ERROR] Recognition batch failed: {e}")
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            finally:
+                db.close()
+
+    def _process(self, batch, db):
+        if not utils.KNOWN_FACES_LOADED:
+            utils.load_known_faces(db)
+
+        frames = []
+        for job in batch:
+            metrics.observe("recognition_queue_wait_seconds", time.perf_counter() - job.queued_at,
+                            help_text="Time jobs spent queued before their batch started")
+            if job.action == "refresh":
+                user_ids = job.params.get("user_ids")
+                if user_ids is None:
+                    utils.load_known_faces(db)
+                else:
+                    utils.reload_known_faces(db, user_ids)
+                job.future.set_result({"ok": True})
+            elif not utils.load_vision():
+                # Mock mode: the single-request paths already know how to fake it
+                job.future.set_result(self._mock(job, db))
+            else:
+                frames.append(job)
+
+        # 1. Decode + detect + quality gate, frame by frame
+        crops, encoded_jobs = [], []
+        for job in frames:
+            try:
+                profile = job.params["profile"]
+                with metrics.stage("decode"):
+                    image = utils.face_recognition.load_image_file(io.BytesIO(job.image_bytes))
+                with metrics.stage("detect"):
+                    locations = utils.detect_faces(image, profile)
+                if not locations:
+                    job.future.set_result(self._empty(job))
+                    continue
+                utils.gate_face(image, locations[0], profile)
+                crops.append(utils.face_crop(image, locations[0]))
+                encoded_jobs.append(job)
+            except utils.FaceQualityError as e:
+                job.future.set_exception(e)
+            except Exception as e:
+                print(f"Error in recognition service ({job.action}): {e}")
+                job.future.set_result(self._empty(job))
+
+        # 2. One encoder call for every face in the batch
+        with metrics.stage("encode"):
+            encodings = utils.encode_crops(crops)
+
+        # 3. One gallery product for every recognition probe in the batch
+        probes = [(job, enc) for job, enc in zip(encoded_jobs, encodings) if enc is not None and job.action == "recognize"]
+        with metrics.stage("match"):
+            matches = utils.match_encodings([enc for _, enc in probes]) if probes else []
+        for (job, _), (user_id, _) in zip(probes, matches):
+            metrics.inc("recognition_total", {"result": "match" if user_id else "no_match"},
+                        help_text="Recognition attempts by outcome")
+            job.future.set_result({"user_id": user_id})
+
+        for job, encoding in zip(encoded_jobs, encodings):
+            if job.future.done():
+                continue
+            if encoding is None:
+                job.future.set_result(self._empty(job))
+            elif job.action == "encode":
+                job.future.set_result({"encoding": encoding.tolist()})
+            elif job.action == "verify":
+                job.future.set_result(self._verify(job, encoding, db))
+
+    def _verify(self, job, encoding, db):
+        templates = utils.user_templates(job.params["user_id"], db)
+        if templates is None or len(templates) == 0:
+            return {"matched": False, "distance": None}
+        distance = float(utils.np.linalg.norm(templates - utils.np.asarray(encoding, dtype=utils.np.float32), axis=1).min())
+        matched = distance <= job.params["tolerance"]
+        metrics.inc("verification_total", {"result": "match" if matched else "no_match"},
+                    help_text="1:1 verification attempts by outcome")
+        return {"matched": matched, "distance": distance}
+
+    @staticmethod
+    def _empty(job):
+        return {"recognize": {"user_id": None}, "encode": {"encoding": None},
+                "verify": {"matched": False, "distance": None}}[job.action]
+
+    @staticmethod
+    def _mock(job, db):
+        params = job.params
+        if job.action == "recognize":
+            return {"user_id": utils.recognize_face(io.BytesIO(job.image_bytes), db_session=db, profile=params["profile"])}
+        if job.action == "encode":
+            return {"encoding": utils.get_face_encoding(io.BytesIO(job.image_bytes), profile=params["profile"])}
+        matched, distance = utils.verify_face(job.image_bytes, params["user_id"], db_session=db,
+                                              tolerance=params["tolerance"], profile=params["profile"])
+        return {"matched": matched, "distance": distance}
+
+
+batcher = Batcher()
+
+
+def _apply_gallery_changes(user_ids):
+    # Enrollments from any API worker; applied on the batcher thread like every gallery write
+    ids = None if user_ids is None else [int(uid) for uid in user_ids]
+    batcher.jobs.put(Job("refresh", None, {"user_ids": ids}))
+
+
+@app.on_event("startup")
+def startup_event():
+    batcher.start()
+    cache_bus.subscribe("gallery", _apply_gallery_changes)
+    cache_bus.start()
+    threading.Thread(target=_warm_up_worker, name="warmup", daemon=True).start()
+
+
+def _warm_up_worker():
+    db = database.SessionLocal()
+    try:
+        utils.warm_up(db)
+    finally:
+        db.close()
+
+
+def _check_caller(request: Request, profile: str = None):
+    if not RECOGNITION_SERVICE_TOKEN:
+        raise HTTPException(status_code=503, detail="RECOGNITION_SERVICE_TOKEN is not configured")
+    if not hmac.compare_digest(request.headers.get("X-Recognition-Token", ""), RECOGNITION_SERVICE_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid recognition token")
+    if profile is not None and profile not in utils.DETECTION_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown detection profile: {profile}")
+
+
+async def _run(action, image_bytes, **params):
+    try:
+        future = batcher.submit(action, image_bytes, **params)
+    except queue.Full:
+        raise HTTPException(status_code=503, detail="Recognition queue is full")
+    try:
+        return await asyncio.wrap_future(future)
+    except utils.FaceQualityError as e:
+        raise HTTPException(status_code=422, detail={"reason": e.reason, "message": str(e)})
+
+
+@app.post("/recognition/recognize")
+async def recognize(request: Request, profile: str = "kiosk"):
+    _check_caller(request, profile)
+    return await _run("recognize", await request.body(), profile=profile)
+
+
+@app.post("/recognition/encode")
+async def encode(request: Request, profile: str = "enrollment"):
+    _check_caller(request, profile)
+    return await _run("encode", await request.body(), profile=profile)
+
+
+@app.post("/recognition/verify")
+async def verify(request: Request, user_id: int, tolerance: float = utils.MATCH_TOLERANCE, profile: str = "verify"):
+    _check_caller(request, profile)
+    return await _run("verify", await request.body(), user_id=user_id, tolerance=tolerance, profile=profile)
+
+
+# Called by the API after an enrollment is committed
+@app.post("/recognition/refresh")
+async def refresh(request: Request, user_id: int):
+    _check_caller(request)
+    return await _run("refresh", None, user_ids=[user_id])
+
+
+@app.get("/health/live")
+def liveness_check():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+def readiness_check():
+    state = utils.WARMUP_STATE
+    body = {
+        "ready": state["ready"],
+        "stages": state["stages"],
+        "error": state["error"],
+        "gallery_faces": len(utils.KNOWN_FACES_CACHE),
+        "queue_depth": batcher.jobs.qsize(),
+    }
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,419 @@
+import os
+import argparse
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import event, inspect, select, func, cast, extract, Date, Integer
+from sqlalchemy.exc import IntegrityError
+
+# Pre-aggregated attendance for trend charts.
+#
+# attendance_rollups holds present / late / absent counts per (day, hour,
+# subject, student department). Every ORM write to attendance adjusts its
+# bucket in the same transaction (register_listeners); bulk inserts that skip
+# the ORM call apply() themselves. A year of charts therefore reads a few
+# thousand small rows instead of every attendance record, and archiving a
+# term (attendance_archive.py) leaves its rollups in place.
+#
+# Rows are attributed to the student's department at the time of the write.
+# backfill() counts the records written before the rollups existed, once per
+# database; rebuild() recomputes a date range from the raw records (live
+# table and archives), e.g. after departments were reassigned.
+STATUSES = ("present", "late", "absent")
+GRANULARITIES = ("hour", "day", "week", "month", "weekday", "weekday_hour")
+GROUP_BY = ("none", "subject", "department")
+WEEKDAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+DEFAULT_RANGE_DAYS = 30
+# NULLs never collide in a unique key, so "no subject" / "no department" use these
+NO_SUBJECT = 0
+NO_DEPARTMENT = ""
+BACKFILL_MARKER = "rollups_backfilled" # app_state key
+
+
+def _bucket(day_value, hour, subject_id, department):
+    return (day_value, int(hour), subject_id or NO_SUBJECT, department or NO_DEPARTMENT)
+
+
+def _upsert(connection, buckets):
+    """
+    Adds {bucket: {status: count}} to the rollups, creating missing rows.
+    """
+    from models import AttendanceRollup
+    table = AttendanceRollup.__table__
+    rows = [{"day": day_value, "hour": hour, "subject_id": subject_id, "department": department,
+             **{status: counts.get(status, 0) for status in STATUSES}}
+            for (day_value, hour, subject_id, department), counts in buckets.items()]
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=["day", "hour", "subject_id", "department"],
+            set_={status: table.c[status] + statement.excluded[status] for status in STATUSES}), rows)
+    elif dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table)
+        connection.execute(statement.on_duplicate_key_update(
+            **{status: table.c[status] + statement.inserted[status] for status in STATUSES}), rows)
+    else:
+        for row in rows:
+            key = [table.c.day == row["day"], table.c.hour == row["hour"],
+                   table.c.subject_id == row["subject_id"], table.c.department == row["department"]]
+            increments = {status: table.c[status] + row[status] for status in STATUSES}
+            if connection.execute(table.update().where(*key).values(**increments)).rowcount == 0:
+                connection.execute(table.insert().values(**row))
+
+
+def apply(connection, rows, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) attendance rows from their buckets.
+    rows are dicts with user_id, subject_id, date and status; run it on the
+    connection of the transaction that writes them.
+    """
+    from models import User
+    rows = [r for r in rows if r["status"] in STATUSES and r["date"] is not None]
+    if not rows:
+        return
+    user_ids = {r["user_id"] for r in rows if r["user_id"] is not None}
+    users = User.__table__
+    departments = dict(connection.execute(
+        select(users.c.id, users.c.department).where(users.c.id.in_(user_ids))
+    ).all()) if user_ids else {}
+
+    buckets = {}
+    for r in rows:
+        key = _bucket(r["date"].date(), r["date"].hour, r["subject_id"], departments.get(r["user_id"]))
+        counts = buckets.setdefault(key, {})
+        counts[r["status"]] = counts.get(r["status"], 0) + sign
+    _upsert(connection, buckets)
+
+
+# ------------------------
+# WRITE-SIDE HOOKS
+# ------------------------
+TRACKED = ("user_id", "subject_id", "date", "status")
+
+
+def _row(target):
+    return {name: getattr(target, name) for name in TRACKED}
+
+
+def _inserted(mapper, connection, target):
+    apply(connection, [_row(target)])
+
+
+def _updated(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in TRACKED):
+        return
+    before = {}
+    for name in TRACKED:
+        history = state.attrs[name].history
+        before[name] = history.deleted[0] if history.deleted else getattr(target, name)
+    apply(connection, [before], sign=-1)
+    apply(connection, [_row(target)])
+
+
+def _deleted(mapper, connection, target):
+    apply(connection, [_row(target)], sign=-1)
+
+
+def register_listeners():
+    """
+    Keeps the rollups in step with every ORM write to attendance.
+    """
+    from models import Attendance
+    hooks = [("after_insert", _inserted), ("after_update", _updated), ("after_delete", _deleted)]
+    for event_name, hook in hooks:
+        if not event.contains(Attendance, event_name, hook):
+            event.listen(Attendance, event_name, hook)
+
+
+# ------------------------
+# REBUILD
+# ------------------------
+def _day_hour(dialect, column):
+    day_expr = func.date(column) if dialect in ("sqlite", "mysql", "mariadb") else cast(column, Date)
+    return day_expr, cast(extract("hour", column), Integer)
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def _grouped(connection, table, departments, start, end):
+    """
+    (day, hour, subject_id, department, status, count) for table rows in
+    [start, end), joined to departments (a user id / department table).
+    """
+    day_expr, hour_expr = _day_hour(connection.dialect.name, table.c.date)
+    query = (
+        select(day_expr, hour_expr, table.c.subject_id, departments.c.department, table.c.status, func.count())
+        .select_from(table.outerjoin(departments, departments.c.id == table.c.user_id))
+        .group_by(day_expr, hour_expr, table.c.subject_id, departments.c.department, table.c.status)
+    )
+    if start:
+        query = query.where(table.c.date >= start)
+    if end:
+        query = query.where(table.c.date < end)
+    return connection.execute(query).all()
+
+
+def _live_groups(connection, start_dt=None, end_dt=None):
+    from models import Attendance, User
+    return list(_grouped(connection, Attendance.__table__, User.__table__, start_dt, end_dt))
+
+
+def _archive_groups(db_session, start_dt=None, end_dt=None):
+    from sqlalchemy import MetaData, Table, Column, String
+    from models import User
+    import attendance_archive
+
+    groups = []
+    terms = attendance_archive.archived_terms(db_session, start_dt, end_dt)
+    if terms:
+        # Archives hold user ids only; give each a temporary copy of the departments
+        user_departments = [{"id": uid, "department": dept} for uid, dept in
+                            db_session.query(User.id, User.department).all()]
+        departments = Table("rollup_departments", MetaData(), Column("id", Integer, primary_key=True),
+                            Column("department", String(100)), prefixes=["TEMPORARY"])
+        for term in terms:
+            path = os.path.join(attendance_archive.ARCHIVE_DIR, term.archive_path)
+            if not os.path.exists(path):
+                print(f"[WARN] Archive for term {term.name} is missing: {path}")
+                continue
+            with attendance_archive.archive_engine(path).connect() as archive:
+                departments.create(archive, checkfirst=True)
+                archive.execute(departments.delete())
+                if user_departments:
+                    archive.execute(departments.insert(), user_departments)
+                groups += _grouped(archive, attendance_archive.archive_table, departments, start_dt, end_dt)
+                departments.drop(archive)
+    return groups
+
+
+def _buckets(groups):
+    """
+    {bucket: {status: count}} from _grouped() rows.
+    """
+    buckets = {}
+    for day_value, hour, subject_id, department, status, count in groups:
+        if status not in STATUSES:
+            continue
+        counts = buckets.setdefault(_bucket(_as_date(day_value), hour, subject_id, department), {})
+        counts[status] = counts.get(status, 0) + count
+    return buckets
+
+
+def rebuild(db_session, start=None, end=None):
+    """
+    Recomputes the rollups for days in [start, end] (dates, either open)
+    from the live table and the archived terms. Returns the bucket count.
+    Attendance written while it runs may be miscounted; use it when the
+    kiosks are quiet.
+    """
+    from models import AttendanceRollup, AppState
+
+    start_dt = datetime.combine(start, datetime.min.time()) if start else None
+    end_dt = datetime.combine(end + timedelta(days=1), datetime.min.time()) if end else None
+    connection = db_session.connection()
+    buckets = _buckets(_live_groups(connection, start_dt, end_dt) + _archive_groups(db_session, start_dt, end_dt))
+
+    rollups = AttendanceRollup.__table__
+    delete = rollups.delete()
+    if start:
+        delete = delete.where(rollups.c.day >= start)
+    if end:
+        delete = delete.where(rollups.c.day <= end)
+    connection.execute(delete)
+    if buckets:
+        connection.execute(rollups.insert(), [
+            {"day": d, "hour": h, "subject_id": s, "department": dept,
+             **{status: counts.get(status, 0) for status in STATUSES}}
+            for (d, h, s, dept), counts in buckets.items()
+        ])
+    if not start and not end:
+        # A full rebuild also covers what backfill() would add
+        db_session.merge(AppState(key=BACKFILL_MARKER, value="rebuild", updated_at=datetime.utcnow()))
+    db_session.commit()
+    records = sum(sum(counts.values()) for counts in buckets.values())
+    print(f"[INFO] Rebuilt attendance rollups: {len(buckets)} buckets from {records} records")
+    return len(buckets)
+
+
+def _snapshot(connection):
+    """
+    Begins a transaction in which every read sees the same database state.
+    """
+    if connection.dialect.name == "sqlite":
+        # pysqlite only opens a transaction before writes; each SELECT would see its own state
+        connection.exec_driver_sql("BEGIN")
+        return connection
+    connection = connection.execution_options(isolation_level="REPEATABLE READ")
+    connection.begin()
+    return connection
+
+
+def backfill():
+    """
+    Counts the attendance recorded before the rollups existed, once per
+    database (app_state BACKFILL_MARKER). The API runs it on a thread at
+    startup with the write hooks already live, possibly in several workers:
+
+      1. one snapshot gives both the live table's counts and the rollups as
+         the hooks had left them at that moment (archived terms are not
+         written to, so they are read after it)
+      2. only the difference is added, with the hooks' own upserts, so
+         writes made after the snapshot stay counted
+      3. the marker is inserted in the same transaction; a worker finishing
+         second fails on it and rolls its additions back
+
+    Returns the number of buckets adjusted, or None if already done.
+    """
+    import database
+    from models import AttendanceRollup, AppState
+    db = database.SessionLocal()
+    try:
+        if db.get(AppState, BACKFILL_MARKER) is not None:
+            return None
+        rollups = AttendanceRollup.__table__
+        with database.engine.connect() as connection:
+            connection = _snapshot(connection)
+            groups = _live_groups(connection)
+            current = connection.execute(select(
+                rollups.c.day, rollups.c.hour, rollups.c.subject_id, rollups.c.department,
+                *[rollups.c[status] for status in STATUSES])).all()
+            connection.rollback()
+        buckets = _buckets(groups + _archive_groups(db))
+        for day_value, hour, subject_id, department, *values in current:
+            counts = buckets.setdefault(_bucket(_as_date(day_value), hour, subject_id, department), {})
+            for status, value in zip(STATUSES, values):
+                counts[status] = counts.get(status, 0) - (value or 0)
+        buckets = {key: counts for key, counts in buckets.items() if any(counts.values())}
+
+        db.add(AppState(key=BACKFILL_MARKER, value="backfill", updated_at=datetime.utcnow()))
+        db.flush()
+        _upsert(db.connection(), buckets)
+        db.commit()
+        print(f"[INFO] Backfilled attendance rollups: {len(buckets)} buckets adjusted")
+        return len(buckets)
+    except IntegrityError:
+        # Another worker finished the backfill first
+        db.rollback()
+    except Exception as e:
+        db.rollback()
+        print(f"[ERROR] Rollup backfill failed: {e}")
+    finally:
+        db.close()
+
+
+# ------------------------
+# READ SIDE
+# ------------------------
+def _bucket_label(day_value, hour, granularity):
+    if granularity == "hour":
+        return hour
+    if granularity == "day":
+        return day_value.isoformat()
+    if granularity == "week":
+        return (day_value - timedelta(days=day_value.weekday())).isoformat()
+    if granularity == "month":
+        return day_value.strftime("%Y-%m")
+    if granularity == "weekday":
+        return WEEKDAY_NAMES[day_value.weekday()]
+    return f"{WEEKDAY_NAMES[day_value.weekday()]}-{hour:02d}"
+
+
+def series(db_session, start=None, end=None, granularity="day", group_by="none", department=None, subject_id=None):
+    """
+    Present / late / absent counts per time bucket (and per subject or
+    department) for days in [start, end]. Defaults to the last 30 days.
+
+    granularity: hour (hour of day), day, week (Monday), month, weekday,
+    weekday_hour (heatmap cells such as "mon-09").
+    """
+    from models import AttendanceRollup, Subject
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if group_by not in GROUP_BY:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+    end = end or date.today()
+    start = start or end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if start > end:
+        raise ValueError("start is after end")
+
+    r = AttendanceRollup
+    key_column = {"subject": r.subject_id, "department": r.department}.get(group_by)
+    columns = [r.day, r.hour] + ([key_column] if key_column is not None else [])
+    query = db_session.query(*columns, func.sum(r.present), func.sum(r.late), func.sum(r.absent)).filter(
+        r.day >= start, r.day <= end
+    )
+    if department:
+        query = query.filter(r.department == department)
+    if subject_id:
+        query = query.filter(r.subject_id == subject_id)
+    rows = query.group_by(*columns).all()
+
+    codes = {}
+    if group_by == "subject":
+        codes = dict(db_session.query(Subject.id, Subject.code).all())
+
+    points = {}
+    for row in rows:
+        day_value, hour = row[0], row[1]
+        key = row[2] if key_column is not None else None
+        if group_by == "subject":
+            key = codes.get(key) if key != NO_SUBJECT else None
+        elif group_by == "department":
+            key = key or None
+        point = points.setdefault((_bucket_label(day_value, hour, granularity), key), [0, 0, 0])
+        for i, value in enumerate(row[-3:]):
+            point[i] += int(value or 0)
+
+    def order(item):
+        (label, key), _ = item
+        if granularity == "weekday":
+            label = WEEKDAY_NAMES.index(label)
+        elif granularity == "weekday_hour":
+            label = (WEEKDAY_NAMES.index(label[:3]), label[4:])
+        return (label, key or "")
+
+    result = []
+    for (label, key), (present, late, absent) in sorted(points.items(), key=order):
+        total = present + late + absent
+        point = {"bucket": label, "present": present, "late": late, "absent": absent, "total": total,
+                 "percentage": round(present / total * 100, 1) if total else 0.0}
+        if group_by != "none":
+            point[group_by] = key
+        result.append(point)
+    return {"start": start.isoformat(), "end": end.isoformat(), "granularity": granularity,
+            "group_by": group_by, "rows_read": len(rows), "series": result}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute attendance rollups from the raw records")
+    parser.add_argument("--start", default=None, help="YYYY-MM-DD (default: all history)")
+    parser.add_argument("--end", default=None, help="YYYY-MM-DD")
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine, add_missing_columns
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(Base)
+
+    db = SessionLocal()
+    try:
+        rebuild(db,
+                datetime.strptime(args.start, "%Y-%m-%d").date() if args.start else None,
+                datetime.strptime(args.end, "%Y-%m-%d").date() if args.end else None)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"[FATAL ERROR] {e}")
+    finally:
+        db.close()
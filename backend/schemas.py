@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
-from datetime import datetime, time
+from datetime import datetime, date, time
 
 class UserBase(BaseModel):
     email: EmailStr
@@ -62,6 +62,8 @@ class SubjectResponse(BaseModel):
     department: str | None
     start_time: time | None = None
     end_time: time | None = None
+    room: str | None = None
+    weekdays: str | None = None
 
     class Config:
         orm_mode = True
@@ -87,3 +89,26 @@ class UserUpdateProfile(BaseModel):
     employee_id: Optional[str] = None
     department: Optional[str] = None
 
+
+class ProfilingConfig(BaseModel):
+    sample_rate: Optional[float] = None # 0 disables, 1 profiles every call
+    mode: Optional[str] = None # cprofile, stack
+    reset_stacks: bool = False
+
+
+class EdgeMark(BaseModel):
+    mark_id: str # Generated by the kiosk; re-sending the same id is a no-op
+    user_id: int
+    seen_at: datetime
+    distance: Optional[float] = None
+
+class EdgeSyncRequest(BaseModel):
+    kiosk_id: str
+    room: Optional[str] = None
+    marks: List[EdgeMark]
+
+
+class TermCreate(BaseModel):
+    name: str
+    start_date: date
+    end_date: date # Inclusive
@@ -0,0 +1,174 @@
+import bisect
+import threading
+from datetime import date, datetime
+
+from sqlalchemy import event
+
+# In-memory timetable index for the current day.
+# Structure: { key: (segment_starts, segment_sessions) } where key is
+# ("room", name), ("dept", name) or ("all", None). Segments are disjoint,
+# sorted [start, end) ranges in seconds-of-day, each holding the session
+# that wins at that time (or None), so a lookup is a single bisect.
+TIMETABLE_INDEX = {}
+TIMETABLE_DAY = None
+TIMETABLE_DIRTY = True
+
+_lock = threading.Lock()
+
+ALL_KEY = ("all", None)
+
+
+class ClassSession:
+    __slots__ = ("subject_id", "name", "code", "department", "room", "start", "end")
+
+    def __init__(self, subject):
+        self.subject_id = subject.id
+        self.name = subject.name
+        self.code = subject.code
+        self.department = subject.department
+        self.room = subject.room
+        self.start = _seconds(subject.start_time)
+        # end_time is inclusive in the schedule, so extend by one second
+        self.end = _seconds(subject.end_time) + 1
+
+
+def _seconds(t) -> int:
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def _winner(active):
+    # Overlapping sessions: the one that started most recently wins,
+    # ties go to the shorter session
+    return max(active, key=lambda s: (s.start, -s.end)) if active else None
+
+
+def _build_segments(sessions):
+    """
+    Splits the day at every session boundary and precomputes the winning
+    session for each elementary segment.
+    """
+    boundaries = sorted({s.start for s in sessions} | {s.end for s in sessions})
+    starts, winners = [], []
+    for b in boundaries[:-1]:
+        active = [s for s in sessions if s.start <= b < s.end]
+        winner = _winner(active)
+        if winners and winners[-1] is winner:
+            continue  # merge with previous segment
+        starts.append(b)
+        winners.append(winner)
+    if boundaries:
+        starts.append(boundaries[-1])
+        winners.append(None)
+    return starts, winners
+
+
+def invalidate(*args, **kwargs):
+    """
+    Marks the index stale; it is rebuilt on the next lookup.
+    Signature accepts SQLAlchemy event arguments.
+    """
+    global TIMETABLE_DIRTY
+    TIMETABLE_DIRTY = True
+
+
+def _build_index(db_session, day: date):
+    """
+    Expands each subject's weekday pattern into the day's session list and
+    builds per-room, per-department and global segment tables.
+    Returns (index, session_count).
+    """
+    from models import Subject
+
+    subjects = db_session.query(Subject).filter(
+        Subject.start_time.isnot(None),
+        Subject.end_time.isnot(None)
+    ).all()
+
+    grouped = {ALL_KEY: []}
+    for sub in subjects:
+        # Known rooms and departments stay in the index even on days they have
+        # no class, so they never fall back to another room's or department's schedule
+        if sub.room:
+            grouped.setdefault(("room", sub.room), [])
+        if sub.department:
+            grouped.setdefault(("dept", sub.department), [])
+        if not sub.runs_on(day):
+            continue
+        session = ClassSession(sub)
+        grouped[ALL_KEY].append(session)
+        if sub.room:
+            grouped[("room", sub.room)].append(session)
+        if sub.department:
+            grouped[("dept", sub.department)].append(session)
+
+    index = {key: _build_segments(sessions) for key, sessions in grouped.items()}
+    return index, len(grouped[ALL_KEY])
+
+
+def build(db_session, day: date = None):
+    """
+    Rebuilds the shared index for day (default today).
+    """
+    global TIMETABLE_INDEX, TIMETABLE_DAY, TIMETABLE_DIRTY
+    day = day or date.today()
+    index, count = _build_index(db_session, day)
+    with _lock:
+        TIMETABLE_INDEX = index
+        TIMETABLE_DAY = day
+        TIMETABLE_DIRTY = False
+    print(f"[INFO] Timetable index built: {count} sessions for {day}.")
+
+
+def index_for(db_session, day: date):
+    """
+    The shared index when day is today, otherwise a one-off index for day
+    (e.g. marks synced late by an offline kiosk) that leaves today's alone.
+    """
+    if day == date.today():
+        if TIMETABLE_DIRTY or TIMETABLE_DAY != day:
+            build(db_session, day)
+        return TIMETABLE_INDEX
+    return _build_index(db_session, day)[0]
+
+
+def _lookup(index, key, seconds):
+    entry = index.get(key)
+    if not entry:
+        return None
+    starts, winners = entry
+    i = bisect.bisect_right(starts, seconds) - 1
+    if i < 0:
+        return None
+    return winners[i]
+
+
+def resolve(db_session, now: datetime = None, room: str = None, department: str = None, index=None):
+    """
+    Returns the active ClassSession (or None) for a kiosk.
+    Lookup order: the kiosk's room, then the department, then any class.
+    A known room or department answers on its own (None when it has no class
+    running); only unknown ones fall through to the next step.
+    index lets callers resolving many past marks reuse one index_for() result.
+    """
+    now = now or datetime.now()
+    if index is None:
+        if TIMETABLE_DIRTY or TIMETABLE_DAY != now.date():
+            build(db_session, now.date())
+        index = TIMETABLE_INDEX
+
+    seconds = _seconds(now.time())
+    if room and ("room", room) in index:
+        return _lookup(index, ("room", room), seconds)
+    if department and ("dept", department) in index:
+        return _lookup(index, ("dept", department), seconds)
+    return _lookup(index, ALL_KEY, seconds)
+
+
+def register_listeners():
+    """
+    Rebuilds the index whenever a Subject row is inserted, updated or deleted.
+    """
+    from models import Subject
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        if not event.contains(Subject, event_name, invalidate):
+            event.listen(Subject, event_name, invalidate)
@@ -0,0 +1,334 @@
+"""
+Bulk user import for POST /admin/users/import.
+
+The upload (CSV with a header row, or NDJSON with one object per line) is
+spooled to a temp file and then read row by row on a background thread,
+so a file with any number of users never sits in memory at once. Rows are
+validated as they are read, then handled in batches of IMPORT_BATCH_SIZE:
+
+  1. one IN query finds emails that are already registered
+  2. bcrypt hashes for the batch are computed across a process pool,
+     while face photos (optional zip, "photo" column) are encoded here
+  3. the batch is inserted and committed in one transaction
+
+Progress and per-row errors are kept in import_jobs, so
+GET /admin/users/import/{job_id} works from any worker.
+
+Columns: name, email, password, role (student | teacher, default student),
+employee_id, department, roll_number, course, year_semester, photo.
+"""
+import os
+import csv
+import json
+import uuid
+import shutil
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+
+import auth
+import utils
+import schemas
+import database
+import image_store
+import frame_cache
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", "0")) or os.cpu_count() or 1
+IMPORT_MAX_ERRORS = 1000 # Stored per job; later errors are only counted
+IMPORT_ROLES = ("student", "teacher") # Admin accounts are created one by one
+EMAIL_DOMAIN = "@vbis.com"
+FIELDS = ("name", "email", "password", "role", "employee_id", "department",
+          "roll_number", "course", "year_semester", "photo")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _hash_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the API process has threads that may hold locks
+            _pool = ProcessPoolExecutor(max_workers=IMPORT_HASH_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _hash_chunk(passwords):
+    return [auth.get_password_hash(p) for p in passwords]
+
+
+def hash_passwords_async(passwords):
+    """
+    Starts hashing on the pool; returns a callable that waits for the hashes.
+    bcrypt is deliberately slow, so this is the bulk of an import's CPU time.
+    """
+    if not passwords:
+        return lambda: []
+    pool = _hash_pool()
+    chunk = max(1, len(passwords) // (IMPORT_HASH_WORKERS * 4))
+    futures = [pool.submit(_hash_chunk, passwords[i:i + chunk]) for i in range(0, len(passwords), chunk)]
+    return lambda: [h for f in futures for h in f.result()]
+
+
+def detect_format(filename, content_type=None):
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or (content_type or "").endswith("ndjson"):
+        return "ndjson"
+    if name.endswith(".csv") or (content_type or "") in ("text/csv", "application/vnd.ms-excel"):
+        return "csv"
+    return None
+
+
+def iter_rows(path, fmt):
+    """
+    Yields (line number, dict or None) one row at a time; None marks an
+    unparseable NDJSON line.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_no, row if isinstance(row, dict) else None
+
+
+def validate_row(row):
+    """
+    Returns (schemas.UserCreate, photo name or None). Raises ValueError.
+    """
+    if row is None:
+        raise ValueError("Not a JSON object")
+    fields = {}
+    for key in FIELDS:
+        value = row.get(key)
+        value = str(value).strip() if value is not None else ""
+        if value:
+            fields[key] = value
+    photo = fields.pop("photo", None)
+    try:
+        user = schemas.UserCreate(**fields)
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+    user.email = user.email.lower()
+    if not user.email.endswith(EMAIL_DOMAIN):
+        raise ValueError(f"Email must belong to {EMAIL_DOMAIN} domain")
+    if user.role not in IMPORT_ROLES:
+        raise ValueError(f"role must be one of {', '.join(IMPORT_ROLES)}")
+    return user, photo
+
+
+class ImportRun:
+    def __init__(self, job_id, rows_path, fmt, photos_path=None):
+        self.job_id = job_id
+        self.rows_path = rows_path
+        self.fmt = fmt
+        self.photos_path = photos_path
+        self.photos = None
+        self.seen_emails = set()
+        self.errors = []
+        self.stats = {"rows_read": 0, "created": 0, "failed": 0}
+
+    def error(self, line, email, message):
+        self.stats["failed"] += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "email": email, "error": message})
+
+    def run(self):
+        from models import ImportJob
+        db = database.SessionLocal()
+        job = db.query(ImportJob).filter(ImportJob.id == self.job_id).first()
+        try:
+            job.status = "running"
+            db.commit()
+            if self.photos_path:
+                self.photos = zipfile.ZipFile(self.photos_path)
+            batch = []
+            for line, row in iter_rows(self.rows_path, self.fmt):
+                self.stats["rows_read"] += 1
+                try:
+                    user, photo = validate_row(row)
+                except ValueError as e:
+                    self.error(line, (row or {}).get("email"), str(e))
+                    continue
+                if user.email in self.seen_emails:
+                    self.error(line, user.email, "Duplicate email in this file")
+                    continue
+                self.seen_emails.add(user.email)
+                batch.append((line, user, photo))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    self.process_batch(db, batch)
+                    self.save_progress(db, job)
+                    batch = []
+            if batch:
+                self.process_batch(db, batch)
+            job.status = "done"
+        except Exception as e:
+            db.rollback()
+            print(f"[ERROR] Import {self.job_id} failed: {e}")
+            job.status, job.message = "failed", str(e)
+        finally:
+            job.finished_at = datetime.utcnow()
+            self.save_progress(db, job)
+            status = job.status
+            db.close()
+            if self.photos is not None:
+                self.photos.close()
+            for path in (self.rows_path, self.photos_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        print(f"[INFO] Import {self.job_id} {status}: {self.stats}")
+
+    def save_progress(self, db, job):
+        for key, value in self.stats.items():
+            setattr(job, key, value)
+        job.errors = json.dumps(self.errors)
+        db.commit()
+
+    def _encode_photo(self, db, photo):
+        """
+        Returns (encoding, image_url) or raises ValueError.
+        """
+        if self.photos is None:
+            raise ValueError("photo given but no photos zip was uploaded")
+        try:
+            content = self.photos.read(photo)
+        except KeyError:
+            raise ValueError(f"{photo} not found in photos zip")
+        digest, created = image_store.save_upload(content)
+        try:
+            encoding = image_store.encoding_for(db, digest, content, profile="enrollment")
+        except utils.FaceQualityError as e:
+            encoding, reason = None, f"Face photo rejected: {e}"
+        else:
+            reason = "No face detected in the photo"
+        if not encoding:
+            if created:
+                image_store.get_store().delete(digest)
+            raise ValueError(reason)
+        return encoding, image_store.url_for(digest)
+
+    def process_batch(self, db, batch):
+        from models import User
+
+        # 1. One query for every email in the batch
+        emails = [user.email for _, user, _ in batch]
+        taken = {email for (email,) in db.query(User.email).filter(User.email.in_(emails)).all()}
+        pending = []
+        for line, user, photo in batch:
+            if user.email in taken:
+                self.error(line, user.email, "Email already registered")
+            else:
+                pending.append((line, user, photo))
+
+        # 2. Hashing runs on the pool while photos are encoded here
+        wait_for_hashes = hash_passwords_async([user.password for _, user, _ in pending])
+        faces = {}
+        for line, user, photo in pending:
+            if photo:
+                try:
+                    faces[line] = self._encode_photo(db, photo)
+                except ValueError as e:
+                    self.error(line, user.email, str(e))
+        hashes = wait_for_hashes()
+
+        # 3. One transaction for the batch
+        rows = []
+        for (line, user, photo), password_hash in zip(pending, hashes):
+            if photo and line not in faces:
+                continue
+            new_user = User(
+                email=user.email, name=user.name, password_hash=password_hash, role=user.role,
+                employee_id=user.employee_id, department=user.department, roll_number=user.roll_number,
+                course=user.course, year_semester=user.year_semester, account_status="active",
+            )
+            if line in faces:
+                encoding, new_user.image_url = faces[line]
+                utils.enroll_template(new_user, encoding)
+            rows.append((line, new_user))
+        if not rows:
+            return
+        db.add_all([u for _, u in rows])
+        try:
+            db.commit()
+            created = [u for _, u in rows]
+        except IntegrityError:
+            # Someone registered one of these emails since the check; insert the rest one by one
+            db.rollback()
+            created = []
+            for line, new_user in rows:
+                db.add(new_user)
+                try:
+                    db.commit()
+                    created.append(new_user)
+                except IntegrityError:
+                    db.rollback()
+                    self.error(line, new_user.email, "Email already registered")
+        self.stats["created"] += len(created)
+
+        enrolled = [u for u in created if u.face_templates]
+        for new_user in enrolled:
+            utils.set_known_face(new_user.id, utils.templates_from_bytes(new_user.face_templates))
+            utils.refresh_remote_face(new_user.id)
+        if enrolled:
+            # Kiosk frames cached as "no match" may show one of these faces
+            frame_cache.clear()
+
+
+def _spool(fileobj, suffix):
+    fd, path = tempfile.mkstemp(prefix="user_import_", suffix=suffix)
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(fileobj, out, 1 << 20)
+    return path
+
+
+def start(db_session, created_by, rows_file, fmt, photos_file=None):
+    """
+    Spools the uploads to disk, records the job and starts it in the
+    background. Returns the ImportJob.
+    """
+    from models import ImportJob
+    rows_path = _spool(rows_file, "." + fmt)
+    photos_path = None
+    if photos_file is not None:
+        photos_path = _spool(photos_file, ".zip")
+        if not zipfile.is_zipfile(photos_path):
+            os.remove(rows_path)
+            os.remove(photos_path)
+            raise ValueError("photos must be a zip file")
+
+    job = ImportJob(id=uuid.uuid4().hex, created_by=created_by, status="queued")
+    db_session.add(job)
+    db_session.commit()
+    run = ImportRun(job.id, rows_path, fmt, photos_path)
+    threading.Thread(target=run.run, name=f"user-import-{job.id[:8]}", daemon=True).start()
+    return job
+
+
+def job_status(job):
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "rows_read": job.rows_read,
+        "created": job.created,
+        "failed": job.failed,
+        "errors": json.loads(job.errors) if job.errors else [],
+        "message": job.message,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
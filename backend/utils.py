@@ -1,85 +1,618 @@
-import shutil
 import os
-import uuid
+import io
+import time
 import json
-import numpy as np
-import cv2
+import threading
+import importlib
+from datetime import datetime
+import http.client
+import metrics
+import profiler
 
-# Try importing face_recognition
-try:
-    import face_recognition
-    REAL_RECOGNITION_AVAILABLE = True
-except ImportError:
-    REAL_RECOGNITION_AVAILABLE = False
-    print("WARNING: face_recognition library not found. Running in MOCK mode.")
+
+class _LazyModule:
+    """
+    Stands in for a heavy module and imports it on first attribute access,
+    so workers that never touch a face image never load it.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+np = _LazyModule("numpy")
+cv2 = _LazyModule("cv2")
+
+# face_recognition (dlib + model weights) is imported by load_vision() on
+# first use. None means "not tried yet".
+face_recognition = None
+REAL_RECOGNITION_AVAILABLE = None
+_vision_lock = threading.Lock()
+
+# VISION_MODE=local  : this process runs detection/encoding itself (default)
+# VISION_MODE=remote : this process never imports the vision stack and
+#                      forwards recognition to the recognition service
+#                      (recognition_service.py, see recognition_client.py)
+VISION_MODE = os.getenv("VISION_MODE", "local")
+
+
+def load_vision():
+    """
+    Imports face_recognition once and returns REAL_RECOGNITION_AVAILABLE.
+    """
+    global face_recognition, REAL_RECOGNITION_AVAILABLE
+    if REAL_RECOGNITION_AVAILABLE is not None:
+        return REAL_RECOGNITION_AVAILABLE
+    with _vision_lock:
+        if REAL_RECOGNITION_AVAILABLE is None:
+            try:
+                import face_recognition as _fr
+                face_recognition = _fr
+                REAL_RECOGNITION_AVAILABLE = True
+            except ImportError:
+                REAL_RECOGNITION_AVAILABLE = False
+                print("WARNING: face_recognition library not found. Running in MOCK mode.")
+    return REAL_RECOGNITION_AVAILABLE
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_DIR = os.path.join(APP_DIR, "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # Global Cache for Known Faces
-# Structure: { user_id: [encoding_array] }
+# Structure: { user_id: centroid_array }
 KNOWN_FACES_CACHE = {} 
+# Structure: { user_id: (k, 128) float32 array of enrolled templates }
+KNOWN_TEMPLATES_CACHE = {}
 KNOWN_FACES_LOADED = False
 
-def upload_to_supabase(file_content: bytes, filename: str) -> str:
-    # Save locally for now
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    with open(file_path, "wb") as f:
-        f.write(file_content)
-    return file_path
+# GALLERY_MODE=float32 : the dicts above (default)
+# GALLERY_MODE=int8 | float16 : KNOWN_FACES_CACHE is a compact_gallery.CompactGallery
+#   of quantized centroids; templates are read from the DB for the exact
+#   re-rank and KNOWN_TEMPLATES_CACHE stays empty
+GALLERY_MODE = os.getenv("GALLERY_MODE", "float32")
+GALLERY_RERANK_CACHE = int(os.getenv("GALLERY_RERANK_CACHE", "1024")) # Users whose templates stay in memory
 
-def load_known_faces(db_session):
+# Contiguous centroid matrix for vectorized shortlisting, rebuilt lazily
+_GALLERY_IDS = None
+_GALLERY_CENTROIDS = None
+# Guards gallery writes (request threads, cache bus) against the matrix rebuild
+_gallery_lock = threading.Lock()
+
+# Multi-template enrollment
+ENCODING_DIM = 128
+MATCH_TOLERANCE = 0.5
+MAX_TEMPLATES_PER_USER = 5
+DUPLICATE_TEMPLATE_DISTANCE = 0.15 # Closer than this to an existing template = redundant
+OUTLIER_TEMPLATE_DISTANCE = 0.6 # Farther than this from the centroid = probably someone else
+SHORTLIST_SIZE = 5
+SHORTLIST_MARGIN = 0.15 # Centroid distance slack before exact template check
+
+# Detection pipeline, tuned per endpoint.
+# min_face_fraction: smallest face we need to find, as a fraction of the image's shorter side
+# target_face_px: size that smallest face is scaled down to before detection
+#   (HOG finds faces from ~80px; each upsample halves that)
+# Override with env vars, e.g. DETECTION_KIOSK_MODEL=cnn or DETECTION_LIVE_UPSAMPLE=2
+DETECTION_PROFILES = {
+    # Kiosk: one person standing close to the camera
+    "kiosk": {"model": "hog", "upsample": 0, "min_face_fraction": 0.2, "target_face_px": 80, "min_face_px": 60},
+    # Live classroom: many small faces across the room
+    "live": {"model": "hog", "upsample": 1, "min_face_fraction": 0.05, "target_face_px": 40, "min_face_px": 30},
+    # 1:1 verification: selfie from the student's phone
+    "verify": {"model": "hog", "upsample": 0, "min_face_fraction": 0.25, "target_face_px": 80, "min_face_px": 60},
+    # Enrollment: portrait photos, accuracy over speed
+    "enrollment": {"model": "hog", "upsample": 1, "min_face_fraction": 0.15, "target_face_px": 60, "min_face_px": 80},
+}
+ENCODE_MAX_FACE_PX = 300 # Face crops larger than this are shrunk before encoding
+
+# Face-quality gate, applied between detection and the (expensive) encoder
+FACE_QUALITY_GATE = os.getenv("FACE_QUALITY_GATE", "1") == "1"
+QUALITY_SAMPLE_PX = 100 # Face crop is normalised to this size before blur/brightness checks
+BLUR_MIN_VARIANCE = float(os.getenv("FACE_BLUR_MIN_VARIANCE", "35"))
+BRIGHTNESS_MIN = 40
+BRIGHTNESS_MAX = 220
+MAX_YAW_RATIO = 0.35 # Nose offset from the eye midpoint, relative to eye distance
+
+QUALITY_MESSAGES = {
+    "face_too_small": "Face is too small. Please move closer to the camera.",
+    "too_dark": "Face is too dark. Please improve the lighting.",
+    "too_bright": "Face is overexposed. Please avoid direct light.",
+    "too_blurry": "Image is blurry. Please hold still.",
+    "pose_not_frontal": "Please look straight at the camera.",
+}
+
+class FaceQualityError(Exception):
     """
-    Loads all user encodings from the database into the global cache.
-    Should be called on startup or periodically.
+    Raised when a detected face is too poor to be worth encoding.
+    reason is one of the QUALITY_MESSAGES keys.
+    """
+    def __init__(self, reason):
+        super().__init__(QUALITY_MESSAGES.get(reason, reason))
+        self.reason = reason
+
+for _profile, _settings in DETECTION_PROFILES.items():
+    for _key, _default in list(_settings.items()):
+        _value = os.getenv(f"DETECTION_{_profile.upper()}_{_key.upper()}")
+        if _value is not None:
+            _settings[_key] = type(_default)(_value)
+
+def templates_from_bytes(block):
+    if not block:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32)
+    return np.frombuffer(block, dtype=np.float32).reshape(-1, ENCODING_DIM)
+
+def templates_to_bytes(templates) -> bytes:
+    return np.ascontiguousarray(templates, dtype=np.float32).tobytes()
+
+def decode_templates(face_encoding, face_templates):
+    if face_templates:
+        return templates_from_bytes(face_templates)
+    # Legacy single-encoding user: JSON string "[0.1, 0.2, ...]"
+    return np.asarray(json.loads(face_encoding), dtype=np.float32).reshape(1, ENCODING_DIM)
+
+def merge_template(templates, new_encoding):
+    """
+    Adds one encoding to a user's template block.
+    Returns (templates, centroid, status) where status is
+    "added", "duplicate" (near-identical template already enrolled, block unchanged)
+    or "outlier" (too far from the user's centroid, block unchanged).
+    """
+    templates = np.asarray(templates, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    new_encoding = np.asarray(new_encoding, dtype=np.float32)
+
+    if len(templates) > 0:
+        centroid = templates.mean(axis=0)
+        distances = np.linalg.norm(templates - new_encoding, axis=1)
+        if distances.min() < DUPLICATE_TEMPLATE_DISTANCE:
+            return templates, centroid, "duplicate"
+        if len(templates) >= 2 and np.linalg.norm(centroid - new_encoding) > OUTLIER_TEMPLATE_DISTANCE:
+            return templates, centroid, "outlier"
+
+    templates = np.vstack([templates, new_encoding])
+    if len(templates) > MAX_TEMPLATES_PER_USER:
+        # Drop the most redundant template (closest to its nearest neighbour)
+        pairwise = np.linalg.norm(templates[:, None, :] - templates[None, :, :], axis=2)
+        np.fill_diagonal(pairwise, np.inf)
+        templates = np.delete(templates, int(pairwise.min(axis=1).argmin()), axis=0)
+    return templates, templates.mean(axis=0), "added"
+
+def enroll_template(user, new_encoding, replace=False):
+    """
+    Merges new_encoding into user's stored templates and refreshes the
+    centroid in face_encoding. Caller commits. Returns the merge status.
+    """
+    if replace:
+        existing = np.empty((0, ENCODING_DIM), dtype=np.float32)
+    elif user.face_templates:
+        existing = templates_from_bytes(user.face_templates)
+    elif user.face_encoding:
+        # Legacy single-encoding user
+        existing = np.asarray(json.loads(user.face_encoding), dtype=np.float32).reshape(1, ENCODING_DIM)
+    else:
+        existing = np.empty((0, ENCODING_DIM), dtype=np.float32)
+
+    templates, centroid, status = merge_template(existing, new_encoding)
+    if status == "added":
+        user.face_templates = templates_to_bytes(templates)
+        user.face_encoding = json.dumps(centroid.tolist())
+        user.face_updated_at = datetime.utcnow()
+    return status
+
+def set_known_face(user_id, templates):
+    """
+    Updates this process's gallery after an enrollment has been committed.
+    """
+    global _GALLERY_IDS
+    if not KNOWN_FACES_LOADED:
+        return # The first load will pick it up
+    templates = np.asarray(templates, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    if len(templates) == 0:
+        return
+    if _compact_gallery():
+        KNOWN_FACES_CACHE.set(user_id, templates)
+        return
+    with _gallery_lock:
+        KNOWN_TEMPLATES_CACHE[user_id] = templates
+        KNOWN_FACES_CACHE[user_id] = templates.mean(axis=0)
+        _GALLERY_IDS = None
+
+def drop_known_face(user_id):
+    global _GALLERY_IDS
+    if _compact_gallery():
+        KNOWN_FACES_CACHE.drop(user_id)
+        return
+    with _gallery_lock:
+        if KNOWN_FACES_CACHE.pop(user_id, None) is not None:
+            KNOWN_TEMPLATES_CACHE.pop(user_id, None)
+            _GALLERY_IDS = None
+
+def _compact_gallery():
+    return not isinstance(KNOWN_FACES_CACHE, dict)
+
+def _read_templates(user_ids):
+    """
+    { user_id: templates } straight from the DB, for the compact gallery's re-rank.
+    """
+    import database
+    from sqlalchemy import select
+    from models import User
+    with database.engine.connect() as conn:
+        rows = conn.execute(select(User.id, User.face_encoding, User.face_templates).where(
+            User.id.in_(list(user_ids)), User.face_encoding.isnot(None))).all()
+    return {user_id: decode_templates(face_encoding, face_templates) for user_id, face_encoding, face_templates in rows}
+
+def _gallery_matrix():
+    global _GALLERY_IDS, _GALLERY_CENTROIDS
+    with _gallery_lock:
+        if _GALLERY_IDS is None:
+            _GALLERY_CENTROIDS = np.array(list(KNOWN_FACES_CACHE.values()), dtype=np.float32).reshape(-1, ENCODING_DIM)
+            _GALLERY_IDS = list(KNOWN_FACES_CACHE.keys())
+        return _GALLERY_IDS, _GALLERY_CENTROIDS
+
+class Gallery:
+    """
+    A gallery of its own, e.g. one class's roster (see load_gallery), for
+    match_encodings(gallery=...) without touching this process's gallery.
+    """
+    __slots__ = ("ids", "centroids", "templates")
+
+    def __init__(self, ids, centroids, templates):
+        self.ids = ids # user ids, in centroid row order
+        self.centroids = centroids # (n, 128) float32
+        self.templates = templates # { user_id: (k, 128) float32 }
+
+    def __len__(self):
+        return len(self.ids)
+
+def match_encodings(unknown_encodings, tolerance=MATCH_TOLERANCE, gallery=None):
+    """
+    Two-stage match for a batch of probes: centroid distances for everyone
+    (one matrix product for the whole batch), then exact template distances
+    for each probe's shortlisted users only.
+    gallery: a Gallery to match against instead of this process's gallery.
+    Returns a list of (user_id, distance) or (None, None), one per probe.
+    """
+    unknowns = np.asarray(unknown_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    if gallery is not None:
+        return _match_exact(unknowns, gallery.ids, gallery.centroids, gallery.templates, tolerance)
+    if _compact_gallery():
+        return _match_compact(KNOWN_FACES_CACHE, unknowns, tolerance)
+    ids, centroids = _gallery_matrix()
+    return _match_exact(unknowns, ids, centroids, KNOWN_TEMPLATES_CACHE, tolerance)
+
+def _match_exact(unknowns, ids, centroids, known_templates, tolerance):
+    if not len(ids) or len(unknowns) == 0:
+        return [(None, None)] * len(unknowns)
+
+    if len(unknowns) == 1:
+        centroid_distances = np.linalg.norm(centroids - unknowns[0], axis=1)[None, :]
+    else:
+        # |a-b|^2 = |a|^2 + |b|^2 - 2ab, so the batch costs one GEMM
+        squared = ((unknowns ** 2).sum(axis=1)[:, None] + (centroids ** 2).sum(axis=1)[None, :]
+                   - 2.0 * unknowns @ centroids.T)
+        centroid_distances = np.sqrt(np.maximum(squared, 0.0))
+    k = min(SHORTLIST_SIZE, len(ids))
+    shortlists = np.argpartition(centroid_distances, k - 1, axis=1)[:, :k]
+
+    results = []
+    for unknown, row, shortlist in zip(unknowns, centroid_distances, shortlists):
+        best_id, best_distance = None, None
+        for i in shortlist:
+            if row[i] > tolerance + SHORTLIST_MARGIN:
+                continue
+            user_id = ids[i]
+            templates = known_templates.get(user_id)
+            if templates is None or len(templates) == 0:
+                distance = float(row[i])
+            else:
+                distance = float(np.linalg.norm(templates - unknown, axis=1).min())
+            if distance <= tolerance and (best_distance is None or distance < best_distance):
+                best_id, best_distance = user_id, distance
+        results.append((best_id, best_distance))
+    return results
+
+def _match_compact(gallery, unknowns, tolerance):
+    """
+    match_encodings on a CompactGallery: the shortlist comes from the
+    quantized centroids, then every shortlisted user of the batch is
+    re-ranked on exact float32 templates fetched in one go.
+    """
+    if not len(gallery) or len(unknowns) == 0:
+        return [(None, None)] * len(unknowns)
+    shortlist_ids, approx = gallery.scan(unknowns, SHORTLIST_SIZE)
+    near = (shortlist_ids >= 0) & (approx <= tolerance + SHORTLIST_MARGIN)
+    templates = gallery.templates({int(user_id) for user_id in shortlist_ids[near]})
+
+    results = []
+    for unknown, row_ids, row_near in zip(unknowns, shortlist_ids, near):
+        best_id, best_distance = None, None
+        for user_id in row_ids[row_near]:
+            user_templates = templates.get(int(user_id))
+            if user_templates is None:
+                continue # Face removed since the scan
+            distance = float(np.linalg.norm(user_templates - unknown, axis=1).min())
+            if distance <= tolerance and (best_distance is None or distance < best_distance):
+                best_id, best_distance = int(user_id), distance
+        results.append((best_id, best_distance))
+    return results
+
+def match_encoding(unknown_encoding, tolerance=MATCH_TOLERANCE, gallery=None):
+    """
+    Matches a single probe. Returns (user_id, distance) or (None, None).
+    """
+    return match_encodings([unknown_encoding], tolerance, gallery)[0]
+
+def _read_faces(db_session, user_ids=None, keep_templates=True):
+    """
+    Returns ({ user_id: centroid }, { user_id: templates }) for enrolled users,
+    all of them or only user_ids. keep_templates=False leaves the second empty.
     """
-    global KNOWN_FACES_CACHE, KNOWN_FACES_LOADED
-    
     # Avoid circular import
     from models import User
     
-    users = db_session.query(User).filter(User.face_encoding.isnot(None)).all()
-    
-    count = 0
-    temp_cache = {}
+    # Only the columns we need, not full ORM objects
+    query = db_session.query(User.id, User.face_encoding, User.face_templates).filter(
+        User.face_encoding.isnot(None)
+    )
+    if user_ids is not None:
+        query = query.filter(User.id.in_(list(user_ids)))
     
-    for user in users:
+    centroids = {}
+    per_user = {}
+    for user_id, face_encoding, face_templates in query.all():
         try:
-            # encoding is stored as a JSON string "[0.1, 0.2, ...]"
-            if user.face_encoding:
-                encoding_list = json.loads(user.face_encoding)
-                temp_cache[user.id] = np.array(encoding_list)
-                count += 1
+            templates = decode_templates(face_encoding, face_templates)
+            if keep_templates:
+                per_user[user_id] = templates
+            centroids[user_id] = templates.mean(axis=0)
         except Exception as e:
-            print(f"Error loading encoding for user {user.id}: {e}")
+            print(f"Error loading encoding for user {user_id}: {e}")
+    return centroids, per_user
+
+def load_gallery(db_session, user_ids=None):
+    """
+    Builds a Gallery of the given users (all enrolled users if None), e.g.
+    a class roster. This process's gallery is left as it is.
+    """
+    centroids, per_user = _read_faces(db_session, user_ids)
+    return Gallery(list(centroids), np.array(list(centroids.values()), dtype=np.float32).reshape(-1, ENCODING_DIM), per_user)
+
+def load_known_faces(db_session):
+    """
+    Loads all user encodings from the database into the global cache.
+    Should be called on startup or periodically.
+    For a subset of users (e.g. one class) use load_gallery instead.
+    """
+    global KNOWN_FACES_CACHE, KNOWN_TEMPLATES_CACHE, KNOWN_FACES_LOADED, _GALLERY_IDS
+    
+    compact = GALLERY_MODE != "float32"
+    temp_cache, temp_templates = _read_faces(db_session, keep_templates=not compact)
+    count = len(temp_cache)
+
+    if compact:
+        import compact_gallery
+        gallery = compact_gallery.CompactGallery(GALLERY_MODE, _read_templates, GALLERY_RERANK_CACHE)
+        gallery.load(list(temp_cache), np.array(list(temp_cache.values()), dtype=np.float32).reshape(-1, ENCODING_DIM))
+        temp_cache, temp_templates = gallery, {}
             
-    KNOWN_FACES_CACHE = temp_cache
-    KNOWN_FACES_LOADED = True
+    with _gallery_lock:
+        KNOWN_FACES_CACHE = temp_cache
+        KNOWN_TEMPLATES_CACHE = temp_templates
+        KNOWN_FACES_LOADED = True
+        _GALLERY_IDS = None
+    metrics.set_gauge("gallery_faces", count, help_text="Face encodings held in memory")
     print(f"[INFO] Loaded {count} face encodings into memory.")
 
-def get_face_encoding(image_path: str):
+def detection_scale(image_shape, settings) -> float:
+    """
+    Downscale factor that brings the smallest face of interest to target_face_px.
+    """
+    smallest_face = settings["min_face_fraction"] * min(image_shape[:2])
+    if smallest_face <= 0:
+        return 1.0
+    return min(1.0, settings["target_face_px"] / smallest_face)
+
+def detect_faces(image, profile="kiosk"):
+    """
+    Detects faces on a downsampled copy of the image.
+    Returns boxes (top, right, bottom, left) in full-resolution coordinates,
+    largest face first.
+    """
+    settings = DETECTION_PROFILES[profile]
+    scale = detection_scale(image.shape, settings)
+    small = image
+    if scale < 1.0:
+        small = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    boxes = face_recognition.face_locations(
+        small, number_of_times_to_upsample=settings["upsample"], model=settings["model"]
+    )
+
+    height, width = image.shape[:2]
+    full_boxes = [
+        (max(0, int(top / scale)), min(width, int(right / scale)),
+         min(height, int(bottom / scale)), max(0, int(left / scale)))
+        for top, right, bottom, left in boxes
+    ]
+    full_boxes.sort(key=lambda b: (b[2] - b[0]) * (b[1] - b[3]), reverse=True)
+    return full_boxes
+
+def face_crop(image, box):
+    """
+    Padded crop around one face box, shrunk to ENCODE_MAX_FACE_PX.
+    Returns (crop, box in crop coordinates).
+    """
+    height, width = image.shape[:2]
+    top, right, bottom, left = box
+    # Landmarks (chin, brows) can sit slightly outside the detector box
+    pad = max(1, (bottom - top) // 4)
+    y0, y1 = max(0, top - pad), min(height, bottom + pad)
+    x0, x1 = max(0, left - pad), min(width, right + pad)
+    crop = image[y0:y1, x0:x1]
+    local_box = (top - y0, right - x0, bottom - y0, left - x0)
+
+    face_px = bottom - top
+    if face_px > ENCODE_MAX_FACE_PX:
+        s = ENCODE_MAX_FACE_PX / face_px
+        crop = cv2.resize(crop, (0, 0), fx=s, fy=s, interpolation=cv2.INTER_AREA)
+        local_box = tuple(int(v * s) for v in local_box)
+    return np.ascontiguousarray(crop), local_box
+
+def encode_crops(crops):
+    """
+    Encodes a list of (crop, box) pairs, from any number of frames.
+    Uses dlib's batched descriptor call (one pass through the ResNet for the
+    whole list) when available. Returns one encoding or None per crop.
+    """
+    if not crops:
+        return []
+    api = getattr(face_recognition, "api", None)
+    if len(crops) > 1 and api is not None and hasattr(api, "face_encoder"):
+        try:
+            import dlib
+            images, shape_sets = [], []
+            for crop, (top, right, bottom, left) in crops:
+                shapes = dlib.full_object_detections()
+                shapes.append(api.pose_predictor_5_point(crop, dlib.rectangle(left, top, right, bottom)))
+                images.append(crop)
+                shape_sets.append(shapes)
+            descriptors = api.face_encoder.compute_face_descriptor(images, shape_sets, 1)
+            return [np.array(d[0]) for d in descriptors]
+        except Exception as e:
+            print(f"[WARN] Batched encoding failed, encoding one by one: {e}")
+
+    encodings = []
+    for crop, box in crops:
+        found = face_recognition.face_encodings(crop, [box])
+        encodings.append(found[0] if found else None)
+    return encodings
+
+def encode_faces(image, boxes):
+    """
+    Encodes each face from a padded crop around its box instead of the full frame.
+    """
+    encodings = encode_crops([face_crop(image, box) for box in boxes])
+    return [e for e in encodings if e is not None]
+
+def check_face_quality(image, box, profile="kiosk"):
+    """
+    Cheap checks on a detected face before encoding it.
+    Returns None if the face is good enough, otherwise a reason code.
+    """
+    top, right, bottom, left = box
+    if min(bottom - top, right - left) < DETECTION_PROFILES[profile]["min_face_px"]:
+        return "face_too_small"
+
+    crop = image[top:bottom, left:right]
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+    gray = cv2.resize(gray, (QUALITY_SAMPLE_PX, QUALITY_SAMPLE_PX), interpolation=cv2.INTER_AREA)
+
+    brightness = gray.mean()
+    if brightness < BRIGHTNESS_MIN:
+        return "too_dark"
+    if brightness > BRIGHTNESS_MAX:
+        return "too_bright"
+    if cv2.Laplacian(gray, cv2.CV_64F).var() < BLUR_MIN_VARIANCE:
+        return "too_blurry"
+
+    # 5-point landmarks are cheap; a nose far off the eye midline means a profile view
+    landmarks = face_recognition.face_landmarks(image, [box], model="small")
+    if landmarks:
+        points = landmarks[0]
+        left_eye = np.mean(points["left_eye"], axis=0)
+        right_eye = np.mean(points["right_eye"], axis=0)
+        nose = np.mean(points["nose_tip"], axis=0)
+        eye_distance = np.linalg.norm(left_eye - right_eye)
+        if eye_distance > 0 and abs(nose[0] - (left_eye[0] + right_eye[0]) / 2) / eye_distance > MAX_YAW_RATIO:
+            return "pose_not_frontal"
+    return None
+
+def gate_face(image, box, profile):
+    if not FACE_QUALITY_GATE:
+        return
+    with metrics.stage("quality"):
+        reason = check_face_quality(image, box, profile)
+    if reason:
+        metrics.inc("face_quality_rejections_total", {"reason": reason, "profile": profile},
+                    help_text="Faces rejected before encoding")
+        raise FaceQualityError(reason)
+
+def _read_bytes(image_path):
+    with open(image_path, "rb") as f:
+        return f.read()
+
+def _remote_call(action, image_bytes, **params):
+    """
+    Forwards one recognition call to the recognition service (VISION_MODE=remote).
+    Returns the decoded JSON body, or None if the service could not be reached.
+    Raises FaceQualityError when the service rejected the face.
+    """
+    import recognition_client
+    try:
+        with metrics.stage("remote"):
+            status, body = recognition_client.post_image(action, image_bytes, **params)
+        if status == 200:
+            return body
+        if status == 422:
+            raise FaceQualityError((body.get("detail") or {}).get("reason", "unknown"))
+        print(f"[ERROR] Recognition service returned {status} for {action}")
+    except (OSError, http.client.HTTPException) as e:
+        print(f"[ERROR] Recognition service unreachable ({action}): {e}")
+    metrics.inc("recognition_service_errors_total", {"action": action},
+                help_text="Failed calls to the remote recognition service")
+    return None
+
+@profiler.profiled("get_face_encoding")
+def get_face_encoding(image_path: str, profile="enrollment"):
     """
-    Given an image path, returns the list of 128-float face encoding.
+    Given an image path (or file-like object), returns the list of 128-float
+    face encoding, or None if no face was found.
+    Raises FaceQualityError if the face is too poor to enroll.
     """
-    if REAL_RECOGNITION_AVAILABLE:
+    if VISION_MODE == "remote":
+        image_bytes = image_path.read() if hasattr(image_path, "read") else _read_bytes(image_path)
+        result = _remote_call("encode", image_bytes, profile=profile)
+        return result.get("encoding") if result else None
+
+    if load_vision():
         try:
-            image = face_recognition.load_image_file(image_path)
-            encodings = face_recognition.face_encodings(image)
+            with metrics.stage("decode"):
+                image = face_recognition.load_image_file(image_path)
+            with metrics.stage("detect"):
+                locations = detect_faces(image, profile)
+            if not locations:
+                return None
+            gate_face(image, locations[0], profile)
+            with metrics.stage("encode"):
+                encodings = encode_faces(image, locations[:1])
             if len(encodings) > 0:
                 return encodings[0].tolist()
+        except FaceQualityError:
+            raise
         except Exception as e:
             print(f"Error in face recognition: {e}")
-            pass
+        return None
 
-    # Mock Fallback if library fails or not installed
+    # Mock Fallback if library not installed
     return [0.1] * 128
 
-def recognize_face(unknown_image_path: str, db_session=None):
+@profiler.profiled("recognize_face")
+def recognize_face(unknown_image_path: str, db_session=None, profile="kiosk"):
     """
-    Recognizes a face from an image path.
+    Recognizes a face from an image path (or file-like object).
+    profile selects the detection settings (see DETECTION_PROFILES).
     Returns: user_id (int) or None
+    Raises FaceQualityError if the face is too poor to be worth encoding.
     """
+    if VISION_MODE == "remote":
+        image_bytes = unknown_image_path.read() if hasattr(unknown_image_path, "read") else _read_bytes(unknown_image_path)
+        result = _remote_call("recognize", image_bytes, profile=profile)
+        return result.get("user_id") if result else None
+
+    load_vision()
     # Auto-load cache if needed and DB session provided
     global KNOWN_FACES_LOADED
     if not KNOWN_FACES_LOADED and db_session:
@@ -90,23 +623,27 @@ def recognize_face(unknown_image_path: str, db_session=None):
     if REAL_RECOGNITION_AVAILABLE and KNOWN_FACES_CACHE:
         try:
             # Load the unknown image
-            unknown_image = face_recognition.load_image_file(unknown_image_path)
-            unknown_encodings = face_recognition.face_encodings(unknown_image)
+            with metrics.stage("decode"):
+                unknown_image = face_recognition.load_image_file(unknown_image_path)
+            with metrics.stage("detect"):
+                unknown_locations = detect_faces(unknown_image, profile)
+            if unknown_locations:
+                gate_face(unknown_image, unknown_locations[0], profile)
+            with metrics.stage("encode"):
+                # Only the largest (closest) face is matched
+                unknown_encodings = encode_faces(unknown_image, unknown_locations[:1])
             
             if len(unknown_encodings) > 0:
                 unknown_encoding = unknown_encodings[0]
                 
-                # Prepare lists for comparison
-                known_ids = list(KNOWN_FACES_CACHE.keys())
-                known_encodings = list(KNOWN_FACES_CACHE.values())
-                
-                # Strict tolerance 0.5 for high accuracy
-                matches = face_recognition.compare_faces(known_encodings, unknown_encoding, tolerance=0.5)
-                
-                if True in matches:
-                    first_match_index = matches.index(True)
-                    detected_user_id = known_ids[first_match_index]
+                with metrics.stage("match"):
+                    # Strict tolerance 0.5 for high accuracy
+                    detected_user_id, _ = match_encoding(unknown_encoding, MATCH_TOLERANCE)
+            metrics.inc("recognition_total", {"result": "match" if detected_user_id else "no_match"},
+                        help_text="Recognition attempts by outcome")
                     
+        except FaceQualityError:
+            raise
         except Exception as e:
             print(f"Error in recognize_face: {e}")
 
@@ -118,3 +655,163 @@ def recognize_face(unknown_image_path: str, db_session=None):
              return random.choice(list(KNOWN_FACES_CACHE.keys()))
     
     return detected_user_id
+
+def user_templates(user_id, db_session=None):
+    """
+    Returns the user's decoded templates from the gallery. Users enrolled
+    since the gallery was loaded are read from their row and cached.
+    """
+    if _compact_gallery() and user_id in KNOWN_FACES_CACHE:
+        return KNOWN_FACES_CACHE.templates([user_id]).get(user_id)
+    templates = KNOWN_TEMPLATES_CACHE.get(user_id)
+    if templates is not None or db_session is None:
+        return templates
+    return reload_known_face(db_session, user_id)
+
+def reload_known_face(db_session, user_id):
+    """
+    Re-reads one user's templates from the DB into the gallery.
+    Returns the templates, or None if the user has no enrolled face.
+    """
+    return reload_known_faces(db_session, [user_id]).get(user_id)
+
+def reload_known_faces(db_session, user_ids):
+    """
+    Gallery delta: re-reads the given users in one query. Users without an
+    enrolled face (or deleted) are dropped. Returns { user_id: templates }.
+    """
+    from models import User
+    user_ids = list(user_ids)
+    rows = db_session.query(User.id, User.face_encoding, User.face_templates).filter(
+        User.id.in_(user_ids), User.face_encoding.isnot(None)
+    ).all() if user_ids else []
+    loaded = {}
+    for user_id, face_encoding, face_templates in rows:
+        templates = decode_templates(face_encoding, face_templates)
+        set_known_face(user_id, templates)
+        loaded[user_id] = templates
+    for user_id in user_ids:
+        if user_id not in loaded:
+            drop_known_face(user_id)
+    if KNOWN_FACES_LOADED:
+        metrics.set_gauge("gallery_faces", len(KNOWN_FACES_CACHE), help_text="Face encodings held in memory")
+    return loaded
+
+@profiler.profiled("verify_face")
+def verify_face(image_bytes: bytes, user_id: int, db_session=None, tolerance=MATCH_TOLERANCE, profile="verify"):
+    """
+    1:1 verification: does the (largest) face in image_bytes belong to user_id?
+    Costs one encode and one distance computation against the user's templates.
+    Returns (matched: bool, distance or None).
+    Raises FaceQualityError if the face is too poor to be worth encoding.
+    """
+    if VISION_MODE == "remote":
+        result = _remote_call("verify", image_bytes, user_id=user_id, tolerance=tolerance, profile=profile)
+        if not result:
+            return False, None
+        return result["matched"], result["distance"]
+
+    if not KNOWN_FACES_LOADED and db_session:
+        load_known_faces(db_session)
+    templates = user_templates(user_id, db_session)
+    if templates is None or len(templates) == 0:
+        return False, None
+
+    if not load_vision():
+        # Mock mode: any upload verifies
+        return True, 0.0
+
+    try:
+        with metrics.stage("decode"):
+            image = face_recognition.load_image_file(io.BytesIO(image_bytes))
+        with metrics.stage("detect"):
+            locations = detect_faces(image, profile)
+        if not locations:
+            return False, None
+        gate_face(image, locations[0], profile)
+        with metrics.stage("encode"):
+            # Stop after the first face; the rest of the frame is irrelevant for 1:1
+            encodings = encode_faces(image, locations[:1])
+        if not encodings:
+            return False, None
+        with metrics.stage("match"):
+            distance = float(np.linalg.norm(templates - np.asarray(encodings[0], dtype=np.float32), axis=1).min())
+    except FaceQualityError:
+        raise
+    except Exception as e:
+        print(f"Error in verify_face: {e}")
+        return False, None
+
+    matched = distance <= tolerance
+    metrics.inc("verification_total", {"result": "match" if matched else "no_match"},
+                help_text="1:1 verification attempts by outcome")
+    return matched, distance
+
+def remote_ready() -> bool:
+    """True if the recognition service answers its readiness probe."""
+    import recognition_client
+    return recognition_client.ready()
+
+def refresh_remote_face(user_id):
+    """
+    Tells the recognition service to reload one user's templates after an
+    enrollment was committed. No-op unless VISION_MODE=remote.
+    """
+    if VISION_MODE == "remote":
+        _remote_call("refresh", b"", user_id=user_id)
+
+def _wait_for_remote(attempts=30, interval=2.0) -> bool:
+    for attempt in range(attempts):
+        if remote_ready():
+            return True
+        if attempt < attempts - 1:
+            time.sleep(interval)
+    return False
+
+# Warm-up / readiness state, reported by /health/ready
+WARMUP_STATE = {"ready": False, "started_at": None, "finished_at": None, "stages": {}, "error": None}
+
+def warm_up(db_session):
+    """
+    Pays the first-request costs up front: face model weights, the gallery
+    and one synthetic inference through detect + landmarks + encoder.
+    With VISION_MODE=remote nothing is loaded; the worker is ready once the
+    recognition service is.
+    Marks the worker ready when done.
+    """
+    WARMUP_STATE.update(ready=False, started_at=time.time(), finished_at=None, stages={}, error=None)
+    try:
+        if VISION_MODE == "remote":
+            start = time.perf_counter()
+            if not _wait_for_remote():
+                raise RuntimeError("recognition service is not ready")
+            WARMUP_STATE["stages"]["remote_seconds"] = round(time.perf_counter() - start, 3)
+        else:
+            start = time.perf_counter()
+            vision = load_vision()
+            WARMUP_STATE["stages"]["import_seconds"] = round(time.perf_counter() - start, 3)
+
+            start = time.perf_counter()
+            load_known_faces(db_session)
+            WARMUP_STATE["stages"]["gallery_seconds"] = round(time.perf_counter() - start, 3)
+
+            if vision:
+                # Synthetic frame: runs the HOG detector, the 5/68-point predictors
+                # and the ResNet encoder once so weights are paged in and BLAS is initialised
+                start = time.perf_counter()
+                frame = np.tile(np.linspace(0, 255, 200, dtype=np.uint8), (200, 1))
+                frame = np.ascontiguousarray(np.stack([frame] * 3, axis=2))
+                box = (40, 160, 160, 40)
+                face_recognition.face_locations(frame, number_of_times_to_upsample=0)
+                face_recognition.face_landmarks(frame, [box], model="small")
+                face_recognition.face_encodings(frame, [box])
+                WARMUP_STATE["stages"]["inference_seconds"] = round(time.perf_counter() - start, 3)
+
+        WARMUP_STATE["ready"] = True
+    except Exception as e:
+        WARMUP_STATE["error"] = str(e)
+        print(f"[ERROR] Warm-up failed: {e}")
+    finally:
+        WARMUP_STATE["finished_at"] = time.time()
+    print(f"[INFO] Warm-up finished (ready={WARMUP_STATE['ready']}): {WARMUP_STATE['stages']}")
+    return WARMUP_STATE["ready"]
@@ -0,0 +1,266 @@
+"""
+Offline attendance from a recorded lecture video.
+
+The video is streamed frame by frame; only sampled frames are decoded into
+images and at most a few are in flight at once, so memory stays flat for
+any length of recording. Sampling adapts to the scene: while the picture
+barely changes the interval doubles (up to --max-interval), and it drops
+back to --sample-every as soon as something moves. Detection and encoding
+run across a process pool; matching, aggregation and the DB write happen
+here.
+
+Each matched sample credits the time since the previous sample to the
+student. Students whose total dwell reaches --min-dwell are marked present
+for the subject on the given date (one bulk insert; students who already
+have a record that day are left alone).
+
+Usage (from backend/):
+    python video_attendance.py lecture.mp4 --subject-code CS101 --date 2025-03-14 --workers 8
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, date as date_cls
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+import numpy as np
+
+# Ensure we can import from backend
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+SIGNATURE_SIZE = 32
+
+
+def _init_worker():
+    import utils
+    # One OpenCV thread per process; the pool already uses every core
+    cv2.setNumThreads(1)
+    utils.load_vision()
+
+
+def encode_frame(frame, profile):
+    """
+    Worker: returns the encodings of every usable face in one BGR frame.
+    """
+    import utils
+    if not utils.load_vision():
+        return []
+    image = np.ascontiguousarray(frame[:, :, ::-1])
+    boxes = utils.detect_faces(image, profile)
+    # Blurry / tiny / side-on faces would only produce unreliable matches
+    boxes = [box for box in boxes if utils.check_face_quality(image, box, profile) is None]
+    return [np.asarray(e, dtype=np.float32) for e in utils.encode_faces(image, boxes)]
+
+
+def scene_signature(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def sample_frames(path, sample_every, max_interval, still_threshold):
+    """
+    Yields (timestamp, credited_seconds, frame) for the sampled frames only.
+    Skipped frames are grabbed but never converted to images.
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    interval = sample_every
+    index, next_index, last_time, last_sig = 0, 0, 0.0, None
+    try:
+        while True:
+            if index < next_index:
+                if not cap.grab():
+                    return
+                index += 1
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                return
+            timestamp = index / fps
+            sig = scene_signature(frame)
+            if last_sig is not None and np.abs(sig - last_sig).mean() < still_threshold:
+                interval = min(interval * 2, max_interval)
+            else:
+                interval = sample_every
+            last_sig = sig
+            yield timestamp, timestamp - last_time, frame
+            last_time = timestamp
+            index += 1
+            next_index = index + max(0, int(round(interval * fps)) - 1)
+    finally:
+        cap.release()
+
+
+class SessionTally:
+    """
+    Per-student sightings over the whole recording.
+    """
+
+    def __init__(self):
+        self.dwell = {}  # user_id -> seconds
+        self.samples = {}
+        self.first_seen = {}
+        self.last_seen = {}
+
+    def add(self, user_id, timestamp, credited):
+        self.dwell[user_id] = self.dwell.get(user_id, 0.0) + credited
+        self.samples[user_id] = self.samples.get(user_id, 0) + 1
+        self.first_seen[user_id] = min(self.first_seen.get(user_id, timestamp), timestamp)
+        self.last_seen[user_id] = max(self.last_seen.get(user_id, timestamp), timestamp)
+
+    def present(self, min_dwell):
+        return {uid for uid, seconds in self.dwell.items() if seconds >= min_dwell}
+
+
+def process_video(path, subject_id=None, subject_code=None, day=None, workers=None, profile="live",
+                  sample_every=1.0, max_interval=8.0, still_threshold=2.0, min_dwell=300.0,
+                  mark_absent=False, dry_run=False, summary_path=None):
+    from database import SessionLocal, engine, add_missing_columns
+    from models import Base, Subject, StudentCourse, Attendance
+    import utils
+    import rollups
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(Base)
+
+    db = SessionLocal()
+    try:
+        query = db.query(Subject)
+        subject = (query.filter(Subject.id == subject_id) if subject_id else query.filter(Subject.code == subject_code)).first()
+        if not subject:
+            print("[ERROR] Subject not found")
+            return None
+        day = day or date_cls.today()
+
+        # Match against the class roster when there is one; fewer candidates, fewer false matches
+        roster = {sid for (sid,) in db.query(StudentCourse.student_id).filter(StudentCourse.subject_id == subject.id).all()}
+        gallery = utils.load_gallery(db, roster or None)
+        if not len(gallery):
+            print("[ERROR] No enrolled faces to match against")
+            return None
+        print(f"[INFO] {subject.name}: matching against {len(gallery)} students")
+
+        started = time.time()
+        tally = SessionTally()
+        stats = {"frames_sampled": 0, "faces_encoded": 0, "faces_matched": 0, "video_seconds": 0.0}
+        workers = workers or os.cpu_count() or 1
+
+        def collect(future, timestamp, credited):
+            encodings = future.result()
+            stats["faces_encoded"] += len(encodings)
+            seen = set()
+            for user_id, _ in utils.match_encodings(encodings, gallery=gallery) if encodings else []:
+                if user_id is not None and user_id not in seen:
+                    seen.add(user_id)
+                    tally.add(user_id, timestamp, credited)
+            stats["faces_matched"] += len(seen)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            # Bounded in-flight frames keep memory flat however long the video is
+            in_flight = {}
+            max_in_flight = workers * 2
+            for timestamp, credited, frame in sample_frames(path, sample_every, max_interval, still_threshold):
+                stats["frames_sampled"] += 1
+                stats["video_seconds"] = timestamp
+                in_flight[pool.submit(encode_frame, frame, profile)] = (timestamp, credited)
+                if len(in_flight) >= max_in_flight:
+                    finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        collect(future, *in_flight.pop(future))
+                if stats["frames_sampled"] % 100 == 0:
+                    print(f"[PROGRESS] {timestamp / 60:.1f} min of video, {len(tally.dwell)} students seen")
+            for future in list(in_flight):
+                collect(future, *in_flight.pop(future))
+
+        present = tally.present(min_dwell)
+        absent = (roster - present) if mark_absent else set()
+
+        # One query for existing records, one bulk insert for the rest
+        start_of_day = datetime.combine(day, datetime.min.time())
+        end_of_day = datetime.combine(day, datetime.max.time())
+        already = {uid for (uid,) in db.query(Attendance.user_id).filter(
+            Attendance.subject_id == subject.id,
+            Attendance.date >= start_of_day,
+            Attendance.date <= end_of_day,
+            Attendance.user_id.in_(list(present | absent))
+        ).all()} if present or absent else set()
+        marked_at = datetime.combine(day, subject.start_time or datetime.min.time())
+        rows = [{"user_id": uid, "subject_id": subject.id, "date": marked_at, "status": "present"}
+                for uid in sorted(present - already)]
+        rows += [{"user_id": uid, "subject_id": subject.id, "date": marked_at, "status": "absent"}
+                 for uid in sorted(absent - already)]
+        if rows and not dry_run:
+            db.bulk_insert_mappings(Attendance, rows)
+            # Bulk inserts bypass the ORM hooks that maintain the rollups
+            rollups.apply(db.connection(), rows)
+            db.commit()
+
+        elapsed = time.time() - started
+        summary = {
+            "video": path,
+            "subject_id": subject.id,
+            "date": day.isoformat(),
+            "elapsed_seconds": round(elapsed, 2),
+            "realtime_factor": round(stats["video_seconds"] / elapsed, 2) if elapsed else None,
+            "workers": workers,
+            **{k: round(v, 1) if isinstance(v, float) else v for k, v in stats.items()},
+            "min_dwell_seconds": min_dwell,
+            "present": len(present),
+            "absent": len(absent),
+            "inserted": 0 if dry_run else len(rows),
+            "already_marked": len(already),
+            "students": [
+                {"user_id": uid, "dwell_seconds": round(tally.dwell[uid], 1), "samples": tally.samples[uid],
+                 "first_seen": round(tally.first_seen[uid], 1), "last_seen": round(tally.last_seen[uid], 1),
+                 "present": uid in present}
+                for uid in sorted(tally.dwell, key=tally.dwell.get, reverse=True)
+            ],
+        }
+    finally:
+        db.close()
+
+    if summary_path:
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    print(f"\n[DONE] {summary['present']} present, {summary['absent']} absent, {summary['inserted']} rows inserted. "
+          f"{summary['video_seconds'] / 60:.1f} min of video in {summary['elapsed_seconds']}s "
+          f"({summary['realtime_factor']}x real time)")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mark attendance from a lecture recording")
+    parser.add_argument("video")
+    parser.add_argument("--subject-id", type=int, default=None)
+    parser.add_argument("--subject-code", default=None)
+    parser.add_argument("--date", default=None, help="YYYY-MM-DD (default: today)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--profile", default="live", help="Detection profile from utils.DETECTION_PROFILES")
+    parser.add_argument("--sample-every", type=float, default=1.0, help="Seconds between samples while the scene changes")
+    parser.add_argument("--max-interval", type=float, default=8.0, help="Longest gap between samples in a still scene")
+    parser.add_argument("--still-threshold", type=float, default=2.0, help="Mean gray-level change below which the scene counts as still")
+    parser.add_argument("--min-dwell", type=float, default=300.0, help="Seconds a student must be seen to count as present")
+    parser.add_argument("--mark-absent", action="store_true", help="Also mark enrolled students who were not seen")
+    parser.add_argument("--dry-run", action="store_true", help="Report only, do not write attendance")
+    parser.add_argument("--summary", default=None, help="Write a JSON summary here")
+    args = parser.parse_args()
+
+    if not args.subject_id and not args.subject_code:
+        parser.error("--subject-id or --subject-code is required")
+
+    try:
+        process_video(
+            args.video, args.subject_id, args.subject_code,
+            datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None,
+            args.workers, args.profile, args.sample_every, args.max_interval, args.still_threshold,
+            args.min_dwell, args.mark_absent, args.dry_run, args.summary,
+        )
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"[FATAL ERROR] {e}")
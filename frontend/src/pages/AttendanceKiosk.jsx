@@ -56,8 +56,14 @@ export default function AttendanceKiosk() {
             const file = new File([blob], "kiosk_scan.jpg", { type: "image/jpeg" });
             const formData = new FormData();
             formData.append("file", file);
+            // Kiosk location (e.g. /kiosk?room=LAB-1) selects the class when sessions overlap
+            const params = new URLSearchParams(window.location.search);
+            const room = params.get('room');
+            if (room) formData.append("room", room);
+            // Edge agent on the kiosk itself (e.g. /kiosk?edge=http://localhost:8100) keeps working offline
+            const apiBase = params.get('edge') || 'http://localhost:8000';
 
-            const response = await axios.post('http://localhost:8000/attendance/auto-mark', formData);
+            const response = await axios.post(`${apiBase}/attendance/auto-mark`, formData);
 
             // Handle Response
             const data = response.data;
@@ -79,6 +85,10 @@ export default function AttendanceKiosk() {
             // We don't want to flash red for every empty frame
             if (error.response && (error.response.status === 404 || error.response.status === 400)) {
                 setStatus('idle'); // Silent fail for no face or no users
+            } else if (error.response && error.response.status === 422) {
+                // Face found but quality too low: show the hint and keep scanning
+                setStatus('idle');
+                setMessage(error.response.data?.detail?.message || 'Looking for faces...');
             } else {
                 console.error("Scan Error", error);
                 setStatus('error');
@@ -360,7 +360,7 @@ export default function TeacherDashboard() {
                                                             <td className="p-4 font-mono text-sm text-slate-400">#{stu.roll_number || 'N/A'}</td>
                                                             <td className="p-4 flex items-center gap-3">
                                                                 <div className="w-8 h-8 rounded-full bg-slate-800 flex items-center justify-center overflow-hidden">
-                                                                    {stu.image_url ? <img src={stu.image_url} className="w-full h-full object-cover" /> : stu.name.charAt(0)}
+                                                                    {stu.image_url ? <img src={stu.image_url.startsWith('/images/') ? `http://localhost:8000${stu.image_url}/thumb` : stu.image_url} className="w-full h-full object-cover" /> : stu.name.charAt(0)}
                                                                 </div>
                                                                 <span className="font-medium text-white">{stu.name}</span>
                                                             </td>
@@ -28,6 +28,11 @@ export default function StudentManager() {
     const [stream, setStream] = useState(null);
     const videoRef = useRef(null);
 
+    // Bulk Import State
+    const [importFile, setImportFile] = useState(null);
+    const [importPhotos, setImportPhotos] = useState(null);
+    const [importJob, setImportJob] = useState(null);
+
     useEffect(() => {
         fetchStudents();
         return () => {
@@ -244,6 +249,39 @@ export default function StudentManager() {
         }
     };
 
+    // Bulk Import: upload, then poll the job until it finishes
+    const handleImport = async (e) => {
+        e.preventDefault();
+        if (!importFile) return;
+        const formData = new FormData();
+        formData.append('file', importFile);
+        if (importPhotos) formData.append('photos', importPhotos);
+        try {
+            const res = await axios.post('http://localhost:8000/admin/users/import', formData, {
+                headers: { 'Content-Type': 'multipart/form-data' }
+            });
+            setImportJob(res.data);
+            pollImport(res.data.job_id);
+        } catch (err) {
+            setImportJob({ status: 'failed', message: err.response?.data?.detail || 'Import failed' });
+        }
+    };
+
+    const pollImport = (jobId) => {
+        const timer = setInterval(async () => {
+            try {
+                const res = await axios.get(`http://localhost:8000/admin/users/import/${jobId}`);
+                setImportJob(res.data);
+                if (res.data.status === 'done' || res.data.status === 'failed') {
+                    clearInterval(timer);
+                    fetchStudents();
+                }
+            } catch (err) {
+                clearInterval(timer);
+            }
+        }, 2000);
+    };
+
     return (
         <div className="p-6 bg-slate-900 rounded-xl border border-slate-800 shadow-xl relative">
             <h2 className="text-2xl font-bold text-white mb-6 flex items-center gap-2">
@@ -253,6 +291,41 @@ export default function StudentManager() {
                 Student Management
             </h2>
 
+            {/* Bulk Import */}
+            <div className="mb-8 bg-slate-950 p-6 rounded-xl border border-slate-800">
+                <h3 className="text-lg font-semibold text-slate-200 mb-1">Bulk Import</h3>
+                <p className="text-xs text-slate-500 mb-4">CSV or NDJSON with name, email, password, roll_number, department, course, year_semester and an optional photo column naming a file in the photos zip.</p>
+                <form onSubmit={handleImport} className="flex flex-wrap items-end gap-4">
+                    <div>
+                        <label className="block text-xs text-slate-400 mb-1">Users file (.csv / .ndjson)</label>
+                        <input type="file" accept=".csv,.ndjson,.jsonl" onChange={e => setImportFile(e.target.files[0])} className="text-sm text-slate-300" required />
+                    </div>
+                    <div>
+                        <label className="block text-xs text-slate-400 mb-1">Photos (.zip, optional)</label>
+                        <input type="file" accept=".zip" onChange={e => setImportPhotos(e.target.files[0])} className="text-sm text-slate-300" />
+                    </div>
+                    <button type="submit" disabled={importJob && (importJob.status === 'queued' || importJob.status === 'running')} className="px-4 py-2 bg-blue-600 hover:bg-blue-500 disabled:opacity-50 text-white text-sm rounded-lg flex items-center gap-2">
+                        <Upload className="w-4 h-4" /> Import
+                    </button>
+                </form>
+                {importJob && (
+                    <div className="mt-4 text-sm text-slate-300">
+                        <div>
+                            Status: <span className="font-semibold">{importJob.status}</span>
+                            {importJob.rows_read !== undefined && ` | ${importJob.rows_read} rows read, ${importJob.created} created, ${importJob.failed} failed`}
+                            {importJob.message && <span className="text-red-400"> | {importJob.message}</span>}
+                        </div>
+                        {importJob.errors && importJob.errors.length > 0 && (
+                            <ul className="mt-2 max-h-40 overflow-y-auto text-xs text-red-400 space-y-1">
+                                {importJob.errors.map((err, i) => (
+                                    <li key={i}>Line {err.line}{err.email ? ` (${err.email})` : ''}: {err.error}</li>
+                                ))}
+                            </ul>
+                        )}
+                    </div>
+                )}
+            </div>
+
             {/* Create / Edit Form */}
             <div className="mb-8 bg-slate-950 p-6 rounded-xl border border-slate-800">
                 <h3 className="text-lg font-semibold text-slate-200 mb-4">{editingId ? 'Edit Student' : 'Register New Student'}</h3>